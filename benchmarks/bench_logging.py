@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# Microbenchmark for the cost of logging on the read/write hot path.
+#
+# 'before' repeats the log statements write_pin and get_registered_pin used to make: the message is always built with
+# string concatenation and, since the module used to force the DEBUG level and a stdout handler, also printed
+# (here into os.devnull so the console stays readable). 'after' is the level gated lazy logging used now.
+#
+# Usage: python benchmarks/bench_logging.py [--board-id /dev/ttyUSB0 --board-type mega]
+
+import argparse
+import logging
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def per_call_ns(func, number):
+    """ Best of five runs, as nanoseconds per call """
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e9
+
+
+def bench_log_statements(number):
+    """ Measures only the log statements of a single write_pin call, old style and new style """
+    results = dict()
+    name = 'light'
+    value = 1
+
+    before_logger = logging.getLogger('Pyrduino benchmark before')
+    before_logger.propagate = False
+    devnull = open(os.devnull, 'w')
+    before_logger.addHandler(logging.StreamHandler(devnull))
+
+    def before():
+        before_logger.debug('Got a pin named: ' + name)
+        before_logger.debug('Writing to pin a value: ' + str(value))
+
+    before_logger.setLevel(logging.DEBUG)
+    results['before, forced DEBUG and stdout handler'] = per_call_ns(before, number)
+    before_logger.setLevel(logging.WARNING)
+    results['before, level WARNING'] = per_call_ns(before, number)
+
+    after_logger = logging.getLogger('Pyrduino benchmark after')
+    after_logger.setLevel(logging.WARNING)
+
+    def after():
+        if after_logger.isEnabledFor(logging.DEBUG):
+            after_logger.debug('Got a pin named: %s', name)
+        if after_logger.isEnabledFor(logging.DEBUG):
+            after_logger.debug('Writing to pin a value: %s', value)
+
+    results['after, level WARNING'] = per_call_ns(after, number)
+    devnull.close()
+    return results
+
+
+def bench_board(board_id, board_type, number):
+    """ Measures write_pin on a real board with debug logging on and off """
+    from pyrduino.pyrduino import Pyrduino, READY_MODE_HANDSHAKE, PIN_TYPE_DIGITAL, PIN_MODE_OUTPUT, logger
+    results = dict()
+    board = Pyrduino(board_id=board_id, board_type=board_type, ready_mode=READY_MODE_HANDSHAKE)
+    board.register_pin(name='light', number=13, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_OUTPUT)
+    state = [0]
+
+    def write():
+        state[0] ^= 1
+        board.write_pin(name='light', value=state[0])
+
+    devnull = open(os.devnull, 'w')
+    handler = logging.StreamHandler(devnull)
+    logger.addHandler(handler)
+    board.set_loglevel(logging.DEBUG)
+    results['write_pin, DEBUG'] = per_call_ns(write, number)
+    board.set_loglevel(logging.WARNING)
+    results['write_pin, WARNING'] = per_call_ns(write, number)
+    logger.removeHandler(handler)
+    devnull.close()
+    board.exit_board()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Logging overhead of the read/write hot path')
+    parser.add_argument('--number', type=int, default=100000, help='Calls per run')
+    parser.add_argument('--board-id', help='Also measure write_pin on a real board on this port')
+    parser.add_argument('--board-type', default='arduino', help='Type of the real board')
+    args = parser.parse_args()
+
+    results = bench_log_statements(args.number)
+    if args.board_id:
+        results.update(bench_board(args.board_id, args.board_type, min(args.number, 2000)))
+    for label, ns in results.items():
+        print('{:<45} {:>10.1f} ns/call'.format(label, ns))
+
+
+if __name__ == '__main__':
+    main()
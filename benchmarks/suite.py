@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+# Throughput and latency benchmarks for pyrduino.
+#
+# Runs against the simulated board by default, or a real one with --board-id. The results are printed as JSON,
+# so runs of different versions can be compared to catch regressions.
+#
+# Usage: python benchmarks/suite.py [--board-id /dev/ttyUSB0 --board-type mega] [--time-scale 0.1] [--output out.json]
+#
+# Measuring the input latency needs an input that changes: the simulated board changes it itself, on a real board
+# connect an output pin to an input pin and give them with --loopback-pins OUT IN.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pyrduino.pyrduino import (Pyrduino, BOARD_TYPE_SIM, READY_MODE_HANDSHAKE, PIN_TYPE_DIGITAL, PIN_MODE_INPUT,
+                               PIN_MODE_OUTPUT, PIN_MODE_PWM)
+from pyrduino.protocol import UNAVAILABLE
+from pyrduino.sequence import Sequence
+from morse_code import morseAlphabet
+
+# Pins used by the benchmarks, the same ones as in example.py
+LIGHT_PIN = 13
+PIEZO_PIN = 9
+BUTTON_PIN = 12
+
+
+def open_board(args):
+    """ Opens the board under test and measures how long it took
+
+    :return: The board and the startup time in seconds
+    """
+    start = time.perf_counter()
+    board = Pyrduino(board_id=args.board_id or 'sim', board_type=args.board_type, ready_mode=READY_MODE_HANDSHAKE,
+                     baudrate=args.baudrate, write_buffering=args.write_buffering)
+    return board, time.perf_counter() - start
+
+
+def rate(func, duration):
+    """ Calls func for about duration seconds
+
+    :return: Calls per second
+    :rtype: float
+    """
+    calls = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    while True:
+        for _ in range(100):
+            func()
+        calls += 100
+        now = time.perf_counter()
+        if now >= deadline:
+            return calls / (now - start)
+
+
+def bench_registration(args):
+    """ Time to register all the usable digital pins of a fresh board one by one and all at once """
+    results = dict()
+    for label in ('register_pin', 'register_pins'):
+        board, startup = open_board(args)
+        numbers = [pin.pin_number for pin in board.board.digital if pin.mode != UNAVAILABLE]
+        start = time.perf_counter()
+        if label == 'register_pin':
+            for number in numbers:
+                board.register_pin(name=str(number), number=number)
+        else:
+            board.register_pins([(str(number), number) for number in numbers])
+        results[label] = {'pins': len(numbers), 'seconds': time.perf_counter() - start}
+        board.exit_board()
+    return results
+
+
+def bench_throughput(board, duration):
+    """ write_pin, pin handle write and read_pin calls per second """
+    light = board.register_pin(name='light', number=LIGHT_PIN, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_OUTPUT)
+    board.register_pin(name='button', number=BUTTON_PIN, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_INPUT)
+    state = [0]
+
+    def write_by_name():
+        state[0] ^= 1
+        board.write_pin(name='light', value=state[0])
+
+    def write_by_handle():
+        state[0] ^= 1
+        light.write(state[0])
+
+    results = {
+        'write_pin_per_second': rate(write_by_name, duration),
+        'pin_write_per_second': rate(write_by_handle, duration),
+        'read_pin_per_second': rate(lambda: board.read_pin(name='button'), duration)
+    }
+    board.flush()
+    return results
+
+
+def bench_input_latency(board, args, samples=200):
+    """ Time from an input change to its on_change callback
+
+    With the simulated board the change is made by the simulator, with a real board by writing the output pin
+    that is wired to the input pin.
+    """
+    if args.board_type == BOARD_TYPE_SIM:
+        simulator = board.board.sp.board
+
+        def change(value):
+            simulator.set_digital(BUTTON_PIN, value)
+    elif args.loopback_pins:
+        out_pin, in_pin = args.loopback_pins
+        board.register_pin(name='loopback out', number=out_pin)
+        board.register_pin(name='loopback in', number=in_pin, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_INPUT)
+
+        def change(value):
+            board.write_pin(name='loopback out', value=value)
+            board.flush()
+    else:
+        return None
+
+    name = 'button' if args.board_type == BOARD_TYPE_SIM else 'loopback in'
+    called = threading.Event()
+    board.on_change(name, lambda pin_name, value: called.set())
+    latencies = list()
+    for sample in range(samples):
+        called.clear()
+        start = time.perf_counter()
+        change(sample % 2 == 0)
+        if called.wait(1):
+            latencies.append(time.perf_counter() - start)
+    if not latencies:
+        return {'samples': 0}
+    latencies.sort()
+    return {
+        'samples': len(latencies),
+        'mean': sum(latencies) / len(latencies),
+        'median': latencies[len(latencies) // 2],
+        'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        'max': latencies[-1]
+    }
+
+
+def blink_sequence(scale):
+    """ blink_light of example.py """
+    sequence = Sequence()
+    for x in range(100):
+        sequence.write_pin('light', (x + 1) % 2)
+        sequence.pass_time(0.05 * scale)
+    return sequence.write_pin('light', 0)
+
+
+def morse_sequence(scale, text='SOS', speed_factor=6):
+    """ morse of example.py """
+    sequence = Sequence()
+    for character in text:
+        for morse_character in morseAlphabet[character]:
+            beep = 1 if morse_character == '.' else 3
+            sequence.write_pins({'light': 1, 'piezo': 0.6})
+            sequence.pass_time(beep / speed_factor * scale)
+            sequence.write_pins({'light': 0, 'piezo': 0})
+            sequence.pass_time(0.1 * scale)
+    return sequence
+
+
+def smooth_piezo_sequence(scale):
+    """ smooth_piezo of example.py """
+    sequence = Sequence()
+    for v in range(1, 1000):
+        sequence.write_pin('piezo', float(v) / 1000)
+        sequence.pass_time(0.01 * scale)
+    return sequence.write_pin('piezo', 0)
+
+
+def smooth_piezo_profile_sequence(scale):
+    """ smooth_piezo as a motion profile, quantized to the PWM resolution """
+    from pyrduino import motion
+    sequence = motion.linear(0.001, 0.999, duration=9.98 * scale, rate=100 / scale).to_sequence('piezo', PIN_MODE_PWM)
+    return sequence.pass_time(0.01 * scale).write_pin('piezo', 0)
+
+
+def bench_scheduler(board, scale):
+    """ Timing of the example.py patterns played as sequences """
+    if 'piezo' not in board.registered_pins:
+        board.register_pin(name='piezo', number=PIEZO_PIN, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_PWM)
+    results = dict()
+    for label, build in (('blink', blink_sequence), ('morse', morse_sequence),
+                         ('smooth_piezo', smooth_piezo_sequence),
+                         ('smooth_piezo_profile', smooth_piezo_profile_sequence)):
+        try:
+            results[label] = build(scale).run(board).as_dict()
+        except ImportError as e:
+            results[label] = {'skipped': str(e)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='pyrduino throughput and latency benchmarks')
+    parser.add_argument('--board-id', help='Serial port of a real board, the simulated board is used without this')
+    parser.add_argument('--board-type', help='Type of the real board', default='arduino')
+    parser.add_argument('--baudrate', type=int, default=57600, help='Speed of the serial port of a real board')
+    parser.add_argument('--write-buffering', action='store_true', help='Collect the writes, see Pyrduino.flush')
+    parser.add_argument('--duration', type=float, default=1.0, help='Seconds for each throughput measurement')
+    parser.add_argument('--time-scale', type=float, default=1.0,
+                        help='Multiplier for the timing of the scheduler patterns, e.g. 0.1 for a quick run')
+    parser.add_argument('--loopback-pins', type=int, nargs=2, metavar=('OUT', 'IN'),
+                        help='Output and input pins wired together on a real board, for the input latency')
+    parser.add_argument('--output', help='Write the JSON here instead of printing it')
+    args = parser.parse_args()
+    if not args.board_id:
+        args.board_type = BOARD_TYPE_SIM
+
+    results = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'board_type': args.board_type,
+            'board_id': args.board_id,
+            'baudrate': args.baudrate,
+            'write_buffering': args.write_buffering,
+            'time_scale': args.time_scale
+        },
+        'registration': bench_registration(args)
+    }
+    board, startup = open_board(args)
+    results['startup_seconds'] = startup
+    results['throughput'] = bench_throughput(board, args.duration)
+    results['input_latency'] = bench_input_latency(board, args)
+    results['scheduler'] = bench_scheduler(board, args.time_scale)
+    board.exit_board()
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
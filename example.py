@@ -8,6 +8,8 @@ logger = logging.getLogger('Pyrduino test')
 
 # Import stuff from our pyrduino package
 from pyrduino.pyrduino import *
+from pyrduino.sequence import Sequence
+from pyrduino import motion
 # Import morse code for our example code
 from morse_code import morseAlphabet
 
@@ -15,19 +17,21 @@ class OurProgram:
     BLINK_TYPE_SEQUENTICAL = 'sequentical'
     BLINK_TYPE_CONCURRENT = 'concurrent'
 
-    def __init__(self, board_id, board_type):
+    def __init__(self, board_id, board_type, ready_mode=READY_MODE_SLEEP):
         """ Constructor of the program
 
         :param board_id: Id of the board. In Windows, usually 'COM3' or similar
         :type board_id: str
         :param board_type: Type of the board. One of the constant values defined in the beginning of this file.
         :type board_type: str
+        :param ready_mode: How to wait for the board to get ready ('sleep' or 'handshake')
+        :type ready_mode: str
         """
         # Let's assume that the board can't be created and declare a None instance
         self.board = None
         try:
             logger.debug('Trying to register board')
-            self.board = Pyrduino(board_id=board_id, board_type=board_type)
+            self.board = Pyrduino(board_id=board_id, board_type=board_type, ready_mode=ready_mode)
             logger.debug('Board registered')
         except Exception as e:
             error_msg = 'Could not create a board with these values: {} {}, error: {}'.format(board_id, board_type, e)
@@ -69,15 +73,18 @@ class OurProgram:
         :return: Nothing
         """
         self.board.register_pin(name='light', number=13, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_OUTPUT)
+        # Let's build the whole blinking first and play it afterwards, so the timing doesn't drift
+        sequence = Sequence()
         led_on = 1
         for x in range(amount):
             if led_on == 1:
                 led_on = 0
             else:
                 led_on = 1
-            self.board.write_pin(name='light', value=led_on)
-            self.board.pass_time(0.05)
-        self.board.write_pin(name='light', value=0)
+            sequence.write_pin('light', led_on)
+            sequence.pass_time(0.05)
+        sequence.write_pin('light', 0)
+        logger.debug('Blinked with timing {}'.format(sequence.run(self.board)))
 
     def smooth_piezo(self):
         """ Writes values from 1 to 1000 to a piezo in pin 9 at 0.01 second intervals
@@ -86,10 +93,11 @@ class OurProgram:
         """
         self.board.register_pin(name='piezo', number=9, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_PWM)
 
-        for v in range(1, 1000):
-           self.board.write_pin(value=float(v)/1000)
-           self.board.pass_time(0.01)
-        self.board.write_pin(value=0)
+        # The whole ramp is computed at once, and only the steps which change the PWM duty are written
+        sequence = motion.linear(0.001, 0.999, duration=9.98, rate=100).to_sequence('piezo', PIN_MODE_PWM)
+        sequence.pass_time(0.01)
+        sequence.write_pin('piezo', 0)
+        sequence.run(self.board)
 
     def morse(self, text='SOS', speed_factor=6):
         """ Does a morse code
@@ -113,14 +121,15 @@ class OurProgram:
         self.board.register_pin(name='beep', number=9, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_PWM)
         self.board.register_pin(name='light', number=13, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_OUTPUT)
         self.board.write_pin(name='beep', value=0)
-        logger.debug('starting to morse')
+        sequence = Sequence()
         for beep in beep_list:
-            self.board.write_pin(name='light', value=1)
-            self.board.write_pin(name='beep', value=0.6)
-            self.board.pass_time(beep/speed_factor)
-            self.board.write_pin(name='light', value=0)
-            self.board.write_pin(name='beep', value=0)
-            self.board.pass_time(0.1)
+            sequence.write_pins({'light': 1, 'beep': 0.6})
+            sequence.pass_time(beep/speed_factor)
+            sequence.write_pins({'light': 0, 'beep': 0})
+            sequence.pass_time(0.1)
+        logger.debug('starting to morse')
+        report = sequence.run(self.board)
+        logger.debug('Morse timing: {}'.format(report))
 
     def test_piezo(self):
         """ Tests that piezo is working on pin 9 by writing a value of 0.9 for 1 second
@@ -134,24 +143,21 @@ class OurProgram:
 
     def beep_with_button(self, sound_level=0.9):
         self.board.register_pin(name='button', number=12, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_INPUT)
-        self.board.register_pin(name='beep', number=9, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_PWM)
-        sounding = False
+        beep = self.board.register_pin(name='beep', number=9, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_PWM)
         # Shut down the piezo at the start
-        self.board.write_pin(name='beep', value=0)
-        while True:
-            # Get the button pressed status
-            button_pressed = self.board.read_pin(name='button')
-            if not sounding and button_pressed:
-                self.board.write_pin(name='beep', value=sound_level)
-                sounding = True
-            elif sounding and not button_pressed:
-                self.board.write_pin(name='beep', value=0)
-                sounding = False
+        beep.write(0)
 
-            self.board.pass_time(0.05)
+        def button_changed(name, button_pressed):
+            # This is called by the board as soon as the button state changes, no need to poll it
+            beep.write(sound_level if button_pressed else 0)
+
+        self.board.on_change('button', button_changed)
+        while True:
+            time.sleep(1)
 
     def blink_with_input(self, min_pin=11, max_pin=13, blink_type=BLINK_TYPE_SEQUENTICAL, interval=0.2, amount=10):
         self.board.register_pin_array(min_pin=min_pin, max_pin=max_pin)
+        pin_group = self.board.pin_group(*[str(pin_no) for pin_no in range(min_pin, max_pin + 1)])
         for occurrence in range(amount):
             if blink_type == self.BLINK_TYPE_SEQUENTICAL:
                 for pin_no in range(min_pin, max_pin + 1):
@@ -161,11 +167,10 @@ class OurProgram:
                     self.board.write_pin(name=str(pin_no), value=0)
                     self.board.pass_time(interval)
             else:
-                for pin_no in range(min_pin, max_pin +1):
-                    self.board.write_pin(name=str(pin_no), value=1)
+                # Write the pins as a group, so they all change with a single serial write
+                pin_group.write(1)
                 self.board.pass_time(interval)
-                for pin_no in range(min_pin, max_pin + 1):
-                    self.board.write_pin(name=str(pin_no), value=0)
+                pin_group.write(0)
                 self.board.pass_time(interval)
 
 
@@ -188,9 +193,14 @@ class OurProgram:
               help='Board ID, typically a tty or USB port')
 @click.option('-t', '--board_type', default=BOARD_TYPE_ARDUINO_MEGA, show_default=True,
               help='Board type from pyrduino choices')
+@click.option('-r', '--ready_mode', default=READY_MODE_SLEEP, show_default=True, type=click.Choice(READY_MODES),
+              help='Wait a fixed time for the board or just until it answers to a handshake')
+@click.option('-v', '--verbose', is_flag=True, help='Print the debug log of pyrduino')
 @click.pass_context
-def cli(ctx, board_id, board_type):
-    ctx.obj = OurProgram(board_id=board_id, board_type=board_type)
+def cli(ctx, board_id, board_type, ready_mode, verbose):
+    if verbose:
+        enable_console_logging()
+    ctx.obj = OurProgram(board_id=board_id, board_type=board_type, ready_mode=ready_mode)
 
 
 @cli.command()
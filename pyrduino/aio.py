@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+# asyncio front-end for boards running StandardFirmata.
+#
+# Unlike Pyrduino this doesn't use pyfirmata's Board, its blocking reads or the reader thread. The serial port is
+# read and written in non blocking mode through the event loop and the bytes are parsed as they come in, so a single
+# event loop can drive many boards next to whatever else it is doing. The serial port file descriptor is watched with
+# loop.add_reader, which needs a selector based event loop, i.e. this works on Linux and macOS.
+
+import asyncio
+import numbers
+import os
+
+import serial
+
+from . import protocol
+from .pyrduino import (BOARD_TYPE_ARDUINO, BOARD_LAYOUTS, PIN_TYPE_ANALOG, PIN_TYPE_DIGITAL, PIN_MODE_INPUT,
+                       PIN_MODE_OUTPUT, PIN_MODE_PWM, PIN_MODE_SERVO, FIRMATA_PIN_MODES, HANDSHAKE_QUERY_INTERVAL,
+                       CAPABILITY_QUERY_TIMEOUT, PinRegistrationError, check_pin_capability, logger,
+                       _normalize_pin_spec)
+
+# Bytes waiting for the serial port before write methods start to wait for it
+WRITE_BUFFER_HIGH_WATER = 4096
+# Values a stream keeps for a consumer that is falling behind, the oldest ones are dropped first
+STREAM_QUEUE_SIZE = 100
+
+# Put into the stream queues when the board is closed
+_STREAM_END = object()
+
+
+class AsyncPin:
+    """ A pin registered to an AsyncPyrduino """
+    __slots__ = ('name', 'number', 'pin_type', 'pin_mode', 'value')
+
+    def __init__(self, name, number, pin_type, pin_mode):
+        self.name = name
+        self.number = number
+        self.pin_type = pin_type
+        self.pin_mode = pin_mode
+        # The last value read from or written to the pin
+        self.value = None
+
+    def __repr__(self):
+        return 'AsyncPin({!r}, {}:{}:{})'.format(self.name, self.pin_type, self.number, self.pin_mode)
+
+
+class AsyncPyrduino:
+    """ Board controller for asyncio programs
+
+    async with AsyncPyrduino('/dev/ttyUSB0', BOARD_TYPE_ARDUINO_MEGA) as board:
+        await board.register_pin('button', 12, PIN_TYPE_DIGITAL, PIN_MODE_INPUT)
+        async for pressed in board.stream('button'):
+            ...
+    """
+    def __init__(self, board_id, board_type=BOARD_TYPE_ARDUINO, baudrate=57600):
+        """ Constructor for the board controller, nothing is opened before connect is awaited
+
+        :param board_id: Id of the board, usually /dev/ttyXXX
+        :type board_id: str
+        :param board_type: Type of the board. One of the BOARD_TYPE_* constants. Only used for checking the pins
+            if the board doesn't answer to the capability query.
+        :type board_type: str
+        :param baudrate: Baud rate of the serial port
+        :type baudrate: int
+        """
+        self.board_id = board_id
+        self.board_type = board_type
+        self.baudrate = baudrate
+        self.firmata_version = None
+        self.firmware = None
+        self.capabilities = None
+        self.analog_mapping = None
+        self.registered_pins = dict()
+
+        self._loop = None
+        self._serial = None
+        self._fd = None
+        self._parser = protocol.FirmataParser()
+        self._out = bytearray()
+        self._drained = None
+        # Futures waiting for replies by command byte (or SysEx command byte)
+        self._waiters = dict()
+        # Input pins by digital port number and by analog pin number
+        self._digital_inputs = dict()
+        self._analog_inputs = dict()
+        # Bit masks of the digital output values by port number
+        self._port_masks = dict()
+        # (queue, changes_only) pairs by pin name
+        self._streams = dict()
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    @property
+    def connected(self):
+        return self._fd is not None
+
+    async def connect(self, timeout=10):
+        """ Opens the serial port and waits until the board answers to the Firmata handshake
+
+        :param timeout: Seconds to wait for the board to answer
+        :type timeout: float
+        :return: None
+        """
+        self._loop = asyncio.get_running_loop()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._serial = serial.Serial(self.board_id, self.baudrate, timeout=0)
+        self._fd = self._serial.fileno()
+        os.set_blocking(self._fd, False)
+        self._loop.add_reader(self._fd, self._on_readable)
+        try:
+            await asyncio.wait_for(self._handshake(), timeout)
+        except asyncio.TimeoutError:
+            await self.close()
+            raise IOError('Board on {} did not answer to the Firmata handshake in {} seconds'
+                          .format(self.board_id, timeout))
+        except Exception:
+            await self.close()
+            raise
+        logger.debug('Board on %s answered with Firmata version %s', self.board_id, self.firmata_version)
+
+    async def _handshake(self):
+        version = self._expect(protocol.REPORT_VERSION)
+        while not version.done():
+            self._write(bytearray([protocol.REPORT_VERSION]))
+            await asyncio.wait([version], timeout=HANDSHAKE_QUERY_INTERVAL)
+
+    async def query_capabilities(self, timeout=CAPABILITY_QUERY_TIMEOUT):
+        """ Asks the board what its pins can do, see Pyrduino.query_capabilities
+
+        :param timeout: Seconds to wait for the answers
+        :type timeout: float
+        :return: True if the board answered
+        :rtype: bool
+        """
+        if self.capabilities is None or self.analog_mapping is None:
+            replies = [self._expect(protocol.CAPABILITY_RESPONSE), self._expect(protocol.ANALOG_MAPPING_RESPONSE)]
+            self._write(protocol.capability_queries())
+            done, pending = await asyncio.wait(replies, timeout=timeout)
+            for reply in pending:
+                reply.cancel()
+            if pending:
+                logger.warning('Board on %s did not answer to the capability queries', self.board_id)
+        return self.capabilities is not None and self.analog_mapping is not None
+
+    async def close(self):
+        """ Closes the serial port and ends the streams
+
+        :return: None
+        """
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            self._loop.remove_writer(self._fd)
+            self._fd = None
+        if self._serial is not None:
+            self._serial.close()
+            self._serial = None
+        self._out = bytearray()
+        if self._drained is not None:
+            self._drained.set()
+        for waiter in self._waiters.values():
+            waiter.cancel()
+        self._waiters.clear()
+        for streams in self._streams.values():
+            for queue, changes_only in streams:
+                _put_dropping_oldest(queue, _STREAM_END)
+
+    async def register_pin(self, name, number, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_OUTPUT):
+        """ Registers a pin, see Pyrduino.register_pin
+
+        :return: The registered pin
+        :rtype: AsyncPin
+        """
+        await self.register_pins([(name, number, pin_type, pin_mode)])
+        return self.registered_pins[name]
+
+    async def register_pins(self, spec):
+        """ Registers many pins at once with a single write, see Pyrduino.register_pins
+
+        :param spec: List or dict of (name, number, pin_type, pin_mode) entries
+        :raises PinRegistrationError: With all the invalid pins listed
+        :return: None
+        """
+        entries = _normalize_pin_spec(spec)
+        has_capabilities = await self.query_capabilities()
+        taken = set((pin.pin_type, pin.number) for pin in self.registered_pins.values())
+        errors = list()
+        names = set()
+        for name, number, pin_type, pin_mode in entries:
+            if name in names or name in self.registered_pins:
+                errors.append('Pin name {} is used more than once'.format(name))
+            names.add(name)
+            if has_capabilities:
+                error = check_pin_capability(self.capabilities, self.analog_mapping, number, pin_type, pin_mode)
+            else:
+                error = _check_pin_layout(BOARD_LAYOUTS[self.board_type], number, pin_type, pin_mode)
+            if not error and (pin_type, number) in taken:
+                error = 'pin is already taken'
+            if error:
+                errors.append('Pin {} ({}:{}:{}): {}'.format(name, pin_type, number, pin_mode, error))
+            taken.add((pin_type, number))
+        if errors:
+            raise PinRegistrationError(errors)
+
+        msg = bytearray()
+        reporting_ports = set()
+        for name, number, pin_type, pin_mode in entries:
+            pin = AsyncPin(name, number, pin_type, pin_mode)
+            if pin_type == PIN_TYPE_ANALOG:
+                self._analog_inputs[number] = pin
+                msg += protocol.report_analog(number)
+            else:
+                firmata_mode = FIRMATA_PIN_MODES[pin_mode]
+                if firmata_mode == protocol.SERVO:
+                    msg += protocol.servo_config(number)
+                else:
+                    msg += protocol.set_pin_mode(number, firmata_mode)
+                if firmata_mode == protocol.INPUT:
+                    port_number = number // 8
+                    self._digital_inputs[port_number] = self._digital_inputs.get(port_number, []) + [pin]
+                    reporting_ports.add(port_number)
+            self.registered_pins[name] = pin
+        for port_number in sorted(reporting_ports):
+            msg += protocol.report_digital(port_number)
+        self._write(msg)
+        await self._drain()
+
+    def get_registered_pin(self, name):
+        """ Returns a registered pin by a name
+
+        :param name: Name of the pin
+        :type name: str
+        :rtype: AsyncPin
+        """
+        try:
+            return self.registered_pins[name]
+        except KeyError:
+            raise Exception('No pin registered with that name: {}'.format(name))
+
+    async def write_pin(self, name, value):
+        """ Write a value to the pin
+
+        :param name: Name of a registered pin
+        :type name: str
+        :param value: Value to write
+        :type value: int or float
+        :return: None
+        """
+        self._check_writable({name: value})
+        self._write(self._encode_write(self.registered_pins[name], value))
+        await self._drain()
+
+    async def write_pins(self, values):
+        """ Write values to many pins at once, see Pyrduino.write_pins
+
+        :param values: Values by the names of registered pins
+        :type values: dict
+        :return: None
+        """
+        # Everything is checked before anything changes, like in Pyrduino.write_pins
+        self._check_writable(values)
+        msg = bytearray()
+        ports = dict()
+        for name, value in values.items():
+            pin = self.registered_pins[name]
+            if pin.pin_mode == PIN_MODE_OUTPUT and pin.pin_type != PIN_TYPE_ANALOG:
+                # Only the final mask of every port is needed
+                self._set_output_bit(pin, value)
+                ports[pin.number // 8] = True
+            else:
+                msg += self._encode_write(pin, value)
+        for port_number in ports:
+            msg += protocol.digital_port(port_number, self._port_masks[port_number])
+        self._write(msg)
+        await self._drain()
+
+    def read_pin(self, name):
+        """ Read the latest value of a pin
+
+        :param name: Name of a registered pin
+        :type name: str
+        :return: Pin value
+        """
+        return self.get_registered_pin(name).value
+
+    async def stream(self, name, changes_only=True, queue_size=STREAM_QUEUE_SIZE):
+        """ Yields the values of an input pin as they arrive from the board
+
+        async for value in board.stream('button'): ...
+
+        :param name: Name of a registered input pin
+        :type name: str
+        :param changes_only: Yield only values that differ from the previous one. Analog pins are reported at every
+            sampling interval, so set this to False to get every sample.
+        :type changes_only: bool
+        :param queue_size: Values kept for a consumer that is falling behind, the oldest ones are dropped first
+        :type queue_size: int
+        """
+        pin = self.get_registered_pin(name)
+        if pin.pin_type != PIN_TYPE_ANALOG and pin.pin_mode != PIN_MODE_INPUT:
+            # Nothing would ever come
+            raise Exception('Pin {} is not an input pin'.format(name))
+        entry = (asyncio.Queue(queue_size), changes_only)
+        self._streams[name] = self._streams.get(name, []) + [entry]
+        try:
+            while True:
+                value = await entry[0].get()
+                if value is _STREAM_END:
+                    return
+                yield value
+        finally:
+            self._streams[name] = [e for e in self._streams.get(name, []) if e is not entry]
+
+    async def sleep(self, value):
+        """ Pass a time without blocking the event loop
+
+        :param value: Time to pass
+        :type value: float
+        :return: None
+        """
+        await asyncio.sleep(value)
+
+    def _check_writable(self, values):
+        """ Checks that all the names are registered output, PWM or servo pins and all the values numbers
+
+        :param values: Values by pin name
+        :type values: dict
+        :return: None
+        """
+        for name, value in values.items():
+            pin = self.get_registered_pin(name)
+            if pin.pin_type == PIN_TYPE_ANALOG or pin.pin_mode not in (PIN_MODE_OUTPUT, PIN_MODE_PWM, PIN_MODE_SERVO):
+                raise IOError('{} can not be written to'.format(pin))
+            if not isinstance(value, numbers.Real):
+                raise TypeError('Value for pin {} is not a number: {!r}'.format(name, value))
+
+    def _encode_write(self, pin, value):
+        """ Builds the message for writing a value to a pin
+
+        :rtype: bytearray
+        """
+        if pin.pin_mode == PIN_MODE_OUTPUT and pin.pin_type != PIN_TYPE_ANALOG:
+            self._set_output_bit(pin, value)
+            port_number = pin.number // 8
+            return protocol.digital_port(port_number, self._port_masks[port_number])
+        if pin.pin_mode == PIN_MODE_PWM:
+            pin.value = value
+            return protocol.analog_write(pin.number, int(round(value * 255)))
+        if pin.pin_mode == PIN_MODE_SERVO:
+            pin.value = value
+            return protocol.analog_write(pin.number, int(value))
+        raise IOError('{} can not be written to'.format(pin))
+
+    def _set_output_bit(self, pin, value):
+        pin.value = value
+        port_number = pin.number // 8
+        bit = 1 << (pin.number % 8)
+        mask = self._port_masks.get(port_number, 0)
+        # Only 1 is high, like in pyfirmata's Port.write
+        self._port_masks[port_number] = mask | bit if value == 1 else mask & ~bit
+
+    def _expect(self, command):
+        """ Returns a future for the next reply with the given command byte (or SysEx command byte)
+
+        :rtype: asyncio.Future
+        """
+        waiter = self._waiters.get(command)
+        if waiter is None or waiter.done():
+            waiter = self._loop.create_future()
+            self._waiters[command] = waiter
+        return waiter
+
+    def _resolve(self, command, result):
+        waiter = self._waiters.pop(command, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(result)
+
+    def _write(self, data):
+        """ Writes to the serial port without blocking, what doesn't fit right away is written when it can be
+
+        :param data: Firmata messages
+        :type data: bytearray
+        :return: None
+        """
+        if self._fd is None:
+            raise IOError('Board on {} is not connected'.format(self.board_id))
+        if self._out:
+            self._out += data
+            return
+        try:
+            written = os.write(self._fd, data)
+        except BlockingIOError:
+            written = 0
+        if written < len(data):
+            self._out += data[written:]
+            self._drained.clear()
+            self._loop.add_writer(self._fd, self._on_writable)
+
+    async def _drain(self):
+        if len(self._out) > WRITE_BUFFER_HIGH_WATER:
+            await self._drained.wait()
+
+    def _on_writable(self):
+        try:
+            written = os.write(self._fd, self._out)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._connection_lost(e)
+            return
+        del self._out[:written]
+        if not self._out:
+            self._loop.remove_writer(self._fd)
+            self._drained.set()
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._connection_lost(e)
+            return
+        if not data:
+            self._connection_lost(None)
+            return
+        for command, channel, payload in self._parser.feed(data):
+            self._handle_message(command, channel, payload)
+
+    def _handle_message(self, command, channel, data):
+        if command == protocol.DIGITAL_MESSAGE:
+            pins = self._digital_inputs.get(channel)
+            if pins:
+                mask = protocol.two_byte_value(data)
+                for pin in pins:
+                    self._update(pin, (mask & (1 << (pin.number - channel * 8))) > 0)
+        elif command == protocol.ANALOG_MESSAGE:
+            pin = self._analog_inputs.get(channel)
+            if pin is not None:
+                # Same scale as pyfirmata
+                self._update(pin, round(protocol.two_byte_value(data) / 1023.0, 4))
+        elif command == protocol.REPORT_VERSION:
+            self.firmata_version = (data[0], data[1])
+            self._resolve(command, self.firmata_version)
+        elif command == protocol.START_SYSEX:
+            if channel == protocol.CAPABILITY_RESPONSE:
+                self.capabilities = protocol.parse_capability_response(data)
+            elif channel == protocol.ANALOG_MAPPING_RESPONSE:
+                self.analog_mapping = protocol.parse_analog_mapping_response(data)
+            elif channel == protocol.REPORT_FIRMWARE:
+                self.firmware = bytes(data[2::2]).decode('ascii', 'replace')
+            self._resolve(channel, data)
+
+    def _update(self, pin, value):
+        changed = value != pin.value
+        pin.value = value
+        for queue, changes_only in self._streams.get(pin.name, ()):
+            if changed or not changes_only:
+                _put_dropping_oldest(queue, value)
+
+    def _connection_lost(self, error):
+        logger.warning('Lost connection to board on %s: %s', self.board_id, error)
+        self._loop.create_task(self.close())
+
+
+def _put_dropping_oldest(queue, value):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(value)
+
+
+def _check_pin_layout(layout, number, pin_type, pin_mode):
+    """ Checks a pin against a pyfirmata board layout, for boards that don't answer to the capability query
+
+    :return: An error message or None if the pin is fine
+    :rtype: str
+    """
+    if pin_type == PIN_TYPE_ANALOG:
+        if pin_mode != PIN_MODE_INPUT:
+            return 'analog pins can only be inputs'
+        if number not in layout['analog']:
+            return 'no such analog pin'
+        return None
+    if pin_type != PIN_TYPE_DIGITAL:
+        return 'unknown pin type'
+    if pin_mode not in FIRMATA_PIN_MODES:
+        return 'unknown pin mode'
+    if number not in layout['digital'] or number in layout['disabled']:
+        return 'no such digital pin'
+    if pin_mode == PIN_MODE_PWM and number not in layout['pwm']:
+        return 'pin does not support the mode'
+    return None
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+# Finding the Firmata boards connected to the host.
+#
+# All the candidate serial ports are probed at the same time. A probe keeps asking for the Firmata version, the
+# firmware and the capabilities until the board answers, so a port without Firmata only costs the timeout, and
+# the whole discovery takes about as long as the slowest board needs to boot. The type of a board is told from
+# the number of its pins and analog inputs.
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+from serial.tools import list_ports
+
+from . import protocol
+from .pyrduino import (Pyrduino, BOARD_LAYOUTS, BOARD_TYPE_ARDUINO, BOARD_TYPE_ARDUINO_NANO, BOARD_TYPE_ARDUINO_MEGA,
+                       BOARD_TYPE_ARDUINO_DUE, DEFAULT_BAUDRATE, HANDSHAKE_QUERY_INTERVAL, logger)
+
+# Seconds to wait for a board to answer, long enough for the bootloader that runs after opening the port
+DISCOVERY_TIMEOUT = 5
+
+# Board types that can be told apart by their pins, in the order they are tried
+DETECTED_BOARD_TYPES = [
+    BOARD_TYPE_ARDUINO,
+    BOARD_TYPE_ARDUINO_NANO,
+    BOARD_TYPE_ARDUINO_MEGA,
+    BOARD_TYPE_ARDUINO_DUE
+]
+
+
+class DiscoveredBoard:
+    """ A board found by discover
+
+    The serial port is left open, so connecting doesn't reset the board and wait for it to boot again.
+    Call close for the boards that are not connected.
+    """
+    def __init__(self, port, sp, version, firmware, capabilities, analog_mapping, port_info=None,
+                 baudrate=DEFAULT_BAUDRATE):
+        """
+        :param port: The serial port
+        :type port: str
+        :param sp: The open serial port
+        :param version: Firmata protocol version, (major, minor)
+        :type version: tuple
+        :param firmware: Name of the firmware, None if the board didn't tell
+        :type firmware: str
+        :param capabilities: Parsed capability response
+        :type capabilities: dict
+        :param analog_mapping: Parsed analog mapping response
+        :type analog_mapping: dict
+        :param port_info: What pyserial knows about the port
+        :param baudrate: Speed the port was opened with
+        :type baudrate: int
+        """
+        self.port = port
+        self.baudrate = baudrate
+        self.version = version
+        self.firmware = firmware
+        self.capabilities = capabilities
+        self.analog_mapping = analog_mapping
+        self.board_type = infer_board_type(capabilities, analog_mapping)
+        self.description = getattr(port_info, 'description', None)
+        self.serial_number = getattr(port_info, 'serial_number', None)
+        self._sp = sp
+
+    def __repr__(self):
+        return 'DiscoveredBoard({!r}, board_type={!r}, firmware={!r}, version={})'.format(
+            self.port, self.board_type, self.firmware, '.'.join(str(part) for part in self.version))
+
+    def connect(self, board_type=None, **kwargs):
+        """ Creates a Pyrduino for the board, the capabilities found are used without asking them again
+
+        :param board_type: Type of the board, needed if it couldn't be told from the pins
+        :type board_type: str
+        :param kwargs: Other arguments for Pyrduino. With reconnect=True the port is opened again by its name and
+            the speed it was probed with.
+        :rtype: Pyrduino
+        """
+        board_type = board_type or self.board_type
+        if board_type is None:
+            raise Exception('Could not tell the type of the board on {}, give the board_type'.format(self.port))
+        if self._sp is None:
+            raise IOError('Board on {} is already connected or closed'.format(self.port))
+        # The open port is handed over as a transport, which the supervisor can't open again by itself
+        reconnect = kwargs.pop('reconnect', False)
+        kwargs.setdefault('baudrate', self.baudrate)
+        sp, self._sp = self._sp, None
+        # Answers to the repeated probe queries may still be waiting
+        sp.reset_input_buffer()
+        try:
+            board = Pyrduino(board_id=self.port, board_type=board_type, transport=sp, **kwargs)
+        except Exception:
+            sp.close()
+            raise
+        board.use_capabilities(self.capabilities, self.analog_mapping)
+        if reconnect:
+            try:
+                board.supervise(opener=lambda: serial.Serial(self.port, board.baudrate, timeout=board.timeout,
+                                                             write_timeout=board.write_timeout))
+            except Exception:
+                board.exit_board()
+                raise
+        return board
+
+    def close(self):
+        """ Closes the serial port if the board wasn't connected
+
+        :return: None
+        """
+        if self._sp is not None:
+            self._sp.close()
+            self._sp = None
+
+
+def discover(ports=None, timeout=DISCOVERY_TIMEOUT, baudrate=DEFAULT_BAUDRATE, include_all=False):
+    """ Finds the Firmata boards connected to the host
+
+    for found in pyrduino.discover():
+        board = found.connect()
+
+    :param ports: Serial ports to probe, by default all the USB serial ports pyserial finds
+    :type ports: list
+    :param timeout: Seconds to wait for each board
+    :type timeout: float
+    :param baudrate: Speed of the serial ports
+    :type baudrate: int
+    :param include_all: Probe also the serial ports which are not USB devices
+    :type include_all: bool
+    :return: The boards that answered, by port name order
+    :rtype: list
+    """
+    if ports is None:
+        infos = dict((info.device, info) for info in list_ports.comports()
+                     if include_all or info.vid is not None)
+    else:
+        infos = dict((port, None) for port in ports)
+    if not infos:
+        return list()
+    with ThreadPoolExecutor(max_workers=len(infos), thread_name_prefix='pyrduino-discover') as executor:
+        futures = [executor.submit(probe, port, timeout, baudrate, info) for port, info in sorted(infos.items())]
+        found = [future.result() for future in futures]
+    return [board for board in found if board is not None]
+
+
+def probe(port, timeout=DISCOVERY_TIMEOUT, baudrate=DEFAULT_BAUDRATE, port_info=None):
+    """ Checks if there is a Firmata board on a serial port
+
+    :param port: The serial port
+    :type port: str
+    :param timeout: Seconds to wait for the answers
+    :type timeout: float
+    :param baudrate: Speed of the serial port
+    :type baudrate: int
+    :param port_info: What pyserial knows about the port
+    :return: The board, or None if nothing answered
+    :rtype: DiscoveredBoard
+    """
+    try:
+        sp = serial.Serial(port, baudrate, timeout=0.05)
+    except (serial.SerialException, OSError) as e:
+        logger.debug('Could not open {}: {}'.format(port, e))
+        return None
+    parser = protocol.FirmataParser(protocol.BOARD_MESSAGE_LENGTHS)
+    version = firmware = capabilities = analog_mapping = None
+    deadline = time.monotonic() + timeout
+    next_query = 0
+    try:
+        while version is None or capabilities is None or analog_mapping is None:
+            now = time.monotonic()
+            if now >= deadline:
+                logger.debug('No Firmata board answered on {}'.format(port))
+                sp.close()
+                return None
+            if now >= next_query:
+                # The bootloader may eat the first queries, so ask again until everything is answered
+                query = bytearray([protocol.REPORT_VERSION]) + protocol.sysex(protocol.REPORT_FIRMWARE)
+                if capabilities is None or analog_mapping is None:
+                    query += protocol.capability_queries()
+                sp.write(query)
+                next_query = now + HANDSHAKE_QUERY_INTERVAL
+            for command, channel, data in parser.feed(sp.read(max(sp.in_waiting, 1))):
+                if command == protocol.REPORT_VERSION:
+                    version = (data[0], data[1])
+                elif command == protocol.START_SYSEX:
+                    if channel == protocol.REPORT_FIRMWARE and len(data) >= 2:
+                        version = version or (data[0], data[1])
+                        firmware = parse_firmware_name(data[2:])
+                    elif channel == protocol.CAPABILITY_RESPONSE:
+                        capabilities = protocol.parse_capability_response(data)
+                    elif channel == protocol.ANALOG_MAPPING_RESPONSE:
+                        analog_mapping = protocol.parse_analog_mapping_response(data)
+    except (serial.SerialException, OSError) as e:
+        logger.debug('Probing {} failed: {}'.format(port, e))
+        sp.close()
+        return None
+    board = DiscoveredBoard(port, sp, version, firmware, capabilities, analog_mapping, port_info, baudrate)
+    logger.debug('Found {}'.format(board))
+    return board
+
+
+def infer_board_type(capabilities, analog_mapping):
+    """ Tells the type of a board from the number of its pins and analog inputs
+
+    :param capabilities: Parsed capability response
+    :type capabilities: dict
+    :param analog_mapping: Parsed analog mapping response
+    :type analog_mapping: dict
+    :return: One of the BOARD_TYPE_* constants, or None if no known board has those pins
+    :rtype: str
+    """
+    pins = (len(capabilities), len(analog_mapping))
+    for board_type in DETECTED_BOARD_TYPES:
+        layout = BOARD_LAYOUTS[board_type]
+        if pins == (len(layout['digital']) + len(layout['analog']), len(layout['analog'])):
+            return board_type
+    return None
+
+
+def parse_firmware_name(data):
+    """ The firmware name of a REPORT_FIRMWARE response, every character is sent as two 7-bit bytes
+
+    :param data: The bytes after the version
+    :rtype: str
+    """
+    return ''.join(chr(data[i] | (data[i + 1] << 7)) for i in range(0, len(data) - 1, 2))
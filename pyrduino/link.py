@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# The serial link between a Pyrduino and its board.
+#
+# Every pyfirmata message is its own serial write, which costs a system call (and often a USB transfer) for three
+# bytes. The link sits in place of the serial port of the pyfirmata board, so it sees all the writes, and can collect
+# them into a buffer that goes out in a single write. When it isn't buffering, the methods of the port are bound
+# straight onto the link, so nothing is added to the way of the reads and writes.
+#
+# The link is also where a supervised board swaps a lost port for a new one. While it is supervised every write to the
+# port checks that the link is up, and waits a bounded time for it to come back instead of failing right away.
+
+import threading
+import time
+
+import serial
+
+# Bytes collected before the buffer is sent on its own
+DEFAULT_FLUSH_THRESHOLD = 256
+
+
+class BufferedLink:
+    """ A serial port (or anything like it) with optional write buffering """
+    def __init__(self, sp, flush_threshold=DEFAULT_FLUSH_THRESHOLD):
+        """
+        :param sp: The serial port
+        :param flush_threshold: Send the buffer when it has this many bytes
+        :type flush_threshold: int
+        """
+        self.flush_threshold = flush_threshold
+        self.buffering = False
+        self.redirect = None
+        # Seconds a write waits for a lost link to come back, None when the link isn't supervised
+        self.stall_timeout = None
+        self.on_lost = None
+        # Set while the port works, cleared from losing it until a new one is attached
+        self.online = threading.Event()
+        self.online.set()
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        # Keeps the writes of different threads whole when the link is supervised
+        self._write_lock = threading.Lock()
+        self.attach(sp)
+
+    def attach(self, sp):
+        """ Puts a port behind the link, e.g. one that counts the bytes
+
+        :param sp: The serial port
+        :return: None
+        """
+        self.sp = sp
+        self.read = sp.read
+        self.inWaiting = sp.inWaiting
+        self._bind()
+
+    def _bind(self):
+        # send always writes (or buffers), write can be redirected elsewhere first
+        self._write_port = self.sp.write if self.stall_timeout is None else self._write_guarded
+        self.send = self._write_buffered if self.buffering else self._write_port
+        self.write = self.send if self.redirect is None else self.redirect
+
+    def __getattr__(self, name):
+        # Everything else goes straight to the port
+        if name == 'sp':
+            raise AttributeError(name)
+        return getattr(self.sp, name)
+
+    def set_buffering(self, buffering):
+        """ Starts or stops collecting writes, stopping sends what was collected
+
+        :param buffering: Collect or not
+        :type buffering: bool
+        :return: None
+        """
+        with self._lock:
+            self.buffering = buffering
+            self._bind()
+        if not buffering:
+            self.flush()
+
+    def set_redirect(self, redirect):
+        """ Makes write call another function instead of sending, e.g. to queue the data for a writer thread which
+        then sends it with send
+
+        :param redirect: Function called with the data, None to send again
+        :return: None
+        """
+        self.redirect = redirect
+        self._bind()
+
+    def supervise(self, stall_timeout, on_lost):
+        """ Makes the writes notice a lost port and wait for a new one to be attached
+
+        :param stall_timeout: Seconds a write waits for the link to come back before raising IOError
+        :type stall_timeout: float
+        :param on_lost: Function called with the error when a write finds the port lost
+        :return: None
+        """
+        with self._lock:
+            self.on_lost = on_lost
+            self.stall_timeout = stall_timeout
+            self._bind()
+
+    def lost(self, error):
+        """ Marks the port lost, writes wait until a new one is attached
+
+        :param error: What went wrong
+        :return: None
+        """
+        if self.online.is_set():
+            self.online.clear()
+            if self.on_lost is not None:
+                self.on_lost(error)
+
+    def _write_guarded(self, data):
+        deadline = None
+        while True:
+            if not self.online.is_set():
+                if deadline is None:
+                    deadline = time.monotonic() + self.stall_timeout
+                if not self.online.wait(max(deadline - time.monotonic(), 0)):
+                    raise IOError('The link to the board is down')
+            try:
+                with self._write_lock:
+                    return self.sp.write(data)
+            except (serial.SerialException, OSError) as e:
+                self.lost(e)
+
+    def send_now(self, data):
+        """ Writes straight to the port, past the buffer and without waiting for a lost link
+
+        :param data: Bytes to write
+        :return: None
+        """
+        with self._write_lock:
+            self.sp.write(data)
+
+    def _write_buffered(self, data):
+        with self._lock:
+            self._buffer += data
+            if len(self._buffer) >= self.flush_threshold:
+                self._send()
+        return len(data)
+
+    def _send(self):
+        # Called with the lock held
+        if self._buffer:
+            data = bytes(self._buffer)
+            del self._buffer[:]
+            self._write_port(data)
+
+    def flush(self):
+        """ Sends the collected writes
+
+        :return: None
+        """
+        with self._lock:
+            self._send()
+
+    def close(self):
+        """ Sends the collected writes and closes the port
+
+        :return: None
+        """
+        try:
+            self.flush()
+        finally:
+            self.sp.close()
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# Motion profiles for PWM and servo pins.
+#
+# A profile is the whole table of times and values of a move, computed with NumPy in one go instead of one Python
+# call per step. Before playing, the values are rounded to what the pin can actually do (256 PWM levels, whole servo
+# degrees) and the steps that wouldn't change anything are dropped, so a slow move sends only the writes that matter.
+# The result is played with a Sequence, so it keeps its timing and can be mixed with other writes.
+# NumPy is only needed when profiles are used.
+
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .pyrduino import PIN_MODE_PWM, PIN_MODE_SERVO
+from .sequence import Sequence
+
+# Updates per second when no rate is given, about what a hobby servo follows
+DEFAULT_RATE = 50
+
+# Number of steps in a value of 1 of each pin mode, the same encoding as Pyrduino.write_pins uses
+PIN_RESOLUTIONS = {
+    PIN_MODE_PWM: 255,
+    PIN_MODE_SERVO: 1
+}
+
+
+def linear_easing(u):
+    return u
+
+
+def ease_in(u):
+    return u * u
+
+
+def ease_out(u):
+    return u * (2 - u)
+
+
+def ease_in_out(u):
+    return (1 - numpy.cos(math.pi * u)) / 2
+
+
+class Profile:
+    """ Values of a pin over time
+
+    profile = motion.move(0, 180, duration=2, easing=motion.ease_in_out)
+    profile.play(board, 'servo')
+    """
+    def __init__(self, times, values):
+        """
+        :param times: Seconds from the start of the profile, increasing
+        :param values: Value at each time
+        """
+        _require_numpy()
+        self.times = numpy.asarray(times, dtype=numpy.float64)
+        self.values = numpy.asarray(values, dtype=numpy.float64)
+        assert self.times.shape == self.values.shape, 'Every time needs a value'
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration(self):
+        """ Time of the last value """
+        return float(self.times[-1]) if len(self.times) else 0.0
+
+    def then(self, other, pause=0.0):
+        """ This profile followed by another one
+
+        :param other: The profile to play after this one
+        :type other: Profile
+        :param pause: Seconds between the last value of this one and the first value of the other
+        :type pause: float
+        :rtype: Profile
+        """
+        return Profile(numpy.concatenate((self.times, other.times + self.duration + pause)),
+                       numpy.concatenate((self.values, other.values)))
+
+    def quantized(self, pin_mode):
+        """ The profile rounded to the resolution of a pin mode, without the steps that don't change the value
+
+        :param pin_mode: Mode of the pin, one of the PIN_MODE_* constants. Digital outputs are rounded to 0 and 1.
+        :type pin_mode: str
+        :rtype: Profile
+        """
+        steps = PIN_RESOLUTIONS.get(pin_mode, 1)
+        values = numpy.round(self.values * steps) / steps
+        if not len(values):
+            return Profile(self.times, values)
+        keep = numpy.empty(len(values), dtype=bool)
+        keep[0] = True
+        numpy.not_equal(values[1:], values[:-1], out=keep[1:])
+        return Profile(self.times[keep], values[keep])
+
+    def to_sequence(self, name, pin_mode, sequence=None):
+        """ Adds the quantized profile to a sequence, starting at the current end of the sequence
+
+        The end of the sequence is moved to the time of the last value, so more can be added after it.
+
+        :param name: Name of the pin
+        :type name: str
+        :param pin_mode: Mode of the pin, see quantized
+        :type pin_mode: str
+        :param sequence: Sequence to add to, a new one by default
+        :type sequence: Sequence
+        :return: The sequence
+        :rtype: Sequence
+        """
+        if sequence is None:
+            sequence = Sequence()
+        profile = self.quantized(pin_mode)
+        if pin_mode == PIN_MODE_SERVO or pin_mode not in PIN_RESOLUTIONS:
+            values = profile.values.astype(numpy.int64).tolist()
+        else:
+            values = profile.values.tolist()
+        start = sequence.cursor
+        sequence.add_series(name, (profile.times + start).tolist(), values)
+        sequence.cursor = start + self.duration
+        return sequence
+
+    def play(self, board, name, **run_kwargs):
+        """ Plays the profile on a registered pin and waits until it's done
+
+        :param board: The board
+        :type board: Pyrduino
+        :param name: Name of a registered PWM or servo pin
+        :type name: str
+        :param run_kwargs: Arguments for Sequence.run
+        :return: How well the timing went
+        :rtype: SequenceReport
+        """
+        pin = board.get_registered_pin(name)
+        return self.to_sequence(name, pin.pin_mode).run(board, **run_kwargs)
+
+
+def move(start, end, duration, rate=DEFAULT_RATE, easing=linear_easing):
+    """ A move from one value to another
+
+    :param start: First value
+    :type start: float
+    :param end: Last value
+    :type end: float
+    :param duration: Seconds the move takes
+    :type duration: float
+    :param rate: Updates per second
+    :type rate: float
+    :param easing: Function mapping the progress in time (a NumPy array of 0.0-1.0) to the progress of the value,
+        e.g. ease_in_out
+    :return: The profile
+    :rtype: Profile
+    """
+    times = _times(duration, rate)
+    u = times / duration if duration > 0 else numpy.ones_like(times)
+    return Profile(times, start + (end - start) * easing(u))
+
+
+def linear(start, end, duration, rate=DEFAULT_RATE):
+    """ A move at a constant speed, refer to @move """
+    return move(start, end, duration, rate)
+
+
+def eased(start, end, duration, rate=DEFAULT_RATE):
+    """ A move that starts and stops gently, refer to @move """
+    return move(start, end, duration, rate, ease_in_out)
+
+
+def trapezoidal(start, end, duration, rate=DEFAULT_RATE, ramp=0.25):
+    """ A move with a constant acceleration, a constant speed and a constant deceleration
+
+    :param start: First value
+    :type start: float
+    :param end: Last value
+    :type end: float
+    :param duration: Seconds the move takes
+    :type duration: float
+    :param rate: Updates per second
+    :type rate: float
+    :param ramp: Part of the duration spent accelerating, and the same part decelerating, up to 0.5
+    :type ramp: float
+    :return: The profile
+    :rtype: Profile
+    """
+    assert 0 < ramp <= 0.5, 'Ramp must be more than 0 and at most half of the duration'
+
+    def easing(u):
+        # Top speed such that the area under the speed curve is 1
+        speed = 1 / (1 - ramp)
+        accelerating = speed * u * u / (2 * ramp)
+        cruising = speed * (u - ramp / 2)
+        decelerating = 1 - speed * (1 - u) ** 2 / (2 * ramp)
+        return numpy.where(u < ramp, accelerating, numpy.where(u > 1 - ramp, decelerating, cruising))
+    return move(start, end, duration, rate, easing)
+
+
+def waveform(values, rate=DEFAULT_RATE):
+    """ Arbitrary values played at a fixed rate
+
+    :param values: The values, e.g. a NumPy array
+    :param rate: Values per second
+    :type rate: float
+    :return: The profile
+    :rtype: Profile
+    """
+    _require_numpy()
+    values = numpy.asarray(values, dtype=numpy.float64)
+    return Profile(numpy.arange(len(values)) / float(rate), values)
+
+
+def _times(duration, rate):
+    """ Times of the updates of a move, the last one exactly at the end """
+    _require_numpy()
+    assert duration >= 0 and rate > 0, 'Duration must not be negative and rate must be positive'
+    count = max(int(math.ceil(duration * rate)), 1)
+    times = numpy.arange(count + 1) / float(rate)
+    times[-1] = duration
+    return times
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError('Motion profiles need NumPy, install it with: pip install numpy')
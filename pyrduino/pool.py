@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Many boards handled together.
+#
+# Every board is opened on its own thread, so a rack of boards gets ready in about the time of the slowest one.
+# After that each board keeps its own reader (the pyfirmata iterator thread of its Pyrduino) and its own writer
+# thread, so operations on all of the boards run side by side while the writes to any single board stay in order.
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .pyrduino import Pyrduino, PIN_TYPE_ANALOG, PIN_MODE_INPUT, READY_MODE_HANDSHAKE, logger
+
+
+class BoardPool:
+    """ A set of boards which can be driven together
+
+    with BoardPool([('/dev/ttyUSB0', BOARD_TYPE_ARDUINO_NANO), ('/dev/ttyACM0', BOARD_TYPE_ARDUINO_MEGA)]) as pool:
+        pool.register_pin(name='light', number=13)
+        pool.write_pin(name='light', value=1)
+    """
+    def __init__(self, boards, ready_timeout=10, require_all=True, **board_kwargs):
+        """ Constructor for the pool, opens all the boards in parallel
+
+        :param boards: (board_id, board_type) pairs
+        :type boards: list
+        :param ready_timeout: Seconds to wait for each board to answer the handshake
+        :type ready_timeout: float
+        :param require_all: Raise if any of the boards can't be opened. Otherwise the boards that failed are left out
+            and listed in failed.
+        :type require_all: bool
+        :param board_kwargs: Other arguments for every Pyrduino
+        """
+        self.boards = dict()
+        self.failed = dict()
+        self._workers = dict()
+
+        boards = list(boards)
+        if not boards:
+            return
+        # Handshaking is the default, but the caller may still ask for the sleeping
+        board_kwargs.setdefault('ready_mode', READY_MODE_HANDSHAKE)
+        with ThreadPoolExecutor(max_workers=len(boards), thread_name_prefix='pyrduino-connect') as executor:
+            futures = [(board_id, executor.submit(Pyrduino, board_id=board_id, board_type=board_type,
+                                                  ready_timeout=ready_timeout, **board_kwargs))
+                       for board_id, board_type in boards]
+            for board_id, future in futures:
+                try:
+                    self.boards[board_id] = future.result()
+                except Exception as e:
+                    logger.warning('Could not open board %s: %s', board_id, e)
+                    self.failed[board_id] = e
+
+        if self.failed and require_all:
+            self.close()
+            raise IOError('Could not open boards: {}'.format(
+                ', '.join('{} ({})'.format(board_id, e) for board_id, e in self.failed.items())))
+
+        for board_id in self.boards:
+            self._workers[board_id] = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pyrduino-writer')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getitem__(self, board_id):
+        return self.boards[board_id]
+
+    def __iter__(self):
+        return iter(self.boards.values())
+
+    def __len__(self):
+        return len(self.boards)
+
+    def close(self):
+        """ Waits for the queued work to finish and exits all the boards
+
+        :return: None
+        """
+        for worker in self._workers.values():
+            worker.shutdown(wait=True)
+        self._workers.clear()
+        for board in self.boards.values():
+            board.exit_board()
+
+    def submit(self, board_id, func, *args, **kwargs):
+        """ Runs func(board, *args, **kwargs) on the worker thread of one board
+
+        :param board_id: Id of the board
+        :type board_id: str
+        :param func: Function to run
+        :return: Future of the result
+        :rtype: concurrent.futures.Future
+        """
+        return self._workers[board_id].submit(func, self.boards[board_id], *args, **kwargs)
+
+    def map(self, func, *args, **kwargs):
+        """ Runs func(board, *args, **kwargs) for all the boards at the same time and waits for them all
+
+        :param func: Function to run
+        :return: Results by board id
+        :rtype: dict
+        :raises Exception: The first error, after all the boards are done
+        """
+        futures = [(board_id, self.submit(board_id, func, *args, **kwargs)) for board_id in self.boards]
+        results = dict()
+        error = None
+        for board_id, future in futures:
+            try:
+                results[board_id] = future.result()
+            except Exception as e:
+                logger.warning('Board %s failed: %s', board_id, e)
+                error = error or e
+        if error:
+            raise error
+        return results
+
+    def register_pin(self, *args, **kwargs):
+        """ Registers the same pin on all the boards, refer to @Pyrduino.register_pin """
+        self.map(Pyrduino.register_pin, *args, **kwargs)
+
+    def register_pins(self, spec):
+        """ Registers the same pins on all the boards, refer to @Pyrduino.register_pins """
+        self.map(Pyrduino.register_pins, spec)
+
+    def write_pin(self, name, value):
+        """ Writes a value to a pin on all the boards
+
+        :param name: Name of the pin, registered on every board
+        :type name: str
+        :param value: Value to write
+        :return: None
+        """
+        self.map(Pyrduino.write_pin, name, value)
+
+    def write_pins(self, values):
+        """ Writes values to pins on all the boards, refer to @Pyrduino.write_pins """
+        self.map(Pyrduino.write_pins, values)
+
+    def flush(self):
+        """ Sends the collected writes of all the boards, refer to @Pyrduino.flush """
+        self.map(Pyrduino.flush)
+
+    def snapshot(self, names=None):
+        """ The current values of the input pins of all the boards
+
+        The values come from what the reader threads of the boards have already received, so no board is asked for
+        anything and this doesn't wait behind queued writes.
+
+        :param names: Names of the pins to include, all the registered input pins (analog pins and digital inputs)
+            by default. Output pins named here give the value last written to them.
+        :type names: list
+        :return: Pin values by pin name by board id
+        :rtype: dict
+        """
+        snapshot = dict()
+        for board_id, board in self.boards.items():
+            pins = board.registered_pins
+            if names is None:
+                included = [name for name, pin in pins.items()
+                            if pin.pin_type == PIN_TYPE_ANALOG or pin.pin_mode == PIN_MODE_INPUT]
+            else:
+                included = names
+            snapshot[board_id] = dict((name, pins[name].read()) for name in included)
+        return snapshot
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+# Board profiles: the board and its named pins in a file instead of register_pin calls.
+#
+# A profile is a JSON, YAML or TOML file like:
+#
+#   {
+#       "board": {"type": "arduino", "port": "/dev/ttyUSB0", "ready_mode": "handshake"},
+#       "pins": {
+#           "beep": {"number": 9, "mode": "pwm", "initial": 0},
+#           "light": {"number": 13, "initial": 1},
+#           "button": {"number": 2, "mode": "input"},
+#           "temperature": {"number": 0, "type": "analog", "sampling_rate": 100}
+#       }
+#   }
+#
+# Everything in "board" other than the type and the port goes to Pyrduino as it is. Pin types and modes can be
+# written out or given as the PIN_TYPE_* and PIN_MODE_* letters.
+#
+# Checking the pins needs the capabilities of the board, which take a round-trip and a long answer to ask. They are
+# kept on disk by the type of the board and the name and version of its firmware, so after the first start only the
+# short firmware query is made. YAML needs PyYAML, TOML needs Python 3.11 or tomli.
+
+import json
+import os
+import re
+
+from .pyrduino import (Pyrduino, PIN_TYPE_ANALOG, PIN_TYPE_DIGITAL, PIN_MODE_INPUT, PIN_MODE_OUTPUT, PIN_MODE_SERVO,
+                       PIN_MODE_PWM, logger)
+from .sampling import DEFAULT_CAPACITY
+
+# Where the capabilities are kept by default
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+                                 'pyrduino', 'capabilities')
+
+# Profile words for the pin types and modes
+PIN_TYPE_NAMES = {
+    'analog': PIN_TYPE_ANALOG,
+    'digital': PIN_TYPE_DIGITAL
+}
+PIN_MODE_NAMES = {
+    'input': PIN_MODE_INPUT,
+    'output': PIN_MODE_OUTPUT,
+    'servo': PIN_MODE_SERVO,
+    'pwm': PIN_MODE_PWM
+}
+
+# The keys a pin can have
+PIN_KEYS = ['name', 'number', 'type', 'mode', 'initial', 'sampling_rate', 'capacity']
+
+
+class BoardProfile:
+    """ The board and the pins of a profile file
+
+    profile = BoardProfile.load('greenhouse.toml')
+    board = profile.open()
+    """
+    def __init__(self, data, source=None):
+        """ Constructor for the profile, checks the content
+
+        :param data: The parsed profile, see the top of this module
+        :type data: dict
+        :param source: Where the profile came from, for the error messages
+        :type source: str
+        """
+        self.source = source or 'profile'
+        if not isinstance(data, dict):
+            raise Exception('{} is not a dictionary'.format(self.source))
+        board = dict(data.get('board') or dict())
+        self.board_type = board.pop('type', None)
+        self.board_id = board.pop('port', None)
+        # The rest are Pyrduino arguments
+        self.options = board
+        self.pins = [self._parse_pin(pin) for pin in _pin_entries(data.get('pins'), self.source)]
+
+    @classmethod
+    def load(cls, path):
+        """ Reads a profile file, the format is told by the file extension (.json, .yaml, .yml or .toml)
+
+        :param path: Path of the file
+        :type path: str
+        :rtype: BoardProfile
+        """
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.json':
+            with open(path, 'r') as f:
+                data = json.load(f)
+        elif extension in ('.yaml', '.yml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('YAML profiles need PyYAML, install it with: pip install pyyaml')
+            with open(path, 'r') as f:
+                data = yaml.safe_load(f)
+        elif extension == '.toml':
+            try:
+                import tomllib
+            except ImportError:
+                try:
+                    import tomli as tomllib
+                except ImportError:
+                    raise ImportError('TOML profiles need Python 3.11 or tomli, install it with: pip install tomli')
+            with open(path, 'rb') as f:
+                data = tomllib.load(f)
+        else:
+            raise Exception('Unknown profile format: {}'.format(path))
+        return cls(data, source=path)
+
+    def _parse_pin(self, pin):
+        unknown = [key for key in pin if key not in PIN_KEYS]
+        if unknown:
+            raise Exception('Unknown keys for pin {} in {}: {}'.format(pin.get('name'), self.source, ', '.join(unknown)))
+        if 'name' not in pin or 'number' not in pin:
+            raise Exception('Every pin in {} needs a name and a number'.format(self.source))
+        pin = dict(pin)
+        pin['type'] = _lookup(PIN_TYPE_NAMES, pin.get('type', PIN_TYPE_DIGITAL), 'pin type', pin['name'])
+        pin['mode'] = _lookup(PIN_MODE_NAMES, pin.get('mode', PIN_MODE_INPUT if pin['type'] == PIN_TYPE_ANALOG
+                                                      else PIN_MODE_OUTPUT), 'pin mode', pin['name'])
+        if 'sampling_rate' in pin and pin['type'] != PIN_TYPE_ANALOG:
+            raise Exception('Only analog pins can be sampled, {} is not one'.format(pin['name']))
+        return pin
+
+    def pin_spec(self):
+        """ The pins as register_pins takes them
+
+        :rtype: list
+        """
+        return [(pin['name'], pin['number'], pin['type'], pin['mode']) for pin in self.pins]
+
+    def initial_values(self):
+        """ Values written to the pins right after registering them
+
+        :return: Values by pin name
+        :rtype: dict
+        """
+        return dict((pin['name'], pin['initial']) for pin in self.pins if pin.get('initial') is not None)
+
+    def open(self, board_id=None, cache=True, board_class=Pyrduino, **kwargs):
+        """ Creates the board, checks the pins against its capabilities, registers them, writes the initial values and
+        starts the sampling
+
+        :param board_id: Serial port, overrides the one of the profile
+        :type board_id: str
+        :param cache: Keep the capabilities of the board on disk: True for the default directory, a directory path,
+            a CapabilityCache, or False to always ask the board
+        :param board_class: Class of the board, Pyrduino or a subclass of it
+        :param kwargs: Pyrduino arguments, override the ones of the profile
+        :return: The board
+        :rtype: Pyrduino
+        """
+        board_id = board_id or self.board_id
+        if not board_id:
+            raise Exception('{} has no port, give the board_id'.format(self.source))
+        options = dict(self.options)
+        options.update(kwargs)
+        if self.board_type is not None:
+            options.setdefault('board_type', self.board_type)
+        board = board_class(board_id, **options)
+        try:
+            self._configure(board, _cache(cache))
+        except Exception:
+            board.exit_board()
+            raise
+        return board
+
+    def _configure(self, board, cache):
+        if cache is not None and not board._capabilities_queried:
+            cached = None
+            if board.query_firmware():
+                key = capability_key(board.board_type, board.firmware, board.firmware_version)
+                cached = cache.get(key)
+            if cached is not None:
+                board.use_capabilities(*cached)
+                logger.debug('Using the cached capabilities of {}'.format(key))
+            elif board.query_capabilities() and board.firmware is not None:
+                cache.put(key, board.capabilities, board.analog_mapping)
+        board.register_pins(self.pin_spec())
+        initial = self.initial_values()
+        if initial:
+            board.write_pins(initial)
+        sampled = [pin for pin in self.pins if pin.get('sampling_rate')]
+        if sampled:
+            # The board has a single sampling interval, so the fastest pin sets it for all of them
+            board.start_sampling([pin['name'] for pin in sampled], max(pin['sampling_rate'] for pin in sampled),
+                                 max(pin.get('capacity', DEFAULT_CAPACITY) for pin in sampled))
+        board.flush()
+
+
+class CapabilityCache:
+    """ Capability and analog mapping responses of boards in a directory, a JSON file for every key """
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        """
+        :param directory: Where the files are, created when needed
+        :type directory: str
+        """
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, re.sub(r'[^A-Za-z0-9_.-]+', '_', key) + '.json')
+
+    def get(self, key):
+        """ The cached responses
+
+        :param key: See capability_key
+        :type key: str
+        :return: Capabilities and analog mapping as parsed by the protocol module, or None if they aren't cached
+        :rtype: tuple
+        """
+        try:
+            with open(self._path(key), 'r') as f:
+                data = json.load(f)
+            # JSON keys are always strings
+            capabilities = dict((int(pin), dict((int(mode), resolution) for mode, resolution in modes.items()))
+                                for pin, modes in data['capabilities'].items())
+            analog_mapping = dict((int(channel), pin) for channel, pin in data['analog_mapping'].items())
+        except (IOError, ValueError, KeyError, AttributeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning('Ignoring the broken capability cache of {}: {}'.format(key, e))
+            return None
+        return capabilities, analog_mapping
+
+    def put(self, key, capabilities, analog_mapping):
+        """ Stores the responses
+
+        :param key: See capability_key
+        :type key: str
+        :param capabilities: Parsed capability response
+        :type capabilities: dict
+        :param analog_mapping: Parsed analog mapping response
+        :type analog_mapping: dict
+        :return: None
+        """
+        path = self._path(key)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            # Written next to the real file and renamed, so a reader never sees half of it
+            with open(path + '.tmp', 'w') as f:
+                json.dump({'key': key, 'capabilities': capabilities, 'analog_mapping': analog_mapping}, f)
+            os.replace(path + '.tmp', path)
+        except (IOError, OSError) as e:
+            logger.warning('Could not cache the capabilities of {}: {}'.format(key, e))
+
+    def clear(self):
+        """ Forgets all the cached responses, e.g. after flashing a board with a new build of the same firmware
+
+        :return: None
+        """
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.directory, name))
+
+
+def open_profile(profile, board_id=None, cache=True, board_class=Pyrduino, **kwargs):
+    """ Creates a board from a profile, refer to @BoardProfile.open
+
+    :param profile: A BoardProfile, the path of a profile file or the parsed content of one
+    :return: The board
+    :rtype: Pyrduino
+    """
+    if isinstance(profile, str):
+        profile = BoardProfile.load(profile)
+    elif isinstance(profile, dict):
+        profile = BoardProfile(profile)
+    return profile.open(board_id, cache, board_class, **kwargs)
+
+
+def capability_key(board_type, firmware, firmware_version):
+    """ The cache key of a board: the same firmware has different pins on different boards
+
+    :rtype: str
+    """
+    return '{}-{}-{}'.format(board_type, firmware, '.'.join(str(part) for part in firmware_version))
+
+
+def _cache(cache):
+    if cache is True:
+        return CapabilityCache()
+    if not cache:
+        return None
+    if isinstance(cache, str):
+        return CapabilityCache(cache)
+    return cache
+
+
+def _pin_entries(pins, source):
+    """ The pins of a profile as a list of dicts with names, from either a list or a dict by name """
+    if pins is None:
+        return list()
+    if isinstance(pins, dict):
+        entries = list()
+        for name, pin in pins.items():
+            if not isinstance(pin, dict):
+                raise Exception('Pin {} in {} is not a dictionary'.format(name, source))
+            pin = dict(pin)
+            pin.setdefault('name', name)
+            entries.append(pin)
+        return entries
+    if isinstance(pins, list) and all(isinstance(pin, dict) for pin in pins):
+        return pins
+    raise Exception('Pins of {} must be a list or a dictionary of pins'.format(source))
+
+
+def _lookup(names, value, what, pin_name):
+    """ The PIN_TYPE_* or PIN_MODE_* value of a profile word or letter """
+    if value in names.values():
+        return value
+    try:
+        return names[str(value).lower()]
+    except KeyError:
+        raise Exception('Unknown {} for pin {}: {}'.format(what, pin_name, value))
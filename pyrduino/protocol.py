@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+# Helpers for building and parsing raw Firmata messages.
+# pyfirmata sends every message on its own, these let us put many of them into a single serial write.
+
+from pyfirmata.pyfirmata import (ANALOG_MAPPING_QUERY, ANALOG_MAPPING_RESPONSE, ANALOG_MESSAGE,
+                                 CAPABILITY_QUERY, CAPABILITY_RESPONSE, DIGITAL_MESSAGE, END_SYSEX, EXTENDED_ANALOG,
+                                 PIN_STATE_QUERY, PIN_STATE_RESPONSE, REPORT_ANALOG, REPORT_DIGITAL, REPORT_FIRMWARE,
+                                 REPORT_VERSION, SAMPLING_INTERVAL, SERVO_CONFIG, SET_PIN_MODE, START_SYSEX,
+                                 SYSTEM_RESET, UNAVAILABLE, INPUT, OUTPUT, ANALOG, PWM, SERVO)
+
+# Not defined by pyfirmata, sets the value of a single digital pin instead of a whole port
+SET_DIGITAL_PIN_VALUE = 0xF5
+
+# Commands which carry a pin or port number in their lower 4 bits
+CHANNEL_COMMANDS = (DIGITAL_MESSAGE, ANALOG_MESSAGE, REPORT_ANALOG, REPORT_DIGITAL)
+
+# Number of data bytes following each command, the same command can have a different length depending on who sends it
+BOARD_MESSAGE_LENGTHS = {
+    DIGITAL_MESSAGE: 2,
+    ANALOG_MESSAGE: 2,
+    REPORT_VERSION: 2
+}
+HOST_MESSAGE_LENGTHS = {
+    DIGITAL_MESSAGE: 2,
+    ANALOG_MESSAGE: 2,
+    REPORT_ANALOG: 1,
+    REPORT_DIGITAL: 1,
+    SET_PIN_MODE: 2,
+    SET_DIGITAL_PIN_VALUE: 2,
+    REPORT_VERSION: 0,
+    SYSTEM_RESET: 0
+}
+
+# Marks the end of one pin in the capability response and a non analog pin in the analog mapping response
+CAPABILITY_PIN_END = 0x7F
+NO_ANALOG_CHANNEL = 0x7F
+
+
+def sysex(command, data=()):
+    """ Builds a SysEx message
+
+    :param command: SysEx command byte
+    :type command: int
+    :param data: 7-bit data bytes
+    :return: The message
+    :rtype: bytearray
+    """
+    msg = bytearray([START_SYSEX, command])
+    msg.extend(data)
+    msg.append(END_SYSEX)
+    return msg
+
+
+def capability_queries():
+    """ Both of the queries needed to know what the pins of a board can do, as a single message
+
+    :return: Capability and analog mapping queries
+    :rtype: bytearray
+    """
+    return sysex(CAPABILITY_QUERY) + sysex(ANALOG_MAPPING_QUERY)
+
+
+def set_pin_mode(pin_number, mode):
+    """ Builds a SET_PIN_MODE message
+
+    :param pin_number: Number of the (digital) pin
+    :type pin_number: int
+    :param mode: One of the Firmata pin modes (INPUT, OUTPUT, ANALOG, PWM, SERVO)
+    :type mode: int
+    :rtype: bytearray
+    """
+    return bytearray([SET_PIN_MODE, pin_number, mode])
+
+
+def report_analog(channel, enable=True):
+    """ Builds a message to turn reporting of an analog channel on or off
+
+    :rtype: bytearray
+    """
+    return bytearray([REPORT_ANALOG + channel, int(enable)])
+
+
+def report_digital(port_number, enable=True):
+    """ Builds a message to turn reporting of a digital port on or off
+
+    :rtype: bytearray
+    """
+    return bytearray([REPORT_DIGITAL + port_number, int(enable)])
+
+
+def servo_config(pin_number, min_pulse=544, max_pulse=2400):
+    """ Builds a SERVO_CONFIG message, the defaults are the same as in Arduino and pyfirmata
+
+    :rtype: bytearray
+    """
+    return sysex(SERVO_CONFIG, [pin_number, min_pulse % 128, min_pulse >> 7, max_pulse % 128, max_pulse >> 7])
+
+
+def digital_port(port_number, mask):
+    """ Builds a DIGITAL_MESSAGE which sets all the output pins of an 8 pin port at once
+
+    :param port_number: Number of the port (pin number // 8)
+    :type port_number: int
+    :param mask: Bit mask of the pin states, lowest bit is the first pin of the port
+    :type mask: int
+    :rtype: bytearray
+    """
+    return bytearray([DIGITAL_MESSAGE + port_number, mask % 128, mask >> 7])
+
+
+def analog_write(pin_number, value):
+    """ Builds a message to write a PWM duty or a servo angle to a pin
+
+    ANALOG_MESSAGE only has room for pins 0-15, so the extended analog SysEx is used for the rest.
+
+    :param pin_number: Number of the pin
+    :type pin_number: int
+    :param value: Integer value to write
+    :type value: int
+    :rtype: bytearray
+    """
+    if pin_number < 16:
+        return bytearray([ANALOG_MESSAGE + pin_number, value % 128, value >> 7])
+    return sysex(EXTENDED_ANALOG, [pin_number, value % 128, value >> 7])
+
+
+def sampling_interval(milliseconds):
+    """ Builds a SAMPLING_INTERVAL message, which sets how often the board reports its analog inputs
+
+    :param milliseconds: Interval, StandardFirmata goes down to 1 ms and defaults to 19 ms
+    :type milliseconds: int
+    :rtype: bytearray
+    """
+    return sysex(SAMPLING_INTERVAL, [milliseconds % 128, milliseconds >> 7])
+
+
+def parse_capability_response(data):
+    """ Parses the data of a CAPABILITY_RESPONSE
+
+    :param data: The bytes between the command byte and END_SYSEX
+    :return: Supported modes of every pin, e.g. {13: {0: 1, 1: 1, 3: 8}} means that pin 13 supports
+        input, output and PWM with 8 bit resolution
+    :rtype: dict
+    """
+    capabilities = dict()
+    pin_number = 0
+    modes = dict()
+    position = 0
+    while position < len(data):
+        if data[position] == CAPABILITY_PIN_END:
+            capabilities[pin_number] = modes
+            pin_number += 1
+            modes = dict()
+            position += 1
+        else:
+            # Mode and resolution always come in pairs
+            modes[data[position]] = data[position + 1] if position + 1 < len(data) else 0
+            position += 2
+    return capabilities
+
+
+def parse_analog_mapping_response(data):
+    """ Parses the data of an ANALOG_MAPPING_RESPONSE
+
+    :param data: The bytes between the command byte and END_SYSEX
+    :return: Analog channel numbers mapped to pin numbers, e.g. {0: 54} on a Mega
+    :rtype: dict
+    """
+    return dict((channel, pin_number) for pin_number, channel in enumerate(data) if channel != NO_ANALOG_CHANNEL)
+
+
+def two_byte_value(data):
+    """ The 14 bit value of a 7-bit lsb, msb pair
+
+    :rtype: int
+    """
+    return data[0] | (data[1] << 7)
+
+
+class FirmataParser:
+    """ Incremental Firmata parser
+
+    Bytes can be fed in whatever pieces they happen to arrive in, whole messages come out as
+    (command, channel, data) tuples. command is the command byte without the channel, channel is the pin or port
+    number for the commands that have one and the SysEx command for SysEx messages (where command is START_SYSEX),
+    otherwise None. data is a bytes object of the data bytes.
+    """
+    def __init__(self, message_lengths=None):
+        """ Constructor for the parser
+
+        :param message_lengths: Data byte counts by command, BOARD_MESSAGE_LENGTHS for parsing what a board sends
+            (default) or HOST_MESSAGE_LENGTHS for parsing what a host sends
+        :type message_lengths: dict
+        """
+        self.message_lengths = BOARD_MESSAGE_LENGTHS if message_lengths is None else message_lengths
+        self._command = None
+        self._channel = None
+        self._needed = 0
+        self._data = bytearray()
+        self._in_sysex = False
+
+    def feed(self, data):
+        """ Parses some more bytes
+
+        :param data: Bytes read from the serial port
+        :type data: bytes
+        :return: The messages completed by these bytes
+        :rtype: list
+        """
+        messages = list()
+        for byte in data:
+            if byte < 0x80:
+                if self._in_sysex:
+                    if self._channel is None:
+                        self._channel = byte
+                    else:
+                        self._data.append(byte)
+                elif self._command is not None:
+                    self._data.append(byte)
+                    if len(self._data) == self._needed:
+                        messages.append((self._command, self._channel, bytes(self._data)))
+                        self._command = None
+                # Data bytes without a command we know are just skipped
+            elif byte == START_SYSEX:
+                self._in_sysex = True
+                self._command = None
+                self._channel = None
+                self._data = bytearray()
+            elif byte == END_SYSEX:
+                if self._in_sysex and self._channel is not None:
+                    messages.append((START_SYSEX, self._channel, bytes(self._data)))
+                self._in_sysex = False
+            else:
+                self._in_sysex = False
+                command, channel = (byte & 0xF0, byte & 0x0F) if byte < START_SYSEX else (byte, None)
+                needed = self.message_lengths.get(command)
+                if needed is None:
+                    self._command = None
+                elif needed == 0:
+                    self._command = None
+                    messages.append((command, channel, b''))
+                else:
+                    self._command = command
+                    self._channel = channel
+                    self._needed = needed
+                    self._data = bytearray()
+        return messages
@@ -1,26 +1,71 @@
 # -*- coding: utf-8 -*-
 import time
 import logging
+import numbers
 import sys
+import threading
+import queue
+from contextlib import contextmanager
 
 logger = logging.getLogger('Pyrduino')
-logger.setLevel(logging.DEBUG)
-logger.addHandler(logging.StreamHandler(sys.stdout))
+# Handler added by enable_console_logging, None until someone asks for it
+_console_handler = None
 
-from dotmap import DotMap
-from pyfirmata import Arduino, ArduinoMega, ArduinoNano, ArduinoDue, util
+import serial
+from pyfirmata import Arduino, ArduinoMega, ArduinoNano, ArduinoDue, BOARDS
+from pyfirmata.pyfirmata import (REPORT_VERSION, UNAVAILABLE, DIGITAL, OUTPUT, PWM, SERVO, DIGITAL_MESSAGE,
+                                 ANALOG_MESSAGE)
+
+from . import protocol
+from .sampling import SampleBuffer, DEFAULT_CAPACITY
+from .stats import Stats, CountingSerial, timed_iterate
+from .link import BufferedLink, DEFAULT_FLUSH_THRESHOLD
 
 BOARD_TYPE_ARDUINO = 'arduino'
 BOARD_TYPE_ARDUINO_MEGA = 'mega'
 BOARD_TYPE_ARDUINO_NANO = 'nano'
 BOARD_TYPE_ARDUINO_DUE = 'due'
+# A software board looking like an Arduino Uno, see pyrduino.sim
+BOARD_TYPE_SIM = 'sim'
 BOARD_TYPES = [
     BOARD_TYPE_ARDUINO,
     BOARD_TYPE_ARDUINO_MEGA,
     BOARD_TYPE_ARDUINO_NANO,
-    BOARD_TYPE_ARDUINO_DUE
+    BOARD_TYPE_ARDUINO_DUE,
+    BOARD_TYPE_SIM
+]
+
+# Lookup table to get different types of board classes from board type choices
+BOARD_CLASSES = {
+    BOARD_TYPE_ARDUINO: Arduino,
+    BOARD_TYPE_ARDUINO_MEGA: ArduinoMega,
+    BOARD_TYPE_ARDUINO_NANO: ArduinoNano,
+    BOARD_TYPE_ARDUINO_DUE: ArduinoDue,
+    BOARD_TYPE_SIM: Arduino
+}
+
+# The same board types as pyfirmata layouts, used when we set up the board ourselves
+BOARD_LAYOUTS = {
+    BOARD_TYPE_ARDUINO: BOARDS['arduino'],
+    BOARD_TYPE_ARDUINO_MEGA: BOARDS['arduino_mega'],
+    BOARD_TYPE_ARDUINO_NANO: BOARDS['arduino_nano'],
+    BOARD_TYPE_ARDUINO_DUE: BOARDS['arduino_due'],
+    BOARD_TYPE_SIM: BOARDS['arduino']
+}
+
+# How to decide that the board is ready to be used:
+# 'sleep' waits a fixed amount of time (the pyfirmata way),
+# 'handshake' waits only until the board answers to a Firmata version query
+READY_MODE_SLEEP = 'sleep'
+READY_MODE_HANDSHAKE = 'handshake'
+READY_MODES = [
+    READY_MODE_SLEEP,
+    READY_MODE_HANDSHAKE
 ]
 
+# Seconds between the version queries sent while waiting for the handshake
+HANDSHAKE_QUERY_INTERVAL = 0.25
+
 # These literals will actually be forming parts of the string for getting a pin from pyfirmata board instance
 PIN_TYPE_ANALOG = 'a'
 PIN_TYPE_DIGITAL = 'd'
@@ -30,57 +75,425 @@ PIN_MODE_OUTPUT = 'o'
 PIN_MODE_SERVO = 's'
 PIN_MODE_PWM = 'p'
 
+# Our pin modes as the Firmata pin modes the capability response talks about
+FIRMATA_PIN_MODES = {
+    PIN_MODE_INPUT: protocol.INPUT,
+    PIN_MODE_OUTPUT: protocol.OUTPUT,
+    PIN_MODE_SERVO: protocol.SERVO,
+    PIN_MODE_PWM: protocol.PWM
+}
+
+# Which way a value has to change to trigger a change callback
+EDGE_RISING = 'rising'
+EDGE_FALLING = 'falling'
+EDGE_BOTH = 'both'
+EDGES = [
+    EDGE_RISING,
+    EDGE_FALLING,
+    EDGE_BOTH
+]
+
+# Speed of the serial link, the same as the StandardFirmata default
+DEFAULT_BAUDRATE = 57600
+
+# Seconds to wait for the capability and analog mapping responses
+CAPABILITY_QUERY_TIMEOUT = 2
+
+# Analog samples per second recorded by start_sampling, 1 ms is the shortest interval Firmata has
+DEFAULT_SAMPLING_RATE = 1000
+
+
+class PinRegistrationError(Exception):
+    """ Raised when pins can not be registered, errors has a message for every invalid pin """
+    def __init__(self, errors):
+        self.errors = errors
+        super(PinRegistrationError, self).__init__('Could not register pins:\n' + '\n'.join(errors))
+
 
 class Pyrduino:
-    def __init__(self, board_id, board_type=BOARD_TYPE_ARDUINO, loglevel=logging.DEBUG):
+    def __init__(self, board_id, board_type=BOARD_TYPE_ARDUINO, loglevel=None,
+                 ready_mode=READY_MODE_SLEEP, ready_timeout=10, write_cache=False, write_cache_epsilon=0.0,
+                 transport=None, stats=False, baudrate=DEFAULT_BAUDRATE, timeout=None, write_timeout=None,
+                 write_buffering=False, flush_threshold=DEFAULT_FLUSH_THRESHOLD, thread_safe=False, reconnect=False):
         """ Constructor for the board controller
 
         :param board_id: Id of the board. In Windows, usually 'COM3' or similar, in Linux usually /dev/ttyXXX
         :type board_id: str
         :param board_type: Type of the board. One of the constant values defined in the beginning of this file.
         :type board_type: str
-        :param loglevel: Log level
-        :type loglevel: One of the Python's logging package log levels. (Default: logging.DEBUG)
-        """
-        # Let's set up a lookup table to get different types of board classes from board type choices
-        board_type_lookup_table = {
-            BOARD_TYPE_ARDUINO: Arduino,
-            BOARD_TYPE_ARDUINO_MEGA: ArduinoMega,
-            BOARD_TYPE_ARDUINO_NANO: ArduinoNano,
-            BOARD_TYPE_ARDUINO_DUE: ArduinoDue
-        }
-        # Now let us get the board type class from the lookup table and instantiate it with board id
-        # This is a shortcut for if-else clauses and a shorter version of this:
-        # board_class = board_type_lookup_table[board_type]
-        # self.board = board_class(board_id)
-
-        # Let's assume that the board can't be created and declare a None instance
+        :param loglevel: Log level for the 'Pyrduino' logger. Nothing is printed unless the application configures
+            logging or calls enable_console_logging. (Default: None, leave the logger as it is)
+        :type loglevel: One of the Python's logging package log levels
+        :param ready_mode: How to wait for the board to get ready. One of the READY_MODE_* constants.
+            With 'handshake' the constructor returns as soon as the board answers and pins are registered
+            without any extra sleeping. (Default: 'sleep')
+        :type ready_mode: str
+        :param ready_timeout: Seconds to wait for the handshake before giving up, only used with 'handshake'
+        :type ready_timeout: float
+        :param write_cache: Remember the last value written to each pin and skip writes that would not change it
+        :type write_cache: bool
+        :param write_cache_epsilon: PWM and servo writes closer than this to the last value are skipped too
+        :type write_cache_epsilon: float
+        :param transport: Something to talk to the board through instead of opening board_id as a serial port.
+            Anything with the read, write, inWaiting and close methods of serial.Serial will do, for example a
+            pyrduino.sim.LoopbackTransport. The board is always handshaked when a transport is given.
+        :param stats: Collect statistics of the traffic and timing from the start, see enable_stats
+        :type stats: bool
+        :param baudrate: Speed of the serial port, has to match the Firmata sketch on the board
+        :type baudrate: int
+        :param timeout: Seconds a serial read waits for data, None waits forever
+        :type timeout: float
+        :param write_timeout: Seconds a serial write waits to get its data out, None waits forever
+        :type write_timeout: float
+        :param write_buffering: Collect the outgoing messages and send them together when flush is called or when
+            flush_threshold bytes have been collected. Without this only the writes inside batch blocks are collected.
+        :type write_buffering: bool
+        :param flush_threshold: Bytes collected before they are sent without waiting for a flush
+        :type flush_threshold: int
+        :param thread_safe: Let many threads use the board at once. All the writes are queued to a writer thread of
+            the board, which keeps the messages whole and in order, every thread has its own last pin name and
+            snapshot gives the input values as a consistent set.
+        :type thread_safe: bool
+        :param reconnect: Watch the connection and open it again if it's lost, with the default settings of
+            supervise. Use supervise instead to change them.
+        :type reconnect: bool
+        """
+        # Let's assume that the board can't be created and declare None instances first, so exit_board (and __del__)
+        # can deal with a board whose constructor failed
         self.board = None
+        # Writer thread and its queue of (function, arguments), only in the thread safe mode
+        self._writes = None
+        self._writer = None
+        self._writer_ident = None
+        # Reader thread, and the supervisor reopening the connection when it's lost, None unless asked for
+        self._reader = None
+        self._supervisor = None
+        assert ready_mode in READY_MODES, 'Unknown ready mode: {}'.format(ready_mode)
+        if board_type == BOARD_TYPE_SIM or transport is not None:
+            # There is nothing to wait for with a simulated board or an already open connection
+            ready_mode = READY_MODE_HANDSHAKE
+        self.set_loglevel(loglevel)
+        self.board_id = board_id
+        self.board_type = board_type
+        self.ready_mode = ready_mode
+        # Kept for opening the port again
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.write_timeout = write_timeout
+        self.transport = transport
+
         try:
-            self.board = board_type_lookup_table[board_type](board_id)
+            if ready_mode == READY_MODE_HANDSHAKE:
+                self.board = _open_board(board_type, board_id, ready_timeout, transport, baudrate, timeout,
+                                         write_timeout)
+            else:
+                # Now let us get the board type class from the lookup table and instantiate it with board id
+                # This is a shortcut for if-else clauses and a shorter version of this:
+                # board_class = BOARD_CLASSES[board_type]
+                # self.board = board_class(board_id)
+                self.board = BOARD_CLASSES[board_type](board_id, baudrate=baudrate, timeout=timeout)
+                if write_timeout is not None:
+                    self.board.sp.write_timeout = write_timeout
             logger.debug('Registered a board with type: {} id: {}'.format(board_type, board_id))
         except Exception as e:
             raise e
 
-        # Give the board some time to synchronize
-        time.sleep(5)
+        if ready_mode == READY_MODE_SLEEP:
+            # pyfirmata keeps the command handlers in a class level dictionary, let's give every board its own
+            self.board._command_handlers = dict(self.board._command_handlers)
+            # Give the board some time to synchronize
+            time.sleep(5)
 
-        # Let's start the iterator so the board read values can be passed to pyfirmata
-        it = util.Iterator(self.board)
-        it.start()
+        # All the writes, including the ones pyfirmata makes, go through the link so they can be buffered
+        self.board.sp = BufferedLink(self.board.sp, flush_threshold)
+        self.write_buffering = write_buffering
+        self._batch_depth = 0
+        self._batch_lock = threading.Lock()
+        if write_buffering:
+            self.board.sp.set_buffering(True)
 
         # Dictionary for storing registered ports by name
         self.registered_pins = dict()
 
+        # In the thread safe mode every thread has its own last pin name in _local and this stays None
         self.last_pin_name = None
+        self._local = None
+
+        self.thread_safe = thread_safe
+        # Values of the input pins by name, replaced as a whole by the reader thread in the thread safe mode
+        self._input_pins = ()
+        self._snapshot = dict()
+
+        # Shadow state of the written values, the counters tell how many writes were skipped (hits) or sent (misses)
+        self.write_cache = write_cache
+        self.write_cache_epsilon = write_cache_epsilon
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # What the pins of the board can do, filled by query_capabilities
+        self.capabilities = None
+        self.analog_mapping = None
+        self._capabilities_queried = False
+        self._capability_event = threading.Event()
+        self._analog_mapping_event = threading.Event()
+        # Name and (major, minor) version of the firmware, filled by query_firmware
+        self.firmware = None
+        self.firmware_version = None
+        self._firmware_event = threading.Event()
+
+        # Change callbacks by digital port number and analog pin number. The lists are replaced instead of
+        # modified, so the reader thread can go through them without locking.
+        self._inputs_watched = False
+        self._digital_callbacks = dict()
+        self._analog_callbacks = dict()
+        # Functions called with the pins after every write, replaced instead of modified like the callbacks
+        self._write_listeners = ()
+
+        # Sample buffers by analog pin number, replaced instead of modified like the callbacks
+        self._samplers = dict()
+        # Milliseconds set by start_sampling, None while the board uses its default
+        self._sampling_interval = None
+
+        # Statistics, None when they are not collected
+        self._stats = None
+        if stats:
+            self.enable_stats()
+
+        if thread_safe:
+            self._start_writer()
+
+        # Let's start the reader so the board read values can be passed to pyfirmata
+        self._start_reader()
+
+        if reconnect:
+            self.supervise()
+
+    def set_loglevel(self, loglevel):
+        """ Sets the level of the 'Pyrduino' logger
+
+        Read and write methods check the level before formatting anything, so they cost next to nothing when debug
+        logging is off. Configuring logging elsewhere works as well, the level is checked on every call.
+
+        :param loglevel: One of the Python's logging package log levels or None to keep the current level
+        :return: None
+        """
+        if loglevel is not None:
+            logger.setLevel(loglevel)
+
+    def enable_stats(self, enabled=True):
+        """ Starts or stops collecting statistics: per pin read and write counts, bytes both ways, serial write
+        time, time spent on every incoming message and the bytes waiting behind it, and change callback time
+
+        Collecting wraps the serial port and the reader of the board, so it costs a little on every byte and message.
+        When it's off nothing is wrapped. Stopping throws the collected statistics away.
+
+        :param enabled: Collect or not
+        :type enabled: bool
+        :return: None
+        """
+        if enabled and self._stats is None:
+            stats = Stats(self.board_id)
+            # Count under the link, so the buffered writes are timed when they really go out
+            self.board.sp.attach(CountingSerial(self.board.sp.sp, stats))
+            # The reader thread calls board.iterate, an instance attribute goes in front of the method
+            self.board.iterate = timed_iterate(self.board, stats)
+            self._stats = stats
+        elif not enabled and self._stats is not None:
+            self._stats = None
+            del self.board.iterate
+            self.board.sp.attach(self.board.sp.sp.sp)
+
+    def stats(self):
+        """ The statistics collected since enable_stats or their last reset
+
+        stats = board.stats()
+        stats.snapshot()    # Everything as a dict
+        stats.prometheus()  # Everything in the Prometheus text format
+        stats.reset()       # Start over
+
+        :rtype: pyrduino.stats.Stats
+        """
+        if self._stats is None:
+            raise Exception('Statistics are not collected, call enable_stats first')
+        return self._stats
+
+    def flush(self):
+        """ Sends the collected writes when write buffering is on
+
+        :return: None
+        """
+        self._on_writer(self.board.sp.flush)
+
+    @contextmanager
+    def batch(self):
+        """ Collects all the writes made inside the block and sends them in one go when the block ends
+
+        with board.batch():
+            board.write_pin('red', 1)
+            board.write_pin('green', 0)
+
+        Blocks can be nested, the writes go out at the end of the outermost one.
+        """
+        link = self.board.sp
+        with self._batch_lock:
+            self._batch_depth += 1
+            if self._batch_depth == 1 and not self.write_buffering:
+                self._on_writer(link.set_buffering, True)
+        try:
+            yield self
+        finally:
+            with self._batch_lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    if self.write_buffering:
+                        self._on_writer(link.flush)
+                    else:
+                        self._on_writer(link.set_buffering, False)
+
+    def _start_writer(self):
+        """ Starts the writer thread of the thread safe mode and sends all the writes through it
+
+        :return: None
+        """
+        self._local = threading.local()
+        self._writes = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._writer_loop, name='pyrduino-writer')
+        self._writer.daemon = True
+        self._writer.start()
+        self._writer_ident = self._writer.ident
+        # pyfirmata writes to the port directly, so the queueing has to happen in the link
+        self.board.sp.set_redirect(self._queue_send)
+        # Keep the input snapshot up to date
+        self._watch_inputs()
+
+    def _writer_loop(self):
+        while True:
+            func, args = self._writes.get()
+            if func is None:
+                return
+            try:
+                func(*args)
+            except Exception:
+                # Nobody is there to catch it, and the writes after this one should still go out
+                logger.exception('Write to board {} failed'.format(self.board_id))
+
+    def _queue_send(self, data):
+        # Messages made on the writer thread go out right away, the rest wait for their turn
+        if threading.get_ident() == self._writer_ident:
+            self.board.sp.send(data)
+        else:
+            self._writes.put((self.board.sp.send, (bytes(data), )))
+
+    def _on_writer(self, func, *args):
+        """ Calls func on the writer thread after the writes queued so far, or right away without one
+
+        :return: None
+        """
+        if self._writes is not None and threading.get_ident() != self._writer_ident:
+            self._writes.put((func, args))
+        else:
+            func(*args)
+
+    def wait_writes(self, timeout=None):
+        """ Waits until the writes queued so far have been sent, only needed in the thread safe mode
+
+        :param timeout: Seconds to wait at most
+        :type timeout: float
+        :return: True if the writes were sent
+        :rtype: bool
+        """
+        if self._writes is None or threading.get_ident() == self._writer_ident:
+            return True
+        done = threading.Event()
+        self._writes.put((done.set, ()))
+        return done.wait(timeout)
+
+    def _start_reader(self):
+        """ Starts a reader thread for the current serial port, the old one must have stopped
+
+        :return: None
+        """
+        self._reader = _Reader(self.board)
+        self._reader.start()
+
+    def supervise(self, **kwargs):
+        """ Starts watching the connection to the board and opening it again when it's lost
+
+        A lost connection is noticed from a failed write, the reader thread stopping on an error, or the board not
+        answering to the heartbeat version queries. The port is then opened again with a growing delay between the
+        attempts, and once the board answers, the modes of all the registered pins and the values of the outputs
+        are sent to it in one write. Meanwhile the writes wait, at most stall_timeout seconds, and the reads give
+        the last known values. Refer to @pyrduino.supervisor.Supervisor for the arguments.
+
+        :return: The supervisor
+        :rtype: pyrduino.supervisor.Supervisor
+        """
+        if self._supervisor is None:
+            # Imported here, since the supervisor imports this module
+            from .supervisor import Supervisor
+            self._supervisor = Supervisor(self, **kwargs)
+        return self._supervisor
+
+    @property
+    def connected(self):
+        """ False while a supervised board is being reconnected """
+        return self.board.sp.online.is_set()
+
+    def _state_messages(self):
+        """ The messages that bring a freshly reset board to the state of the registered pins
+
+        :return: Pin modes, reporting, output values and the sampling interval as one bytearray
+        :rtype: bytearray
+        """
+        msg = bytearray()
+        output_ports = list()
+        reporting_ports = list()
+        for pin in self.registered_pins.values():
+            actual_pin = pin.pin
+            if pin.pin_type == PIN_TYPE_ANALOG:
+                if actual_pin.reporting:
+                    msg += protocol.report_analog(pin.number)
+                continue
+            mode = actual_pin.mode
+            msg += protocol.servo_config(pin.number) if mode == SERVO else protocol.set_pin_mode(pin.number, mode)
+            if mode == OUTPUT:
+                # The digital outputs are written a port at a time after the modes are known
+                if actual_pin.port not in output_ports:
+                    output_ports.append(actual_pin.port)
+            elif mode == PWM and actual_pin.value is not None:
+                msg += protocol.analog_write(pin.number, int(round(actual_pin.value * 255)))
+            elif mode == SERVO and actual_pin.value is not None:
+                msg += protocol.analog_write(pin.number, int(actual_pin.value))
+            elif actual_pin.reporting and actual_pin.port not in reporting_ports:
+                reporting_ports.append(actual_pin.port)
+        for port in output_ports:
+            msg += protocol.digital_port(port.port_number, _port_mask(port))
+        for port in reporting_ports:
+            msg += protocol.report_digital(port.port_number)
+        if self._sampling_interval is not None:
+            msg += protocol.sampling_interval(self._sampling_interval)
+        return msg
 
     def exit_board(self):
         """ Just a method for convenience to exit the board
 
         :return: None
         """
+        # getattr, since the constructor may have failed before anything was set
+        if getattr(self, '_supervisor', None) is not None:
+            self._supervisor.stop()
+            self._supervisor = None
+        if getattr(self, '_writer', None) is not None:
+            # Let the queued writes go out first
+            writer, self._writer = self._writer, None
+            self._writes.put((None, None))
+            if writer is not threading.current_thread():
+                writer.join()
+            self.board.sp.set_redirect(None)
         # Only call exit if the board exists
-        if self.board:
+        if getattr(self, 'board', None):
+            if self._reader is not None:
+                self._reader.stop()
             self.board.exit()
 
     def __del__(self):
@@ -99,24 +512,221 @@ class Pyrduino:
         :type number: int
         :param pin_type: Type of the pin (digital, analog)
         :param pin_mode: Mode of the pin (input, output, servo, pwm)
-        :return: None
+        :return: The registered pin, which can also be used directly for reading and writing
+        :rtype: Pin
         """
-        # Let's make our pin DotMap (an enhanced version of Python dictionary)
-        pin = DotMap()
-        # Assign a number and a pin type and mode
-        pin.number = number
-        pin.pin_type = pin_type
-        pin.pin_mode = pin_mode
         # Let's create the actual pin and store that too, The format is for example 'd:13:i'
         pin_string = '{}:{}:{}'.format(pin_type, str(number), pin_mode)
         logger.debug('Registering a pin with string: ' + pin_string + ' with name: ' + name)
         actual_pin = self.board.get_pin(pin_string)
-        pin.pin = actual_pin
-        time.sleep(1)
+        if self.ready_mode == READY_MODE_SLEEP:
+            # A handshaked board is already in sync, only the blind mode needs to wait here
+            time.sleep(1)
+        return self._add_registered_pin(name, number, pin_type, pin_mode, actual_pin)
+
+    def _add_registered_pin(self, name, number, pin_type, pin_mode, actual_pin):
+        """ Stores an already configured pyfirmata pin with a name
+
+        :return: The registered pin
+        :rtype: Pin
+        """
+        pin = Pin(self, name, number, pin_type, pin_mode, actual_pin)
         # Add it to our registered pins with the desired name
         self.registered_pins[name] = pin
-        self.last_pin_name = name
+        if self._local is None:
+            self.last_pin_name = name
+        else:
+            self._local.last_pin_name = name
+        if pin_type == PIN_TYPE_ANALOG or pin_mode == PIN_MODE_INPUT:
+            self._input_pins += (pin, )
+            if self.thread_safe:
+                self._publish_inputs()
+        return pin
+
+    def query_capabilities(self, timeout=CAPABILITY_QUERY_TIMEOUT):
+        """ Asks the board what its pins can do. Both queries are sent at once and answered in one round-trip.
+
+        The answer is stored in capabilities and analog_mapping, and asked only once per board.
+
+        :param timeout: Seconds to wait for the answers
+        :type timeout: float
+        :return: True if the board answered
+        :rtype: bool
+        """
+        if not self._capabilities_queried:
+            self._capabilities_queried = True
+            self.board.add_cmd_handler(protocol.CAPABILITY_RESPONSE, self._handle_capability_response)
+            self.board.add_cmd_handler(protocol.ANALOG_MAPPING_RESPONSE, self._handle_analog_mapping_response)
+            self.board.sp.write(protocol.capability_queries())
+            # The answers can't come before the queries are sent
+            self.flush()
+            deadline = time.monotonic() + timeout
+            for event in (self._capability_event, self._analog_mapping_event):
+                if not event.wait(max(deadline - time.monotonic(), 0)):
+                    logger.warning('Board on {} did not answer to the capability queries'.format(self.board.name))
+                    break
+        return self.capabilities is not None and self.analog_mapping is not None
+
+    def query_firmware(self, timeout=CAPABILITY_QUERY_TIMEOUT):
+        """ Asks the board for the name and version of its firmware, stored in firmware and firmware_version
+
+        :param timeout: Seconds to wait for the answer
+        :type timeout: float
+        :return: True if the board answered
+        :rtype: bool
+        """
+        if self.firmware is None:
+            self.board.add_cmd_handler(protocol.REPORT_FIRMWARE, self._handle_report_firmware)
+            self._send(protocol.sysex(protocol.REPORT_FIRMWARE))
+            self.flush()
+            if not self._firmware_event.wait(timeout):
+                logger.warning('Board on {} did not tell its firmware'.format(self.board.name))
+        return self.firmware is not None
+
+    def _handle_report_firmware(self, *data):
+        self.board._handle_report_firmware(*data)
+        self.firmware_version = (data[0], data[1])
+        self.firmware = self.board.firmware
+        self._firmware_event.set()
+
+    @classmethod
+    def from_profile(cls, profile, board_id=None, cache=True, **kwargs):
+        """ Creates a board as described by a profile file, refer to @pyrduino.profiles.open_profile
+
+        board = Pyrduino.from_profile('greenhouse.yaml')
+
+        :return: The board with the pins of the profile registered
+        :rtype: Pyrduino
+        """
+        # Imported here, since the profiles import this module
+        from .profiles import open_profile
+        return open_profile(profile, board_id, cache, board_class=cls, **kwargs)
+
+    def use_capabilities(self, capabilities, analog_mapping):
+        """ Takes the capabilities of the board from somewhere else, so the board doesn't have to be asked
+
+        :param capabilities: Parsed capability response, see protocol.parse_capability_response
+        :type capabilities: dict
+        :param analog_mapping: Parsed analog mapping response, see protocol.parse_analog_mapping_response
+        :type analog_mapping: dict
+        :return: None
+        """
+        self.capabilities = capabilities
+        self.analog_mapping = analog_mapping
+        self._capabilities_queried = True
+
+    def _handle_capability_response(self, *data):
+        self.capabilities = protocol.parse_capability_response(data)
+        self._capability_event.set()
+
+    def _handle_analog_mapping_response(self, *data):
+        self.analog_mapping = protocol.parse_analog_mapping_response(data)
+        self._analog_mapping_event.set()
+
+    def register_pins(self, spec):
+        """ Registers many pins at once
+
+        All the pins are checked against what the board says it can do, and all of them are configured with
+        a single serial write. If any of the pins is invalid, none of them are registered.
+
+        :param spec: Either a list of (name, number, pin_type, pin_mode) tuples or dicts with those keys,
+            or a dict of name: (number, pin_type, pin_mode). pin_type and pin_mode are optional like in register_pin,
+            except that analog pins are inputs by default and can't be anything else.
+        :type spec: list or dict
+        :raises PinRegistrationError: With all the invalid pins listed
+        :return: None
+        """
+        entries = _normalize_pin_spec(spec)
+        has_capabilities = self.query_capabilities()
+        errors = list()
+        names = set()
+        # Pins claimed by the earlier entries, board.taken only knows the ones registered before
+        claimed = set()
+        for name, number, pin_type, pin_mode in entries:
+            if name in names or name in self.registered_pins:
+                errors.append('Pin name {} is used more than once'.format(name))
+            names.add(name)
+            if has_capabilities:
+                error = self._check_pin_capability(number, pin_type, pin_mode)
+            else:
+                error = self._check_pin_layout(number, pin_type, pin_mode)
+            if not error and (pin_type, number) in claimed:
+                error = 'pin is already taken'
+            claimed.add((pin_type, number))
+            if error:
+                errors.append('Pin {} ({}:{}:{}): {}'.format(name, pin_type, number, pin_mode, error))
+        if errors:
+            raise PinRegistrationError(errors)
+
+        # Everything is fine, so let's collect the messages for all of the pins and send them in one go
+        msg = bytearray()
+        reporting_ports = set()
+        for name, number, pin_type, pin_mode in entries:
+            logger.debug('Registering a pin {}:{}:{} with name: {}'.format(pin_type, number, pin_mode, name))
+            if pin_type == PIN_TYPE_ANALOG:
+                actual_pin = self.board.analog[number]
+                actual_pin.reporting = True
+                msg += protocol.report_analog(number)
+            else:
+                actual_pin = self.board.digital[number]
+                firmata_mode = FIRMATA_PIN_MODES[pin_mode]
+                # Set the private attribute, since setting the mode property would write to the board right away
+                actual_pin._mode = firmata_mode
+                if firmata_mode == protocol.SERVO:
+                    msg += protocol.servo_config(number)
+                else:
+                    msg += protocol.set_pin_mode(number, firmata_mode)
+                if firmata_mode == protocol.INPUT:
+                    actual_pin.reporting = True
+                    reporting_ports.add(actual_pin.port)
+            self.board.taken['analog' if pin_type == PIN_TYPE_ANALOG else 'digital'][number] = True
+            self._add_registered_pin(name, number, pin_type, pin_mode, actual_pin)
+        for port in reporting_ports:
+            port.reporting = True
+            msg += protocol.report_digital(port.port_number)
+        if msg:
+            self.board.sp.write(msg)
+
+    def _check_pin_capability(self, number, pin_type, pin_mode):
+        """ Checks a pin against the capability and analog mapping responses
+
+        :return: An error message or None if the pin is fine
+        :rtype: str
+        """
+        error = check_pin_capability(self.capabilities, self.analog_mapping, number, pin_type, pin_mode)
+        if error:
+            return error
+        # pyfirmata must know the pin too
+        if number >= len(self.board.analog if pin_type == PIN_TYPE_ANALOG else self.board.digital):
+            return 'no such {} pin'.format('analog' if pin_type == PIN_TYPE_ANALOG else 'digital')
+        return self._check_pin_taken(number, pin_type)
+
+    def _check_pin_layout(self, number, pin_type, pin_mode):
+        """ Checks a pin against the pyfirmata board layout, for boards that don't answer to the capability query
+
+        :return: An error message or None if the pin is fine
+        :rtype: str
+        """
+        if pin_type == PIN_TYPE_ANALOG:
+            if pin_mode != PIN_MODE_INPUT:
+                return 'analog pins can only be inputs'
+            if number >= len(self.board.analog):
+                return 'no such analog pin'
+        elif pin_type == PIN_TYPE_DIGITAL:
+            if pin_mode not in FIRMATA_PIN_MODES:
+                return 'unknown pin mode'
+            if number >= len(self.board.digital) or self.board.digital[number].mode == UNAVAILABLE:
+                return 'no such digital pin'
+            if pin_mode == PIN_MODE_PWM and not self.board.digital[number].PWM_CAPABLE:
+                return 'pin does not support the mode'
+        else:
+            return 'unknown pin type'
+        return self._check_pin_taken(number, pin_type)
 
+    def _check_pin_taken(self, number, pin_type):
+        if self.board.taken['analog' if pin_type == PIN_TYPE_ANALOG else 'digital'][number]:
+            return 'pin is already taken'
+        return None
 
     def register_pin_array(self, min_pin=11, max_pin=13, pin_type=PIN_TYPE_DIGITAL, pin_mode=PIN_MODE_OUTPUT):
         """ A helper to register multiple pins at once. Refer to @register_pin method.
@@ -129,9 +739,9 @@ class Pyrduino:
         :param pin_mode: Mode of the pins to register
         :return: None
         """
-        for x in range(min_pin, max_pin + 1):  # +1 since range will omit the last value
-            # Let's register the pins by desired type with the name of being a string version of the number
-            self.register_pin(name=str(x), number=x, pin_type=pin_type, pin_mode=pin_mode)
+        # Let's register the pins by desired type with the name of being a string version of the number
+        # +1 since range will omit the last value
+        self.register_pins([(str(x), x, pin_type, pin_mode) for x in range(min_pin, max_pin + 1)])
 
     def get_registered_pin(self, name=None):
         """ Returns a registered pin by a name
@@ -139,18 +749,37 @@ class Pyrduino:
         :param name: Name of the pin
         :type name: str
         :return: Pin
-        :rtype a DotMap instance
+        :rtype: Pin
         """
+        local = self._local
         if not name:
-            assert self.last_pin_name, 'You must give a pin name if pin name has not been used before'
-            name = self.last_pin_name
-        if name in self.registered_pins.keys():
-            # Let's keep the last used pin in store, for convenience
+            name = self.last_pin_name if local is None else getattr(local, 'last_pin_name', None)
+            assert name, 'You must give a pin name if pin name has not been used before'
+        try:
+            pin = self.registered_pins[name]
+        except KeyError:
+            raise Exception('No pin registered with that name')
+        # Let's keep the last used pin in store, for convenience
+        if local is None:
             self.last_pin_name = name
-            logger.debug('Got a pin named: ' + name)
-            return self.registered_pins[name]
         else:
-            raise Exception('No pin registered with that name')
+            local.last_pin_name = name
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Got a pin named: %s', name)
+        return pin
+
+    def pin(self, name):
+        """ Returns a registered pin to be used directly
+
+        Reading and writing through the returned pin skips the name lookup, which is handy in tight loops:
+        light = board.pin('light'); light.write(1)
+
+        :param name: Name of the pin
+        :type name: str
+        :return: Pin
+        :rtype: Pin
+        """
+        return self.get_registered_pin(name)
 
     def write_pin(self, name=None, value=0):
         """ Write a value to the pin
@@ -161,8 +790,190 @@ class Pyrduino:
         :type value: int or float
         :return: None
         """
-        self.get_registered_pin(name).pin.write(value)
-        logger.debug('Writing to pin a value: ' + str(value))
+        self._write(self.get_registered_pin(name), value)
+
+    def _write(self, pin, value):
+        """ Write a value to a registered pin, this is where all the single pin writes end up
+
+        :param pin: A registered pin
+        :type pin: Pin
+        :param value: Value to write
+        :type value: int or float
+        :return: None
+        """
+        # Checked in the caller, so a bad write raises here even when the writer thread does the writing
+        self._check_write(pin, value)
+        if self._writes is not None and threading.get_ident() != self._writer_ident:
+            self._writes.put((self._write, (pin, value)))
+            return
+        if self.write_cache and self._is_cached(pin, value):
+            return
+        actual_pin = pin.pin
+        previous = actual_pin.value
+        try:
+            actual_pin.write(value)
+        except Exception:
+            # pyfirmata stores the value before sending it and skips writing the same value again, so it has to
+            # forget a value that may never have reached the board
+            actual_pin.value = previous
+            raise
+        # Only cached once it has been sent, so the same value can be tried again after a failed write
+        pin.last_value = value
+        if self._stats is not None:
+            self._stats.count_write(pin.name)
+        if self._write_listeners:
+            for listener in self._write_listeners:
+                listener((pin, ))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Writing to pin %s a value: %s', pin.name, value)
+
+    def _is_cached(self, pin, value):
+        """ Checks the write cache, and counts a hit or a miss
+
+        :param pin: A registered pin
+        :param value: Value about to be written
+        :return: True if the pin already has the value and the write can be skipped
+        :rtype: bool
+        """
+        last_value = pin.last_value
+        if last_value is not None:
+            if pin.pin_mode in (PIN_MODE_PWM, PIN_MODE_SERVO):
+                cached = abs(value - last_value) <= self.write_cache_epsilon
+            else:
+                cached = value == last_value
+            if cached:
+                self.cache_hits += 1
+                return True
+        self.cache_misses += 1
+        return False
+
+    def clear_write_cache(self):
+        """ Forgets the cached pin values, so the next write to every pin goes to the board
+
+        Useful if the board has been reset or written to by someone else.
+
+        :return: None
+        """
+        for pin in self.registered_pins.values():
+            pin.last_value = None
+
+    def get_write_cache_stats(self):
+        """ Returns how well the write cache is doing
+
+        :return: Counts of skipped (hits) and sent (misses) writes and the hit ratio
+        :rtype: dict
+        """
+        total = self.cache_hits + self.cache_misses
+        return {
+            'hits': self.cache_hits,
+            'misses': self.cache_misses,
+            'hit_ratio': float(self.cache_hits) / total if total else 0.0
+        }
+
+    def write_pins(self, values):
+        """ Write values to many pins at once
+
+        Digital outputs sharing an 8 pin port are merged into a single message per port and all the messages
+        are sent in one serial write, so the pins change practically at the same time.
+
+        :param values: Values by the names of registered pins, e.g. {'red': 1, 'green': 0}
+        :type values: dict
+        :return: None
+        """
+        # Everything is checked before anything changes, so a bad name or pin doesn't leave half of the values
+        # stored but never sent
+        self._check_writable(values)
+        if self._writes is not None and threading.get_ident() != self._writer_ident:
+            self._writes.put((self.write_pins, (dict(values), )))
+            return
+        msg = bytearray()
+        ports = list()
+        sent = list()
+        previous = list()
+        for name, value in values.items():
+            pin = self.registered_pins[name]
+            if self.write_cache and self._is_cached(pin, value):
+                continue
+            sent.append((pin, value))
+            actual_pin = pin.pin
+            previous.append((actual_pin, actual_pin.value))
+            actual_pin.value = value
+            mode = actual_pin.mode
+            if mode == OUTPUT:
+                # Just store the value, the whole port is written after all the values are known
+                if actual_pin.port not in ports:
+                    ports.append(actual_pin.port)
+            elif mode == PWM:
+                msg += protocol.analog_write(actual_pin.pin_number, int(round(value * 255)))
+            else:
+                msg += protocol.analog_write(actual_pin.pin_number, int(value))
+        for port in ports:
+            msg += protocol.digital_port(port.port_number, _port_mask(port))
+        if msg:
+            try:
+                self._send(msg)
+            except Exception:
+                # Nothing may have reached the board, so the pins keep the values they had
+                for actual_pin, value in previous:
+                    actual_pin.value = value
+                raise
+        # Only the values that were sent are cached and counted, like in _write
+        for pin, value in sent:
+            pin.last_value = value
+        if self._stats is not None:
+            for pin, value in sent:
+                self._stats.count_write(pin.name)
+        if self._write_listeners and sent:
+            pins = [pin for pin, value in sent]
+            for listener in self._write_listeners:
+                listener(pins)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Wrote to pins values: %s', values)
+
+    def _check_writable(self, values):
+        """ Checks that all the names are registered output, PWM or servo pins and all the values numbers
+
+        :param values: Values by pin name
+        :type values: dict
+        :return: None
+        """
+        for name, value in values.items():
+            if name not in self.registered_pins:
+                raise Exception('No pin registered with that name: {}'.format(name))
+            self._check_write(self.registered_pins[name], value)
+
+    def _check_write(self, pin, value):
+        """ Checks that the pin is an output, PWM or servo pin and the value a number
+
+        :param pin: A registered pin
+        :type pin: Pin
+        :param value: Value about to be written
+        :return: None
+        """
+        actual_pin = pin.pin
+        if actual_pin.type != DIGITAL or actual_pin.mode not in (OUTPUT, PWM, SERVO):
+            raise IOError('{} can not be written to'.format(actual_pin))
+        if not isinstance(value, numbers.Real):
+            raise TypeError('Value for pin {} is not a number: {!r}'.format(pin.name, value))
+
+    def pin_group(self, *names):
+        """ Creates a group of registered pins that are always written together. Refer to @PinGroup.
+
+        :param names: Names of registered pins
+        :type names: str
+        :return: The group
+        :rtype: PinGroup
+        """
+        return PinGroup(self, names)
+
+    def _send(self, data):
+        """ Sends raw Firmata messages to the board
+
+        :param data: One or more messages
+        :type data: bytearray
+        :return: None
+        """
+        self.board.sp.write(data)
 
     def read_pin(self, name):
         """ Read a pin value
@@ -171,10 +982,203 @@ class Pyrduino:
         :type name: str
         :return: Pin value
         """
-        read_value = self.get_registered_pin(name).pin.read()
-        logger.debug('Read a value from a pin: ' + str(read_value))
+        read_value = self.get_registered_pin(name).pin.value
+        if self._stats is not None:
+            self._stats.count_read(name)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Read a value from a pin: %s', read_value)
         return read_value
 
+    def on_change(self, name, callback, threshold=None, edge=EDGE_BOTH):
+        """ Calls a function when the value of an input pin changes
+
+        The callback is called on the thread reading the board, right after the message with the new value has
+        been handled, so it should return quickly. It gets the pin name and the new value as arguments.
+        The first value reported by the board only sets the starting point and doesn't trigger the callback.
+
+        :param name: Name of a registered input pin
+        :type name: str
+        :param callback: Function to call, callback(name, value)
+        :param threshold: If given, trigger only when the value crosses this threshold instead of on every change
+        :type threshold: float
+        :param edge: Trigger on values going up, down or both ways. One of the EDGE_* constants.
+        :type edge: str
+        :return: The registered callback, which can be given to remove_callback
+        :rtype: ChangeCallback
+        """
+        assert edge in EDGES, 'Unknown edge: {}'.format(edge)
+        pin = self.get_registered_pin(name)
+        return self._add_change_callback(pin, ChangeCallback(pin, callback, threshold, edge))
+
+    def _add_change_callback(self, pin, change_callback):
+        """ Adds anything with a check method to be called after every message of an input pin
+
+        :param pin: A registered input pin
+        :type pin: Pin
+        :param change_callback: The object to call check of
+        :return: change_callback, which can be given to remove_callback
+        """
+        if pin.pin_type == PIN_TYPE_ANALOG:
+            callbacks, key = self._analog_callbacks, pin.number
+        elif pin.pin_mode == PIN_MODE_INPUT:
+            callbacks, key = self._digital_callbacks, pin.pin.port.port_number
+        else:
+            raise Exception('Pin {} is not an input pin'.format(pin.name))
+        self._watch_inputs()
+        callbacks[key] = callbacks.get(key, []) + [change_callback]
+        return change_callback
+
+    def _add_write_listener(self, listener):
+        """ Calls listener with a list of the written pins after every write, on the thread that writes
+
+        :return: None
+        """
+        self._write_listeners += (listener, )
+
+    def _remove_write_listener(self, listener):
+        self._write_listeners = tuple(other for other in self._write_listeners if other is not listener)
+
+    def remove_callback(self, change_callback):
+        """ Removes a callback added with on_change
+
+        :param change_callback: The value returned by on_change
+        :type change_callback: ChangeCallback
+        :return: None
+        """
+        for callbacks in (self._digital_callbacks, self._analog_callbacks):
+            for key, registered in list(callbacks.items()):
+                if change_callback in registered:
+                    callbacks[key] = [c for c in registered if c is not change_callback]
+
+    def _watch_inputs(self):
+        """ Puts our own handlers in front of the pyfirmata ones for incoming digital and analog values
+
+        :return: None
+        """
+        if not self._inputs_watched:
+            self._inputs_watched = True
+            self.board.add_cmd_handler(DIGITAL_MESSAGE, self._handle_digital_message)
+            self.board.add_cmd_handler(ANALOG_MESSAGE, self._handle_analog_message)
+
+    def _handle_digital_message(self, port_nr, lsb, msb):
+        # Let pyfirmata update the pin values first, then see what changed
+        self.board._handle_digital_message(port_nr, lsb, msb)
+        if self.thread_safe:
+            self._publish_inputs()
+        callbacks = self._digital_callbacks.get(port_nr)
+        if callbacks:
+            self._dispatch(callbacks)
+
+    def _handle_analog_message(self, pin_nr, lsb, msb):
+        self.board._handle_analog_message(pin_nr, lsb, msb)
+        if self.thread_safe:
+            self._publish_inputs()
+        sampler = self._samplers.get(pin_nr)
+        if sampler is not None:
+            sampler.append(time.perf_counter(), ((msb << 7) + lsb) / 1023.0)
+        callbacks = self._analog_callbacks.get(pin_nr)
+        if callbacks:
+            self._dispatch(callbacks)
+
+    def _publish_inputs(self):
+        # A new dictionary every time, so a reader always has a whole one
+        self._snapshot = dict((pin.name, pin.pin.value) for pin in self._input_pins)
+
+    def snapshot(self):
+        """ The values of all the input pins at the same moment
+
+        In the thread safe mode the reader thread replaces the snapshot after every message from the board, so the
+        values always belong together. Otherwise they are read one by one.
+
+        :return: Values by pin name, not to be modified
+        :rtype: dict
+        """
+        if self.thread_safe:
+            return self._snapshot
+        return dict((pin.name, pin.pin.value) for pin in self._input_pins)
+
+    def _dispatch(self, callbacks):
+        """ Runs the change callbacks of an incoming message, timing them when statistics are collected
+
+        :param callbacks: ChangeCallbacks of the port or pin of the message
+        :type callbacks: list
+        :return: None
+        """
+        stats = self._stats
+        if stats is None:
+            for change_callback in callbacks:
+                change_callback.check()
+        else:
+            start = time.perf_counter()
+            for change_callback in callbacks:
+                change_callback.check()
+            stats.callback_seconds.observe(time.perf_counter() - start)
+
+    def start_sampling(self, names, rate_hz=DEFAULT_SAMPLING_RATE, capacity=DEFAULT_CAPACITY):
+        """ Records every value the board reports for analog input pins
+
+        Sets the sampling interval of the board and keeps the latest samples of each pin in a ring buffer, with the
+        time.perf_counter time they were received. Get them with samples. Needs NumPy.
+
+        The sampling interval is the same for all the analog pins of the board. Every sample is 3 bytes on the wire,
+        so fast sampling of many pins needs a fast serial link: 8 pins at 1 kHz is 24000 bytes per second, which is
+        more than 57600 baud can carry.
+
+        :param names: Names of registered analog pins
+        :type names: list
+        :param rate_hz: Samples per second, between 1000 and about 0.06 (the longest interval Firmata can set)
+        :type rate_hz: float
+        :param capacity: Number of samples to keep per pin
+        :type capacity: int
+        :return: None
+        """
+        assert rate_hz > 0, 'Sampling rate must be positive'
+        samplers = dict(self._samplers)
+        for name in names:
+            pin = self.get_registered_pin(name)
+            if pin.pin_type != PIN_TYPE_ANALOG:
+                raise Exception('Pin {} is not an analog pin'.format(name))
+            samplers[pin.number] = SampleBuffer(capacity)
+        interval = min(max(int(round(1000.0 / rate_hz)), 1), 0x3FFF)
+        self._watch_inputs()
+        self._samplers = samplers
+        self._sampling_interval = interval
+        self._send(protocol.sampling_interval(interval))
+        logger.debug('Sampling pins {} every {} ms'.format(', '.join(names), interval))
+
+    def stop_sampling(self, names=None):
+        """ Stops recording samples of analog pins, the sampling interval of the board stays as it is
+
+        :param names: Names of the pins, all the sampled pins by default
+        :type names: list
+        :return: None
+        """
+        if names is None:
+            self._samplers = dict()
+        else:
+            numbers = [self.get_registered_pin(name).number for name in names]
+            self._samplers = dict((number, sampler) for number, sampler in self._samplers.items()
+                                  if number not in numbers)
+
+    def samples(self, name, last_n=None):
+        """ The latest recorded samples of an analog pin
+
+        The arrays are views into the ring buffer, not copies. They stay valid until capacity newer samples have come
+        in, copy them to keep them longer.
+
+        :param name: Name of a pin given to start_sampling
+        :type name: str
+        :param last_n: Number of samples, all the kept ones by default
+        :type last_n: int
+        :return: Timestamps (time.perf_counter seconds) and values (0.0-1.0, like read_pin) as NumPy arrays,
+            oldest first
+        :rtype: tuple
+        """
+        sampler = self._samplers.get(self.get_registered_pin(name).number)
+        if sampler is None:
+            raise Exception('Pin {} is not sampled'.format(name))
+        return sampler.latest(last_n)
+
     def pass_time(self, value):
         """ Pass a time on board
 
@@ -192,3 +1196,335 @@ class Pyrduino:
     def get_pins_by_mode(self, pin_mode=PIN_MODE_INPUT):
         return [pin for pin in self.registered_pins.values() if pin.pin_mode == pin_mode]
 
+
+def check_pin_capability(capabilities, analog_mapping, number, pin_type, pin_mode):
+    """ Checks a pin against what a board said in its capability and analog mapping responses
+
+    :param capabilities: Parsed capability response, see protocol.parse_capability_response
+    :type capabilities: dict
+    :param analog_mapping: Parsed analog mapping response, see protocol.parse_analog_mapping_response
+    :type analog_mapping: dict
+    :param number: Number of the pin
+    :type number: int
+    :param pin_type: Type of the pin (digital, analog)
+    :param pin_mode: Mode of the pin (input, output, servo, pwm)
+    :return: An error message or None if the pin is fine
+    :rtype: str
+    """
+    if pin_type == PIN_TYPE_ANALOG:
+        if pin_mode != PIN_MODE_INPUT:
+            return 'analog pins can only be inputs'
+        if number not in analog_mapping:
+            return 'no such analog pin'
+    elif pin_type == PIN_TYPE_DIGITAL:
+        if pin_mode not in FIRMATA_PIN_MODES:
+            return 'unknown pin mode'
+        if number not in capabilities:
+            return 'no such digital pin'
+        if FIRMATA_PIN_MODES[pin_mode] not in capabilities[number]:
+            return 'pin does not support the mode'
+    else:
+        return 'unknown pin type'
+    return None
+
+
+def enable_console_logging(loglevel=logging.DEBUG, stream=sys.stdout):
+    """ Prints the log messages of pyrduino to the console
+
+    Handy for trying things out, applications should rather configure logging themselves. Call this before
+    creating the Pyrduino instances, or call their set_loglevel afterwards.
+
+    :param loglevel: One of the Python's logging package log levels
+    :param stream: Where to print the messages
+    :return: None
+    """
+    global _console_handler
+    if _console_handler is None:
+        _console_handler = logging.StreamHandler(stream)
+        logger.addHandler(_console_handler)
+    logger.setLevel(loglevel)
+
+
+class Pin:
+    """ A registered pin
+
+    Besides being what the name based methods of Pyrduino look up, a pin can be written and read directly.
+    """
+    __slots__ = ('board', 'name', 'number', 'pin_type', 'pin_mode', 'pin', 'last_value')
+
+    def __init__(self, board, name, number, pin_type, pin_mode, pin):
+        """ Constructor for the pin, use Pyrduino.register_pin instead of creating pins yourself
+
+        :param board: The board the pin belongs to
+        :type board: Pyrduino
+        :param name: Name of the pin
+        :type name: str
+        :param number: Number of the pin
+        :type number: int
+        :param pin_type: Type of the pin (digital, analog)
+        :param pin_mode: Mode of the pin (input, output, servo, pwm)
+        :param pin: The pyfirmata pin
+        """
+        self.board = board
+        self.name = name
+        self.number = number
+        self.pin_type = pin_type
+        self.pin_mode = pin_mode
+        self.pin = pin
+        # The last value written to the pin, used by the write cache
+        self.last_value = None
+
+    def __repr__(self):
+        return 'Pin({!r}, {}:{}:{})'.format(self.name, self.pin_type, self.number, self.pin_mode)
+
+    def write(self, value):
+        """ Write a value to the pin
+
+        :param value: Value to write
+        :type value: int or float
+        :return: None
+        """
+        self.board._write(self, value)
+
+    def read(self):
+        """ Read the pin value
+
+        :return: Pin value
+        """
+        stats = self.board._stats
+        if stats is not None:
+            stats.count_read(self.name)
+        return self.pin.value
+
+
+class ChangeCallback:
+    """ A callback waiting for the value of an input pin to change, see @Pyrduino.on_change """
+    __slots__ = ('pin', 'callback', 'threshold', 'edge', 'last_value')
+
+    def __init__(self, pin, callback, threshold=None, edge=EDGE_BOTH):
+        self.pin = pin
+        self.callback = callback
+        self.threshold = threshold
+        self.edge = edge
+        self.last_value = pin.pin.value
+
+    def check(self):
+        """ Compares the current value of the pin to the last one and calls the callback if needed
+
+        :return: None
+        """
+        value = self.pin.pin.value
+        last_value = self.last_value
+        if value == last_value:
+            return
+        self.last_value = value
+        if value is None or last_value is None:
+            return
+        if self.threshold is None:
+            rising = value > last_value
+        elif last_value < self.threshold <= value:
+            rising = True
+        elif value < self.threshold <= last_value:
+            rising = False
+        else:
+            return
+        if self.edge == EDGE_BOTH or (self.edge == EDGE_RISING) == rising:
+            try:
+                self.callback(self.pin.name, value)
+            except Exception:
+                # Don't let a failing callback kill the thread reading the board
+                logger.exception('Change callback of pin %s failed', self.pin.name)
+
+
+class PinGroup:
+    """ A set of registered pins that are written with a single serial write, see @Pyrduino.write_pins """
+    def __init__(self, board, names):
+        """ Constructor for the pin group
+
+        :param board: The board the pins are registered to
+        :type board: Pyrduino
+        :param names: Names of the registered pins
+        :type names: list
+        """
+        self.board = board
+        self.names = tuple(names)
+        for name in self.names:
+            if name not in board.registered_pins:
+                raise Exception('No pin registered with that name: {}'.format(name))
+
+    def write(self, value):
+        """ Write the same value to all the pins of the group
+
+        :param value: Value to write
+        :type value: int or float
+        :return: None
+        """
+        self.board.write_pins(dict.fromkeys(self.names, value))
+
+    def write_values(self, values):
+        """ Write a value for each of the pins of the group
+
+        :param values: Values in the same order as the pin names of the group
+        :type values: list
+        :return: None
+        """
+        assert len(values) == len(self.names), 'You must give a value for every pin of the group'
+        self.board.write_pins(dict(zip(self.names, values)))
+
+    def read(self):
+        """ Read the values of all the pins of the group
+
+        :return: Values by pin name
+        :rtype: dict
+        """
+        return dict((name, self.board.registered_pins[name].pin.value) for name in self.names)
+
+
+def _port_mask(port):
+    """ Bit mask of the output pins of a pyfirmata port which are currently on
+
+    :rtype: int
+    """
+    mask = 0
+    for actual_pin in port.pins:
+        # The same test as pyfirmata's Port.write, so write_pin and write_pins agree on values other than 0 and 1
+        if actual_pin.mode == OUTPUT and actual_pin.value == 1:
+            mask |= 1 << (actual_pin.pin_number - port.port_number * 8)
+    return mask
+
+
+class _Reader(threading.Thread):
+    """ Passes what the board sends to pyfirmata, like pyfirmata.util.Iterator but can be stopped and tells why it
+    stopped on its own """
+    def __init__(self, board):
+        super(_Reader, self).__init__(name='pyrduino-reader')
+        self.daemon = True
+        self.board = board
+        self.error = None
+        # True if the reader stopped on an error that has nothing to do with the connection
+        self.crashed = False
+        self._stopping = threading.Event()
+
+    def run(self):
+        board = self.board
+        while not self._stopping.is_set():
+            try:
+                while board.bytes_available() and not self._stopping.is_set():
+                    board.iterate()
+            except Exception as e:
+                self.error = e
+                if self._stopping.is_set():
+                    # The port was closed under us on purpose
+                    return
+                if not isinstance(e, (serial.SerialException, OSError)) and not _is_empty_read(e):
+                    # A bug in a handler or in the reader, opening the port again wouldn't help
+                    self.crashed = True
+                    raise
+                if getattr(board.sp, 'on_lost', None) is not None:
+                    # The supervisor starts reconnecting right away instead of waiting for the heartbeat
+                    board.sp.lost(e)
+                else:
+                    logger.warning('Stopped reading board {}: {}'.format(board.name, e))
+                return
+            time.sleep(0.001)
+
+    def stop(self):
+        self._stopping.set()
+
+
+def _is_empty_read(error):
+    """ Tells if an error is pyfirmata failing on ord(b''), which it does when a closed or lost port reads nothing
+
+    :rtype: bool
+    """
+    return isinstance(error, TypeError) and str(error).startswith('ord()') and 'length 0' in str(error)
+
+
+def _open_board(board_type, board_id, ready_timeout, transport=None, baudrate=DEFAULT_BAUDRATE, timeout=None,
+                write_timeout=None):
+    """ Creates a pyfirmata board without its fixed startup sleep and waits for the Firmata handshake instead
+
+    :param board_type: Type of the board. One of the BOARD_TYPE_* constants.
+    :type board_type: str
+    :param board_id: Id of the board (serial port)
+    :type board_id: str
+    :param ready_timeout: Seconds to wait for the board to answer
+    :type ready_timeout: float
+    :param transport: Serial port like object to use instead of opening board_id
+    :param baudrate: Speed of the serial port
+    :type baudrate: int
+    :param timeout: Read timeout of the serial port
+    :type timeout: float
+    :param write_timeout: Write timeout of the serial port
+    :type write_timeout: float
+    :return: A ready to use pyfirmata board
+    """
+    if transport is None and board_type == BOARD_TYPE_SIM:
+        # Imported here, since the simulator imports this module
+        from .sim import SimulatedBoard, LoopbackTransport
+        transport = LoopbackTransport(SimulatedBoard(), port=board_id, owns_board=True)
+    board_class = BOARD_CLASSES[board_type]
+    # Skip the pyfirmata constructor, since it always sleeps for 5 seconds, and do the same setup here
+    board = board_class.__new__(board_class)
+    # pyfirmata keeps the command handlers in a class level dictionary, let's give every board its own
+    board._command_handlers = dict()
+    if transport is None:
+        transport = serial.Serial(board_id, baudrate, timeout=timeout, write_timeout=write_timeout)
+    board.sp = transport
+    board.name = board_id
+    board._layout = BOARD_LAYOUTS[board_type]
+    board.setup_layout(board._layout)
+    try:
+        _wait_for_handshake(board, ready_timeout)
+    except Exception:
+        board.exit()
+        raise
+    return board
+
+
+def _wait_for_handshake(board, timeout):
+    """ Waits until the board has reported its Firmata version
+
+    The board sends the version on its own after a reset, but we keep asking for it in case the serial port
+    was opened without resetting the board or the first answer got lost while the bootloader was running.
+
+    :param board: pyfirmata board
+    :param timeout: Seconds to wait before giving up
+    :type timeout: float
+    :return: None
+    """
+    deadline = time.monotonic() + timeout
+    next_query = 0
+    while board.firmata_version is None:
+        now = time.monotonic()
+        if now >= deadline:
+            raise IOError('Board on {} did not answer to the Firmata handshake in {} seconds'
+                          .format(board.name, timeout))
+        if now >= next_query:
+            board.sp.write(bytearray([REPORT_VERSION]))
+            next_query = now + HANDSHAKE_QUERY_INTERVAL
+        while board.bytes_available():
+            board.iterate()
+        time.sleep(0.001)
+    logger.debug('Board on {} answered with Firmata version {}'.format(board.name, board.firmata_version))
+
+
+def _normalize_pin_spec(spec):
+    """ Turns the different pin spec formats of register_pins into a list of (name, number, pin_type, pin_mode)
+
+    :rtype: list
+    """
+    if isinstance(spec, dict):
+        spec = [(name, ) + tuple(entry) if isinstance(entry, (list, tuple)) else dict(entry, name=name)
+                for name, entry in spec.items()]
+    entries = list()
+    for entry in spec:
+        if isinstance(entry, dict):
+            entry = (entry['name'], entry['number'], entry.get('pin_type', PIN_TYPE_DIGITAL), entry.get('pin_mode'))
+        else:
+            entry = tuple(entry) + (PIN_TYPE_DIGITAL, None)[len(entry) - 2:]
+        if entry[3] is None:
+            # Analog pins can only be inputs, the rest are outputs unless told otherwise
+            entry = entry[:3] + (PIN_MODE_INPUT if entry[2] == PIN_TYPE_ANALOG else PIN_MODE_OUTPUT, )
+        entries.append(entry)
+    return entries
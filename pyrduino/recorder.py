@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+# Recording pin values to a file and playing them back.
+#
+# The file is a header followed by fixed size records, written through a memory map so recording costs a few struct
+# writes per event and no memory grows with the length of the recording:
+#
+#   magic (8 bytes) | format version (uint16) | reserved (uint16) | pin table length (uint32) | record count (uint64)
+#   pin table (JSON, padded to a multiple of 16 bytes)
+#   records: time (float64 seconds from the start) | pin index (uint16) | kind (uint16) | value (float32)
+#
+# The record count in the header is updated after every record, so a recording cut short by a crash can still be
+# read up to its last complete record. Records are in time order, which lets the reader find a time range with a
+# binary search instead of reading the whole file.
+
+import json
+import mmap
+import struct
+import threading
+import time
+
+from .pyrduino import Pyrduino, PIN_TYPE_ANALOG, PIN_MODE_INPUT, BOARD_TYPES, BOARD_TYPE_SIM, logger
+
+MAGIC = b'PYRDREC\x00'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sHHIQ')
+RECORD = struct.Struct('<dHHf')
+# Where the record count is in the header
+COUNT_OFFSET = 16
+
+# Kinds of records
+EVENT_INPUT = 0
+EVENT_OUTPUT = 1
+
+# The file grows by this many records at a time
+DEFAULT_CHUNK_RECORDS = 65536
+# Records unpacked at a time when reading
+READ_CHUNK_RECORDS = 4096
+
+
+class Recorder:
+    """ Records the changes of the input pins of a board into a file
+
+    with Recorder(board, 'capture.pyrd'):
+        ...
+
+    Inputs are recorded from the thread reading the board, starting with their current values. Anything else, like
+    the values the program writes, can be added with record.
+    """
+    def __init__(self, board, path, names=None, chunk_records=DEFAULT_CHUNK_RECORDS):
+        """ Constructor for the recorder, starts recording right away
+
+        :param board: The board to record
+        :type board: Pyrduino
+        :param path: File to write, replaced if it exists
+        :type path: str
+        :param names: Names of the pins to put in the file, all the registered pins by default. The input pins
+            among them are recorded automatically.
+        :type names: list
+        :param chunk_records: How many records the file grows by at a time
+        :type chunk_records: int
+        """
+        self.board = board
+        self.path = path
+        self.count = 0
+        self._chunk_size = chunk_records * RECORD.size
+        self._lock = threading.Lock()
+
+        pins = [board.get_registered_pin(name) for name in (board.registered_pins if names is None else names)]
+        self._indexes = dict((pin.name, index) for index, pin in enumerate(pins))
+        table = json.dumps({
+            'board_id': board.board_id,
+            'board_type': board.board_type,
+            'started': time.time(),
+            'pins': [{'name': pin.name, 'number': pin.number, 'pin_type': pin.pin_type, 'pin_mode': pin.pin_mode}
+                     for pin in pins]
+        }).encode('utf-8')
+        table += b' ' * (-(HEADER.size + len(table)) % RECORD.size)
+        self._data_offset = HEADER.size + len(table)
+
+        self._file = open(path, 'w+b')
+        self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(table), 0))
+        self._file.write(table)
+        self._size = self._data_offset + self._chunk_size
+        self._file.truncate(self._size)
+        self._map = mmap.mmap(self._file.fileno(), self._size)
+
+        self._start = time.perf_counter()
+        self._callbacks = list()
+        for pin in pins:
+            if pin.pin_type == PIN_TYPE_ANALOG or pin.pin_mode == PIN_MODE_INPUT:
+                value = pin.read()
+                if value is not None:
+                    self.record(pin.name, value)
+                self._callbacks.append(board.on_change(pin.name, self.record))
+        logger.debug('Recording {} pins to {}'.format(len(pins), path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def record(self, name, value, kind=EVENT_INPUT):
+        """ Adds a record timed now
+
+        :param name: Name of a pin in the file
+        :type name: str
+        :param value: Value of the pin
+        :type value: float
+        :param kind: EVENT_INPUT or EVENT_OUTPUT
+        :type kind: int
+        :return: None
+        """
+        index = self._indexes[name]
+        with self._lock:
+            if self._map is None:
+                return
+            offset = self._data_offset + self.count * RECORD.size
+            if offset + RECORD.size > self._size:
+                self._grow()
+            # The time is taken under the lock, so the records stay in time order
+            RECORD.pack_into(self._map, offset, time.perf_counter() - self._start, index, kind, float(value))
+            self.count += 1
+            struct.pack_into('<Q', self._map, COUNT_OFFSET, self.count)
+
+    def _grow(self):
+        self._map.close()
+        self._size += self._chunk_size
+        self._file.truncate(self._size)
+        self._map = mmap.mmap(self._file.fileno(), self._size)
+
+    def close(self):
+        """ Stops recording and cuts the file to the records written
+
+        :return: None
+        """
+        for change_callback in self._callbacks:
+            self.board.remove_callback(change_callback)
+        self._callbacks = list()
+        with self._lock:
+            if self._map is None:
+                return
+            self._map.flush()
+            self._map.close()
+            self._map = None
+            self._file.truncate(self._data_offset + self.count * RECORD.size)
+            self._file.close()
+        logger.debug('Recorded {} events to {}'.format(self.count, self.path))
+
+
+class Recording:
+    """ A recorded file, read through a memory map so only the parts used are loaded
+
+    recording = Recording('capture.pyrd')
+    for at, name, value, kind in recording.events(start=60, end=120):
+        ...
+    """
+    def __init__(self, path):
+        """
+        :param path: File written by a Recorder
+        :type path: str
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, reserved, table_length, count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise IOError('{} is not a pyrduino recording'.format(path))
+        if version != FORMAT_VERSION:
+            self.close()
+            raise IOError('{} has an unknown format version {}'.format(path, version))
+        self._data_offset = HEADER.size + table_length
+        # A recording cut short may have room for more records than were written
+        self.count = min(count, (len(self._map) - self._data_offset) // RECORD.size)
+        header = json.loads(self._map[HEADER.size:self._data_offset].decode('utf-8'))
+        self.board_id = header['board_id']
+        self.board_type = header['board_type']
+        self.started = header['started']
+        self.pins = header['pins']
+        self._names = [pin['name'] for pin in self.pins]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """ Closes the file
+
+        :return: None
+        """
+        self._map.close()
+        self._file.close()
+
+    @property
+    def duration(self):
+        """ Time of the last record in seconds from the start """
+        return self._time(self.count - 1) if self.count else 0.0
+
+    def _time(self, i):
+        return struct.unpack_from('<d', self._map, self._data_offset + i * RECORD.size)[0]
+
+    def index(self, at):
+        """ Position of the first record at or after a time, found with a binary search
+
+        :param at: Seconds from the start
+        :type at: float
+        :rtype: int
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._time(middle) < at:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def events(self, start=None, end=None):
+        """ The records between two times
+
+        :param start: Seconds from the start of the recording, from the beginning by default
+        :type start: float
+        :param end: Seconds from the start of the recording (not included), to the end by default
+        :type end: float
+        :return: Generator of (time, pin name, value, kind)
+        """
+        first = 0 if start is None else self.index(start)
+        last = self.count if end is None else self.index(end)
+        names = self._names
+        for chunk in range(first, last, READ_CHUNK_RECORDS):
+            offset = self._data_offset + chunk * RECORD.size
+            data = self._map[offset:offset + min(READ_CHUNK_RECORDS, last - chunk) * RECORD.size]
+            for at, index, kind, value in RECORD.iter_unpack(data):
+                yield at, names[index], value, kind
+
+    def array(self, start=None, end=None):
+        """ The records between two times as a NumPy structured array, a view into the file without copying
+
+        The recording can't be closed while the array is in use.
+
+        :return: Array with the fields time, pin (index in pins), kind and value
+        """
+        import numpy
+        first = 0 if start is None else self.index(start)
+        last = self.count if end is None else self.index(end)
+        dtype = numpy.dtype([('time', '<f8'), ('pin', '<u2'), ('kind', '<u2'), ('value', '<f4')])
+        return numpy.frombuffer(self._map, dtype=dtype, count=last - first,
+                                offset=self._data_offset + first * RECORD.size)
+
+
+class Replay:
+    """ Plays the inputs of a recording back through a simulated board
+
+    The board has the pins of the recording registered, so a program can read them with the usual read_pin,
+    on_change and samples while the recorded values come in with their recorded timing:
+
+    with Replay('capture.pyrd') as replay:
+        replay.board.on_change('button', handle_button)
+        replay.start()
+        replay.wait()
+    """
+    def __init__(self, path, speed=1.0, start=None, end=None):
+        """ Constructor for the replay, opens the board and registers the pins but doesn't play anything yet
+
+        :param path: File written by a Recorder
+        :type path: str
+        :param speed: Playback speed, 2 plays twice as fast
+        :type speed: float
+        :param start: Seconds from the start of the recording to play from
+        :type start: float
+        :param end: Seconds from the start of the recording to stop at
+        :type end: float
+        """
+        from .sim import SimulatedBoard, LoopbackTransport, SIM_LAYOUTS
+        assert speed > 0, 'Speed must be positive'
+        self.recording = Recording(path)
+        self.speed = speed
+        self._range = (start, end)
+        board_type = self.recording.board_type if self.recording.board_type in BOARD_TYPES else BOARD_TYPE_SIM
+        self.simulator = SimulatedBoard(board_type=board_type if board_type in SIM_LAYOUTS else 'arduino')
+        self.board = Pyrduino(board_id=path, board_type=board_type,
+                              transport=LoopbackTransport(self.simulator, port=path, owns_board=True))
+        self.board.register_pins(self.recording.pins)
+        self._pins = dict((pin['name'], pin) for pin in self.recording.pins)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        """ Starts playing on a thread of its own
+
+        :return: None
+        """
+        assert self._thread is None, 'Replay already started'
+        self._thread = threading.Thread(target=self._play, name='pyrduino-replay')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """ Waits for the playback to end
+
+        :param timeout: Seconds to wait at most
+        :type timeout: float
+        :return: True if the playback has ended
+        :rtype: bool
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        return True
+
+    def _play(self):
+        start, end = self._range
+        offset = start or 0.0
+        begin = time.perf_counter()
+        for at, name, value, kind in self.recording.events(start, end):
+            if kind != EVENT_INPUT:
+                continue
+            delay = begin + (at - offset) / self.speed - time.perf_counter()
+            if self._stop.wait(delay) if delay > 0 else self._stop.is_set():
+                return
+            pin = self._pins[name]
+            if pin['pin_type'] == PIN_TYPE_ANALOG:
+                self.simulator.send_analog(pin['number'], round(value * 1023))
+            else:
+                self.simulator.set_digital(pin['number'], value)
+
+    def close(self):
+        """ Stops playing and closes the board and the recording
+
+        :return: None
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.board.exit_board()
+        self.recording.close()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Ring buffers for recording analog samples.
+#
+# Every sample is written twice, at i and i + capacity of arrays twice the capacity long. That way the latest n samples
+# are always one contiguous slice, so they can be handed out as NumPy views without copying or reordering anything.
+# NumPy is only needed when sampling is used.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Samples kept per pin when no capacity is given, 10 seconds at 1 kHz
+DEFAULT_CAPACITY = 10000
+
+
+class SampleBuffer:
+    """ Timestamps and values of the latest samples of a single pin
+
+    Written by one thread (the board reader) and read by others: a view holds the samples that were there when it was
+    taken, but once capacity newer samples have come in their places get overwritten. Copy the view to keep it longer.
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        """
+        :param capacity: Number of samples to keep
+        :type capacity: int
+        """
+        if numpy is None:
+            raise ImportError('Sampling needs NumPy, install it with: pip install numpy')
+        assert capacity > 0, 'Capacity must be positive'
+        self.capacity = capacity
+        self.timestamps = numpy.zeros(2 * capacity, dtype=numpy.float64)
+        self.values = numpy.zeros(2 * capacity, dtype=numpy.float64)
+        # Total number of samples written and where the next one goes
+        self.count = 0
+        self._index = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, value):
+        """ Adds a sample, overwriting the oldest one when the buffer is full
+
+        :param timestamp: time.perf_counter value of when the sample came in
+        :type timestamp: float
+        :param value: Value of the sample
+        :type value: float
+        :return: None
+        """
+        i = self._index
+        upper = i + self.capacity
+        self.timestamps[i] = self.timestamps[upper] = timestamp
+        self.values[i] = self.values[upper] = value
+        self._index = i + 1 if i + 1 < self.capacity else 0
+        # Counted last, so a reader never sees a sample that isn't written yet
+        self.count += 1
+
+    def latest(self, last_n=None):
+        """ Views of the latest samples, oldest first
+
+        :param last_n: Number of samples, all the kept ones by default
+        :type last_n: int
+        :return: Timestamps and values
+        :rtype: tuple
+        """
+        # Read the position once, the reader thread may move it while we are here. The count first, since it is updated
+        # last: then the index is never behind it.
+        count = self.count
+        index = self._index
+        available = min(count, self.capacity)
+        n = available if last_n is None else max(0, min(last_n, available))
+        end = index + self.capacity
+        return self.timestamps[end - n:end], self.values[end - n:end]
+
+    def clear(self):
+        """ Forgets all the samples
+
+        :return: None
+        """
+        self.count = 0
+        self._index = 0
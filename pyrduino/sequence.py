@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+# Timed sequences of pin writes.
+#
+# Chaining write_pin and pass_time makes every write and log call push the rest of the sequence later, so a long
+# sequence drifts. A Sequence is built up front as a timeline of (time, pin, value) events and played against a
+# monotonic clock: every step is due at a fixed offset from the start, so being late once doesn't move the later steps,
+# and all the writes due at the same time go to the board as a single write.
+
+import math
+import time
+
+# The scheduler sleeps until this many seconds before a step and busy waits the rest, since sleeping tends to overshoot
+DEFAULT_SPIN_TIME = 0.002
+
+
+class Sequence:
+    """ A timeline of pin values
+
+    It can be built like the pyrduino calls it replaces:
+    sequence = Sequence()
+    sequence.write_pin('light', 1)
+    sequence.pass_time(0.5)
+    sequence.write_pin('light', 0)
+    report = sequence.run(board)
+
+    or with absolute times: sequence.add(0.5, 'light', 0)
+    """
+    def __init__(self):
+        # (time, order, name, value), order keeps the events of the same time in the order they were added
+        self.events = list()
+        # Where write_pin adds the next events
+        self.cursor = 0.0
+        # Time from the start to the end of the sequence
+        self.duration = 0.0
+
+    def __len__(self):
+        return len(self.events)
+
+    def add(self, at, name, value):
+        """ Adds a pin write at a given time
+
+        :param at: Seconds from the start of the sequence
+        :type at: float
+        :param name: Name of a registered pin
+        :type name: str
+        :param value: Value to write
+        :type value: int or float
+        :return: The sequence itself, for chaining
+        :rtype: Sequence
+        """
+        assert at >= 0, 'Events can not happen before the start of the sequence'
+        self.events.append((at, len(self.events), name, value))
+        self.duration = max(self.duration, at)
+        return self
+
+    def write_pin(self, name, value):
+        """ Adds a pin write at the current end of the sequence
+
+        :return: The sequence itself, for chaining
+        :rtype: Sequence
+        """
+        return self.add(self.cursor, name, value)
+
+    def write_pins(self, values):
+        """ Adds writes to many pins at the current end of the sequence
+
+        :param values: Values by pin name
+        :type values: dict
+        :return: The sequence itself, for chaining
+        :rtype: Sequence
+        """
+        for name, value in values.items():
+            self.add(self.cursor, name, value)
+        return self
+
+    def add_series(self, name, times, values):
+        """ Adds many writes to one pin at once
+
+        :param name: Name of a registered pin
+        :type name: str
+        :param times: Seconds from the start of the sequence for every value
+        :type times: list
+        :param values: Values to write
+        :type values: list
+        :return: The sequence itself, for chaining
+        :rtype: Sequence
+        """
+        order = len(self.events)
+        self.events.extend((at, order + i, name, value) for i, (at, value) in enumerate(zip(times, values)))
+        if len(self.events) > order:
+            assert min(times) >= 0, 'Events can not happen before the start of the sequence'
+            self.duration = max(self.duration, max(times))
+        return self
+
+    def pass_time(self, value):
+        """ Moves the current end of the sequence forward
+
+        :param value: Seconds
+        :type value: float
+        :return: The sequence itself, for chaining
+        :rtype: Sequence
+        """
+        self.cursor += value
+        self.duration = max(self.duration, self.cursor)
+        return self
+
+    def steps(self):
+        """ The events merged into steps, one for every point in time
+
+        :return: (time, {name: value}) pairs in time order
+        :rtype: list
+        """
+        steps = list()
+        for at, order, name, value in sorted(self.events):
+            if steps and steps[-1][0] == at:
+                steps[-1][1][name] = value
+            else:
+                steps.append((at, {name: value}))
+        return steps
+
+    def run(self, board, spin_time=DEFAULT_SPIN_TIME, wait_end=True):
+        """ Plays the sequence
+
+        :param board: What to write to, anything with a write_pins method (Pyrduino, BoardPool, ...). If it has a
+            flush method too, it is called after every step so buffered writes go out on time.
+        :param spin_time: Seconds to busy wait before every step instead of sleeping. More is more precise and uses more
+            CPU, 0 only sleeps.
+        :type spin_time: float
+        :param wait_end: Also wait for the time after the last step, so sequences can be played one after another
+        :type wait_end: bool
+        :return: How well the timing went
+        :rtype: SequenceReport
+        """
+        clock = time.perf_counter
+        flush = getattr(board, 'flush', None)
+        lateness = list()
+        start = clock()
+        for at, values in self.steps():
+            _wait_until(start + at, spin_time)
+            lateness.append(clock() - start - at)
+            board.write_pins(values)
+            if flush is not None:
+                flush()
+        if wait_end:
+            _wait_until(start + self.duration, spin_time)
+        return SequenceReport(lateness, clock() - start, self.duration)
+
+
+class SequenceReport:
+    """ The achieved timing of a played sequence. Lateness is how much after its time a step was written. """
+    def __init__(self, lateness, elapsed, duration):
+        """
+        :param lateness: Seconds every step was late
+        :type lateness: list
+        :param elapsed: Seconds the whole run took
+        :type elapsed: float
+        :param duration: Seconds the sequence should have taken
+        :type duration: float
+        """
+        self.lateness = lateness
+        self.steps = len(lateness)
+        self.elapsed = elapsed
+        self.duration = duration
+        self.mean_lateness = sum(lateness) / len(lateness) if lateness else 0.0
+        self.max_lateness = max(lateness) if lateness else 0.0
+        # Standard deviation of the lateness, i.e. the jitter
+        self.jitter = math.sqrt(sum((x - self.mean_lateness) ** 2 for x in lateness) / len(lateness)) \
+            if lateness else 0.0
+
+    def __repr__(self):
+        return ('SequenceReport(steps={}, mean_lateness={:.6f}, max_lateness={:.6f}, jitter={:.6f}, elapsed={:.6f}, '
+                'duration={:.6f})').format(self.steps, self.mean_lateness, self.max_lateness, self.jitter,
+                                           self.elapsed, self.duration)
+
+    def as_dict(self):
+        """ The summary numbers of the report
+
+        :rtype: dict
+        """
+        return {
+            'steps': self.steps,
+            'mean_lateness': self.mean_lateness,
+            'max_lateness': self.max_lateness,
+            'jitter': self.jitter,
+            'elapsed': self.elapsed,
+            'duration': self.duration
+        }
+
+
+def _wait_until(deadline, spin_time):
+    """ Sleeps until close to the deadline, then busy waits the rest
+
+    :param deadline: time.perf_counter value to wait for
+    :type deadline: float
+    :param spin_time: Seconds to busy wait at the end
+    :type spin_time: float
+    :return: None
+    """
+    remaining = deadline - time.perf_counter()
+    if remaining > spin_time:
+        time.sleep(remaining - spin_time)
+    while time.perf_counter() < deadline:
+        pass
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+# Pin values shared with other processes.
+#
+# Only one process can have the serial port, so it publishes the values of its pins into a shared memory block which
+# any number of other processes can read without asking anything from the owner. The block has a fixed layout:
+#
+#   header: magic (8 bytes) | format version (uint16) | pin count (uint16) | ring capacity (uint32)
+#           | pin table length (uint32) | writer count (uint32) | publish count (uint64)
+#   pin table (JSON, padded to a multiple of 8 bytes)
+#   a slot per pin: sequence (uint64) | value (float64) | time (float64) | updates (uint64)
+#   a command ring per writer: head (uint64) | tail (uint64) | entries of pin index (uint32) | reserved | value
+#
+# Every slot is a seqlock: the owner makes the sequence odd, writes the slot and makes it even again, and a reader
+# tries again if the sequence was odd or changed while it was reading. Each command ring has a single producer
+# (the client process using that writer number) and a single consumer (the owner), so they only need the head and
+# the tail, which only one side ever writes.
+
+import json
+import math
+import os
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from .pyrduino import PIN_TYPE_ANALOG, PIN_MODE_INPUT, PIN_MODE_PWM, logger
+
+MAGIC = b'PYRDSHM\x00'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sHHIIIQ')
+SLOT = struct.Struct('<QddQ')
+RING_HEADER = struct.Struct('<QQ')
+ENTRY = struct.Struct('<IId')
+# Where the publish count is in the header
+PUBLISH_COUNT_OFFSET = 24
+
+# Seconds between the publisher looking at the command rings, the pin values are published as they change
+DEFAULT_INTERVAL = 0.005
+DEFAULT_WRITERS = 4
+DEFAULT_RING_CAPACITY = 256
+
+# Attempts to read a slot while the owner keeps writing it
+READ_RETRIES = 1000
+
+# Published value of a pin before anything has been published
+_UNPUBLISHED = object()
+
+# Names of the blocks published by this process
+_published_here = set()
+
+
+class _Layout:
+    """ Offsets of the parts of a block """
+    def __init__(self, table_length, pin_count, writers, ring_capacity):
+        self.table_offset = HEADER.size
+        self.slots_offset = HEADER.size + table_length
+        self.rings_offset = self.slots_offset + pin_count * SLOT.size
+        self.ring_size = RING_HEADER.size + ring_capacity * ENTRY.size
+        self.size = self.rings_offset + writers * self.ring_size
+
+    def slot(self, index):
+        return self.slots_offset + index * SLOT.size
+
+    def ring(self, writer):
+        return self.rings_offset + writer * self.ring_size
+
+
+class SharedStatePublisher:
+    """ Mirrors the registered pins of a board into shared memory and carries out the writes other processes send
+
+    The inputs are published by the reader thread right after the board reports them and the outputs right after
+    they are written, so nothing is polled. Only the command rings are looked at on a timer.
+
+    publisher = SharedStatePublisher(board, 'greenhouse')
+    ...
+    publisher.close()
+    """
+    def __init__(self, board, name=None, writers=DEFAULT_WRITERS, ring_capacity=DEFAULT_RING_CAPACITY,
+                 interval=DEFAULT_INTERVAL):
+        """ Constructor for the publisher, creates the block and starts publishing
+
+        :param board: The board, its pins registered at this moment are published
+        :type board: Pyrduino
+        :param name: Name of the shared memory block, a random one by default (see the name attribute)
+        :type name: str
+        :param writers: Number of command rings, one for every process that wants to write
+        :type writers: int
+        :param ring_capacity: Writes each ring can hold
+        :type ring_capacity: int
+        :param interval: Seconds between the looks at the command rings
+        :type interval: float
+        """
+        self.board = board
+        self.interval = interval
+        self.pins = list(board.registered_pins.values())
+        table = json.dumps([{'name': pin.name, 'number': pin.number, 'pin_type': pin.pin_type,
+                             'pin_mode': pin.pin_mode} for pin in self.pins]).encode('utf-8')
+        table += b' ' * (-(HEADER.size + len(table)) % 8)
+        self._layout = _Layout(len(table), len(self.pins), writers, ring_capacity)
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=self._layout.size)
+        self.name = self._shm.name
+        _published_here.add(self.name)
+        buf = self._shm.buf
+        buf[:self._layout.size] = bytes(self._layout.size)
+        HEADER.pack_into(buf, 0, MAGIC, FORMAT_VERSION, len(self.pins), ring_capacity, len(table), writers, 0)
+        buf[HEADER.size:HEADER.size + len(table)] = table
+        self._writers = writers
+        self._ring_capacity = ring_capacity
+        self._indexes = dict((pin.name, index) for index, pin in enumerate(self.pins))
+        # Never equal to a pin value, so even None is published once
+        self._published = [_UNPUBLISHED] * len(self.pins)
+        self._updates = [0] * len(self.pins)
+        self._publish_count = 0
+        # The reader thread and the writing threads both publish, but a seqlock slot can only have one writer at a time
+        self._lock = threading.Lock()
+
+        self.publish()
+        self._watchers = [board._add_change_callback(pin, _Watcher(self, (index, )))
+                          for index, pin in enumerate(self.pins) if pin.pin_type == PIN_TYPE_ANALOG
+                          or pin.pin_mode == PIN_MODE_INPUT]
+        # Kept so the very same listener can be removed again
+        self._write_listener = self._on_write
+        board._add_write_listener(self._write_listener)
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='pyrduino-shared')
+        self._thread.daemon = True
+        self._thread.start()
+        logger.debug('Publishing {} pins in shared memory {}'.format(len(self.pins), self.name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.serve_writes()
+            except Exception:
+                logger.exception('Serving the writes of shared memory {} failed'.format(self.name))
+
+    def _on_write(self, pins):
+        indexes = self._indexes
+        self._publish([indexes[pin.name] for pin in pins if pin.name in indexes])
+
+    def publish(self):
+        """ Writes the changed values of all the pins to the block, only needed if the pins have been changed some
+        other way than through the board
+
+        :return: None
+        """
+        self._publish(range(len(self.pins)))
+
+    def _publish(self, indexes):
+        """ Writes the changed values of some pins to the block
+
+        :param indexes: Indexes of the pins in the block
+        :return: None
+        """
+        with self._lock:
+            if self._shm is None:
+                return
+            buf = self._shm.buf
+            now = time.time()
+            changed = False
+            for index in indexes:
+                value = self.pins[index].pin.value
+                if value == self._published[index]:
+                    continue
+                self._published[index] = value
+                self._updates[index] += 1
+                offset = self._layout.slot(index)
+                sequence = struct.unpack_from('<Q', buf, offset)[0]
+                struct.pack_into('<Q', buf, offset, sequence + 1)
+                SLOT.pack_into(buf, offset, sequence + 1, math.nan if value is None else float(value), now,
+                               self._updates[index])
+                struct.pack_into('<Q', buf, offset, sequence + 2)
+                changed = True
+            if changed:
+                self._publish_count += 1
+                struct.pack_into('<Q', buf, PUBLISH_COUNT_OFFSET, self._publish_count)
+
+    def serve_writes(self):
+        """ Carries out the writes waiting in the command rings, called by the publishing thread
+
+        :return: None
+        """
+        buf = self._shm.buf
+        for writer in range(self._writers):
+            offset = self._layout.ring(writer)
+            head, tail = RING_HEADER.unpack_from(buf, offset)
+            while tail < head:
+                entry = offset + RING_HEADER.size + (tail % self._ring_capacity) * ENTRY.size
+                index, reserved, value = ENTRY.unpack_from(buf, entry)
+                tail += 1
+                struct.pack_into('<Q', buf, offset + 8, tail)
+                if index < len(self.pins):
+                    pin = self.pins[index]
+                    try:
+                        # Only PWM takes fractions, the others are whole numbers
+                        self.board.write_pin(pin.name, value if pin.pin_mode == PIN_MODE_PWM else int(value))
+                    except Exception as e:
+                        logger.warning('Shared write to pin {} failed: {}'.format(pin.name, e))
+
+    def close(self):
+        """ Stops publishing and removes the block
+
+        :return: None
+        """
+        if self._shm is None:
+            return
+        for watcher in self._watchers:
+            self.board.remove_callback(watcher)
+        self.board._remove_write_listener(self._write_listener)
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        with self._lock:
+            self._shm.close()
+            self._shm.unlink()
+            _published_here.discard(self.name)
+            self._shm = None
+
+
+class _Watcher:
+    """ Publishes input pins after every message the board sends about them, a change callback of the board """
+    __slots__ = ('publisher', 'indexes')
+
+    def __init__(self, publisher, indexes):
+        self.publisher = publisher
+        self.indexes = indexes
+
+    def check(self):
+        self.publisher._publish(self.indexes)
+
+
+class SharedStateClient:
+    """ Reads the pin values published by another process, and optionally sends it writes
+
+    client = SharedStateClient('greenhouse', writer=0)
+    client.read('temperature')
+    client.write('fan', 1)
+    """
+    def __init__(self, name, writer=None):
+        """ Constructor for the client, attaches to an existing block
+
+        :param name: Name of the block given to (or chosen by) the publisher
+        :type name: str
+        :param writer: Number of the command ring to write through, every writing process needs its own.
+            None for a client that only reads.
+        :type writer: int
+        """
+        self._shm = _attach(name)
+        self.name = name
+        buf = self._shm.buf
+        magic, version, pin_count, ring_capacity, table_length, writers, publish_count = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self.close()
+            raise IOError('{} is not a pyrduino shared memory block of a known version'.format(name))
+        self.pins = json.loads(bytes(buf[HEADER.size:HEADER.size + table_length]).decode('utf-8'))
+        self._indexes = dict((pin['name'], index) for index, pin in enumerate(self.pins))
+        self._layout = _Layout(table_length, pin_count, writers, ring_capacity)
+        self._ring_capacity = ring_capacity
+        assert writer is None or 0 <= writer < writers, 'The block has writers 0-{}'.format(writers - 1)
+        self.writer = writer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def names(self):
+        """ Names of the published pins """
+        return [pin['name'] for pin in self.pins]
+
+    @property
+    def publish_count(self):
+        """ How many times the publisher has changed anything, handy for noticing that something changed """
+        return struct.unpack_from('<Q', self._shm.buf, PUBLISH_COUNT_OFFSET)[0]
+
+    def read_slot(self, name):
+        """ The latest value of a pin with its details
+
+        :param name: Name of a published pin
+        :type name: str
+        :return: Value (None if the board hasn't reported it yet), time.time() of the update and the number of
+            updates of the pin
+        :rtype: tuple
+        """
+        buf = self._shm.buf
+        offset = self._layout.slot(self._indexes[name])
+        for _ in range(READ_RETRIES):
+            sequence, value, updated, updates = SLOT.unpack_from(buf, offset)
+            if sequence % 2 == 0 and struct.unpack_from('<Q', buf, offset)[0] == sequence:
+                return (None if math.isnan(value) else value), updated, updates
+            # The owner may have been stopped in the middle of the write, give it the processor to finish
+            time.sleep(0)
+        raise IOError('Pin {} kept changing while it was read'.format(name))
+
+    def read(self, name):
+        """ The latest value of a pin
+
+        :param name: Name of a published pin
+        :type name: str
+        :return: Pin value, None if the board hasn't reported it yet
+        """
+        return self.read_slot(name)[0]
+
+    def snapshot(self):
+        """ The latest values of all the pins
+
+        :return: Values by pin name
+        :rtype: dict
+        """
+        return dict((name, self.read(name)) for name in self._indexes)
+
+    def write(self, name, value):
+        """ Asks the publisher to write a value to a pin
+
+        :param name: Name of a published pin
+        :type name: str
+        :param value: Value to write
+        :type value: float
+        :return: False if the command ring is full
+        :rtype: bool
+        """
+        assert self.writer is not None, 'Give the client a writer number to write'
+        buf = self._shm.buf
+        offset = self._layout.ring(self.writer)
+        head, tail = RING_HEADER.unpack_from(buf, offset)
+        if head - tail >= self._ring_capacity:
+            return False
+        ENTRY.pack_into(buf, offset + RING_HEADER.size + (head % self._ring_capacity) * ENTRY.size,
+                        self._indexes[name], 0, float(value))
+        # The entry is written before the head moves, so the publisher never reads half of it
+        struct.pack_into('<Q', buf, offset, head + 1)
+        return True
+
+    def close(self):
+        """ Detaches from the block, the block stays for the other processes
+
+        :return: None
+        """
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+
+def _attach(name):
+    """ Opens an existing block without letting this process remove it when it exits """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 every process attaching registers the block to be removed at its exit
+        shm = shared_memory.SharedMemory(name=name)
+        # A publisher in this process removes the block itself and its registration with it
+        if os.name == 'posix' and name not in _published_here:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
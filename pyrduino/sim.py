@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+# A software Firmata board for testing and benchmarking without hardware.
+#
+# SimulatedBoard behaves like an Arduino running StandardFirmata: it answers the version, firmware, capability and
+# analog mapping queries, keeps track of pin modes and output values, reports digital inputs when they change and
+# analog inputs at the sampling interval (or any rate you like). It can be connected to the host side in two ways:
+#   * LoopbackTransport is a serial.Serial look-alike living in the same process, used by Pyrduino(board_type='sim')
+#     or given to Pyrduino as transport
+#   * PtyBridge serves the board on a pseudo terminal, so anything that opens a serial port by name can talk to it
+
+import os
+import threading
+import time
+
+from pyfirmata import BOARDS
+
+from . import protocol
+from .protocol import (ANALOG_MAPPING_QUERY, ANALOG_MAPPING_RESPONSE, ANALOG_MESSAGE, CAPABILITY_QUERY,
+                       CAPABILITY_RESPONSE, DIGITAL_MESSAGE, EXTENDED_ANALOG, PIN_STATE_QUERY, PIN_STATE_RESPONSE,
+                       REPORT_ANALOG, REPORT_DIGITAL, REPORT_FIRMWARE, REPORT_VERSION, SAMPLING_INTERVAL,
+                       SERVO_CONFIG, SET_DIGITAL_PIN_VALUE, SET_PIN_MODE, START_SYSEX, SYSTEM_RESET, INPUT, OUTPUT,
+                       ANALOG, PWM, SERVO)
+
+# The same board types as in pyrduino, repeated here to keep the import one way
+SIM_LAYOUTS = {
+    'arduino': BOARDS['arduino'],
+    'mega': BOARDS['arduino_mega'],
+    'nano': BOARDS['arduino_nano'],
+    'due': BOARDS['arduino_due']
+}
+
+# StandardFirmata samples the analog inputs every 19 ms by default
+DEFAULT_SAMPLING_INTERVAL = 0.019
+
+
+class SimulatedBoard:
+    """ An in-process Firmata board """
+    def __init__(self, board_type='arduino', firmata_version=(2, 5), firmware='StandardFirmata.ino',
+                 analog_rate=None, signal=None):
+        """ Constructor for the simulated board
+
+        :param board_type: Which board to look like, one of the pyrduino board types
+        :type board_type: str
+        :param firmata_version: Protocol version to report
+        :type firmata_version: tuple
+        :param firmware: Firmware name to report
+        :type firmware: str
+        :param analog_rate: Analog reports per second. By default the board follows the sampling interval the host
+            sets like a real one does, give a rate to report faster than a real board could.
+        :type analog_rate: float
+        :param signal: Function signal(channel, t) returning the raw 0-1023 value of an analog channel at time t.
+            Without it the analog inputs report what set_analog has set.
+        """
+        layout = SIM_LAYOUTS[board_type]
+        self.board_type = board_type
+        self.firmata_version = tuple(firmata_version)
+        self.firmware = firmware
+        self.analog_rate = analog_rate
+        self.signal = signal
+        self.sampling_interval = DEFAULT_SAMPLING_INTERVAL
+
+        # Analog channels come right after the digital pins, as on the real boards
+        self.digital_count = len(layout['digital'])
+        self.pin_count = self.digital_count + len(layout['analog'])
+        self.capabilities = dict()
+        self.analog_mapping = dict()
+        for pin_number in range(self.pin_count):
+            if pin_number >= self.digital_count:
+                self.capabilities[pin_number] = {INPUT: 1, OUTPUT: 1, ANALOG: 10}
+                self.analog_mapping[pin_number - self.digital_count] = pin_number
+            elif pin_number in layout['disabled']:
+                self.capabilities[pin_number] = dict()
+            else:
+                self.capabilities[pin_number] = {INPUT: 1, OUTPUT: 1, SERVO: 14}
+                if pin_number in layout['pwm']:
+                    self.capabilities[pin_number][PWM] = 8
+
+        # Pin modes, input levels given with set_digital and values written by the host, by pin number
+        self.pin_modes = dict()
+        self.inputs = [0] * self.pin_count
+        self.outputs = dict()
+        # Raw analog input values by channel
+        self.analog_values = [0] * len(self.analog_mapping)
+        self.reporting_analog = set()
+        self.reporting_ports = set()
+        # Counts of host messages by command byte, handy in tests and benchmarks
+        self.received = dict()
+
+        self._parser = protocol.FirmataParser(protocol.HOST_MESSAGE_LENGTHS)
+        self._lock = threading.RLock()
+        self._send = None
+        self._output_listeners = list()
+        self._reporter = None
+        self._stop = threading.Event()
+
+    def attach(self, send):
+        """ Connects the board to a host side
+
+        :param send: Function called with the bytes the board sends
+        :return: None
+        """
+        self._send = send
+
+    def detach(self):
+        """ Disconnects the board and stops reporting
+
+        :return: None
+        """
+        self._send = None
+        self.close()
+
+    def close(self):
+        """ Stops the analog reporting thread
+
+        :return: None
+        """
+        self._stop.set()
+        if self._reporter is not None and self._reporter is not threading.current_thread():
+            self._reporter.join()
+        self._reporter = None
+
+    def on_output(self, listener):
+        """ Calls listener(pin_number, value) whenever the host writes an output
+
+        :return: None
+        """
+        self._output_listeners.append(listener)
+
+    def pin_mode(self, pin_number):
+        """ The current Firmata mode of a pin. After a reset digital pins are outputs and analog pins analog inputs.
+
+        :rtype: int
+        """
+        mode = self.pin_modes.get(pin_number)
+        if mode is None:
+            if pin_number >= self.digital_count:
+                return ANALOG
+            return OUTPUT if self.capabilities[pin_number] else protocol.UNAVAILABLE
+        return mode
+
+    def set_digital(self, pin_number, value):
+        """ Sets the level of a digital input, reported to the host if it changes and the port is reporting
+
+        :param pin_number: Number of the pin
+        :type pin_number: int
+        :param value: Level
+        :type value: bool or int
+        :return: None
+        """
+        with self._lock:
+            value = 1 if value else 0
+            if self.inputs[pin_number] == value:
+                return
+            self.inputs[pin_number] = value
+            port_number = pin_number // 8
+            if port_number in self.reporting_ports:
+                self._write(self._port_message(port_number))
+
+    def set_analog(self, channel, value):
+        """ Sets the raw value (0-1023) of an analog input, reported at the next sampling interval
+
+        :param channel: Analog channel (the number after the A on the board)
+        :type channel: int
+        :param value: Raw value
+        :type value: int
+        :return: None
+        """
+        self.analog_values[channel] = int(value)
+
+    def send_analog(self, channel, value):
+        """ Sets the raw value (0-1023) of an analog input and reports it right away if the channel is reporting
+
+        :param channel: Analog channel
+        :type channel: int
+        :param value: Raw value
+        :type value: int
+        :return: None
+        """
+        with self._lock:
+            value = max(0, min(int(value), 1023))
+            self.analog_values[channel] = value
+            if channel in self.reporting_analog:
+                self._write(bytearray([ANALOG_MESSAGE + channel, value % 128, value >> 7]))
+
+    def receive(self, data):
+        """ Handles bytes sent by the host
+
+        :param data: Firmata messages
+        :type data: bytes
+        :return: None
+        """
+        with self._lock:
+            for command, channel, payload in self._parser.feed(data):
+                self.received[command] = self.received.get(command, 0) + 1
+                self._handle(command, channel, payload)
+
+    def _handle(self, command, channel, data):
+        if command == DIGITAL_MESSAGE:
+            mask = protocol.two_byte_value(data)
+            for bit in range(8):
+                pin_number = channel * 8 + bit
+                if pin_number < self.pin_count and self.pin_mode(pin_number) == OUTPUT:
+                    self._set_output(pin_number, (mask >> bit) & 1)
+        elif command == ANALOG_MESSAGE:
+            self._set_output(channel, protocol.two_byte_value(data))
+        elif command == SET_DIGITAL_PIN_VALUE:
+            self._set_output(data[0], data[1])
+        elif command == SET_PIN_MODE:
+            self.pin_modes[data[0]] = data[1]
+        elif command == REPORT_ANALOG:
+            if data[0]:
+                self.reporting_analog.add(channel)
+                self._start_reporting()
+            else:
+                self.reporting_analog.discard(channel)
+        elif command == REPORT_DIGITAL:
+            if data[0]:
+                self.reporting_ports.add(channel)
+                # Firmata reports the current state right away
+                self._write(self._port_message(channel))
+            else:
+                self.reporting_ports.discard(channel)
+        elif command == REPORT_VERSION:
+            self._write(bytearray([REPORT_VERSION, self.firmata_version[0], self.firmata_version[1]]))
+        elif command == SYSTEM_RESET:
+            self.pin_modes.clear()
+            self.outputs.clear()
+            self.reporting_analog.clear()
+            self.reporting_ports.clear()
+        elif command == START_SYSEX:
+            self._handle_sysex(channel, data)
+
+    def _handle_sysex(self, command, data):
+        if command == CAPABILITY_QUERY:
+            response = bytearray()
+            for pin_number in range(self.pin_count):
+                for mode, resolution in sorted(self.capabilities[pin_number].items()):
+                    response += bytearray([mode, resolution])
+                response.append(protocol.CAPABILITY_PIN_END)
+            self._write(protocol.sysex(CAPABILITY_RESPONSE, response))
+        elif command == ANALOG_MAPPING_QUERY:
+            channels = dict((pin_number, channel) for channel, pin_number in self.analog_mapping.items())
+            response = [channels.get(pin_number, protocol.NO_ANALOG_CHANNEL) for pin_number in range(self.pin_count)]
+            self._write(protocol.sysex(ANALOG_MAPPING_RESPONSE, response))
+        elif command == REPORT_FIRMWARE:
+            response = bytearray(self.firmata_version)
+            for char in self.firmware.encode('ascii'):
+                response += bytearray([char & 0x7F, char >> 7])
+            self._write(protocol.sysex(REPORT_FIRMWARE, response))
+        elif command == EXTENDED_ANALOG:
+            value = 0
+            for position, byte in enumerate(data[1:]):
+                value |= byte << (7 * position)
+            self._set_output(data[0], value)
+        elif command == SERVO_CONFIG:
+            self.pin_modes[data[0]] = SERVO
+        elif command == SAMPLING_INTERVAL:
+            self.sampling_interval = max(protocol.two_byte_value(data), 1) / 1000.0
+        elif command == PIN_STATE_QUERY:
+            pin_number = data[0]
+            mode = self.pin_mode(pin_number)
+            value = self.outputs.get(pin_number, self.inputs[pin_number])
+            self._write(protocol.sysex(PIN_STATE_RESPONSE, [pin_number, mode, value % 128, value >> 7]))
+
+    def _set_output(self, pin_number, value):
+        self.outputs[pin_number] = value
+        for listener in self._output_listeners:
+            listener(pin_number, value)
+
+    def _port_message(self, port_number):
+        mask = 0
+        for bit in range(8):
+            pin_number = port_number * 8 + bit
+            if pin_number < self.pin_count and self.pin_modes.get(pin_number) == INPUT and self.inputs[pin_number]:
+                mask |= 1 << bit
+        return protocol.digital_port(port_number, mask)
+
+    def _write(self, data):
+        send = self._send
+        if send is not None:
+            send(bytes(data))
+
+    def _start_reporting(self):
+        if self._reporter is None:
+            self._stop.clear()
+            self._reporter = threading.Thread(target=self._report_loop, name='pyrduino-sim-reporter')
+            self._reporter.daemon = True
+            self._reporter.start()
+
+    def _report_loop(self):
+        """ Sends the analog values of the reporting channels at the sampling interval (or the analog rate) """
+        start = next_report = time.perf_counter()
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            if now < next_report:
+                time.sleep(min(next_report - now, 0.05))
+                continue
+            msg = bytearray()
+            for channel in sorted(self.reporting_analog):
+                if self.signal is not None:
+                    value = int(self.signal(channel, now - start))
+                else:
+                    value = self.analog_values[channel]
+                value = max(0, min(value, 1023))
+                msg += bytearray([ANALOG_MESSAGE + channel, value % 128, value >> 7])
+            if msg:
+                with self._lock:
+                    self._write(msg)
+            next_report += 1.0 / self.analog_rate if self.analog_rate else self.sampling_interval
+            if next_report < now - 1:
+                # Don't try to catch up after a long stall
+                next_report = now
+
+
+class LoopbackTransport:
+    """ serial.Serial look-alike connected to a SimulatedBoard in the same process """
+    def __init__(self, board, port='sim', timeout=None, owns_board=False):
+        """ Constructor for the transport
+
+        :param board: The board to talk to
+        :type board: SimulatedBoard
+        :param port: Name shown as the serial port
+        :type port: str
+        :param timeout: Seconds read waits for data, None waits forever like serial.Serial
+        :type timeout: float
+        :param owns_board: Close the board too when the transport is closed
+        :type owns_board: bool
+        """
+        self.board = board
+        self.port = port
+        self.timeout = timeout
+        self.owns_board = owns_board
+        self.is_open = True
+        self._buffer = bytearray()
+        self._condition = threading.Condition()
+        board.attach(self._from_board)
+
+    def _from_board(self, data):
+        with self._condition:
+            self._buffer += data
+            self._condition.notify_all()
+
+    def write(self, data):
+        if not self.is_open:
+            raise IOError('Transport {} is closed'.format(self.port))
+        self.board.receive(bytes(data))
+        return len(data)
+
+    def read(self, size=1):
+        with self._condition:
+            if not self._buffer and self.is_open:
+                self._condition.wait_for(lambda: self._buffer or not self.is_open, self.timeout)
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            return data
+
+    def inWaiting(self):
+        return len(self._buffer)
+
+    @property
+    def in_waiting(self):
+        return len(self._buffer)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            if self.owns_board:
+                self.board.detach()
+            with self._condition:
+                self._condition.notify_all()
+
+
+class PtyBridge:
+    """ Serves a SimulatedBoard on a pseudo terminal (Linux and macOS)
+
+    bridge = PtyBridge(SimulatedBoard())
+    board = Pyrduino(bridge.path, ready_mode=READY_MODE_HANDSHAKE)
+    """
+    def __init__(self, board):
+        """ Constructor for the bridge, the terminal is ready to be opened when this returns
+
+        :param board: The board to serve
+        :type board: SimulatedBoard
+        """
+        import pty
+        import tty
+        self.board = board
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        tty.setraw(self._master)
+        self.path = os.ttyname(self._slave)
+        board.attach(self._from_board)
+        self._thread = threading.Thread(target=self._read_loop, name='pyrduino-sim-pty')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _from_board(self, data):
+        os.write(self._master, data)
+
+    def _read_loop(self):
+        while True:
+            try:
+                data = os.read(self._master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            self.board.receive(data)
+
+    def close(self):
+        """ Closes the terminal and the board
+
+        :return: None
+        """
+        self.board.detach()
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# Instrumentation of a board: where the time goes and how much goes through.
+#
+# Everything here is only touched when the statistics of a board are enabled. The serial port and the iterate method
+# of the pyfirmata board are then wrapped to count the bytes and time the writes and the incoming frames, and the
+# Pyrduino read and write methods count per pin. When disabled nothing is wrapped and the methods only check that
+# the statistics are None.
+#
+# The counters are updated without locking, so with many threads writing at once a few counts may get lost.
+
+import bisect
+import time
+
+# Upper bounds of the histogram buckets: 1 us to about 8 s for durations, 1 byte to 64 KiB for backlogs
+SECONDS_BUCKETS = tuple(0.000001 * 2 ** i for i in range(24))
+BYTES_BUCKETS = tuple(2 ** i for i in range(17))
+
+
+class Histogram:
+    """ Counts of values in fixed buckets, plus their count, sum and maximum """
+    def __init__(self, bounds):
+        """
+        :param bounds: Upper bounds of the buckets, in increasing order. Larger values go to an extra last bucket.
+        :type bounds: tuple
+        """
+        self.bounds = tuple(bounds)
+        self.reset()
+
+    def reset(self):
+        """ Forgets all the values
+
+        :return: None
+        """
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """ Adds a value
+
+        :param value: The value
+        :type value: float
+        :return: None
+        """
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """ Estimates a quantile as the upper bound of the bucket it falls in
+
+        :param q: The quantile, e.g. 0.99
+        :type q: float
+        :return: The estimate, or the maximum for the last bucket, or None without values
+        :rtype: float
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        """ The summary of the values
+
+        :rtype: dict
+        """
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99)
+        }
+
+
+class Stats:
+    """ Counters and histograms of a single board, see @Pyrduino.enable_stats """
+    def __init__(self, board_id):
+        """
+        :param board_id: Id of the board, used as a label in the Prometheus dump
+        :type board_id: str
+        """
+        self.board_id = board_id
+        self.write_seconds = Histogram(SECONDS_BUCKETS)
+        self.decode_seconds = Histogram(SECONDS_BUCKETS)
+        self.callback_seconds = Histogram(SECONDS_BUCKETS)
+        self.backlog_bytes = Histogram(BYTES_BUCKETS)
+        self.reset()
+
+    def reset(self):
+        """ Starts all the counts over
+
+        :return: None
+        """
+        self.reads = dict()
+        self.writes = dict()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.frames = 0
+        self.backlog = 0
+        self.started = time.time()
+        for histogram in (self.write_seconds, self.decode_seconds, self.callback_seconds, self.backlog_bytes):
+            histogram.reset()
+
+    def count_read(self, name):
+        self.reads[name] = self.reads.get(name, 0) + 1
+
+    def count_write(self, name):
+        self.writes[name] = self.writes.get(name, 0) + 1
+
+    def snapshot(self):
+        """ The current values of everything
+
+        :rtype: dict
+        """
+        return {
+            'board_id': self.board_id,
+            'seconds': time.time() - self.started,
+            'reads': dict(self.reads),
+            'writes': dict(self.writes),
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'frames': self.frames,
+            'backlog': self.backlog,
+            'write_seconds': self.write_seconds.snapshot(),
+            'decode_seconds': self.decode_seconds.snapshot(),
+            'callback_seconds': self.callback_seconds.snapshot(),
+            'backlog_bytes': self.backlog_bytes.snapshot()
+        }
+
+    def prometheus(self, prefix='pyrduino'):
+        """ The statistics in the Prometheus text exposition format
+
+        :param prefix: Prefix of the metric names
+        :type prefix: str
+        :rtype: str
+        """
+        board = 'board="{}"'.format(_escape(self.board_id))
+        lines = list()
+
+        def metric(name, kind, help_text, samples):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+            for suffix, labels, value in samples:
+                lines.append('{}_{}{}{{{}}} {}'.format(prefix, name, suffix, ','.join((board, ) + labels), value))
+
+        def histogram(name, help_text, histogram):
+            samples = list()
+            cumulative = 0
+            for bound, count in zip(histogram.bounds + ('+Inf', ), histogram.buckets):
+                cumulative += count
+                samples.append(('_bucket', ('le="{}"'.format(bound if bound == '+Inf' else repr(bound)), ),
+                                cumulative))
+            samples.append(('_sum', (), repr(histogram.sum)))
+            samples.append(('_count', (), histogram.count))
+            metric(name, 'histogram', help_text, samples)
+
+        metric('bytes_sent_total', 'counter', 'Bytes written to the board', [('', (), self.bytes_sent)])
+        metric('bytes_received_total', 'counter', 'Bytes read from the board', [('', (), self.bytes_received)])
+        metric('frames_total', 'counter', 'Messages handled by the reader thread', [('', (), self.frames)])
+        metric('reader_backlog_bytes', 'gauge', 'Bytes waiting to be read when the last message was handled',
+               [('', (), self.backlog)])
+        metric('pin_reads_total', 'counter', 'Reads of a pin',
+               [('', ('pin="{}"'.format(_escape(name)), ), count) for name, count in sorted(self.reads.items())])
+        metric('pin_writes_total', 'counter', 'Writes to a pin',
+               [('', ('pin="{}"'.format(_escape(name)), ), count) for name, count in sorted(self.writes.items())])
+        histogram('write_seconds', 'Time taken by the serial writes', self.write_seconds)
+        histogram('decode_seconds', 'Time taken by reading and handling one incoming message', self.decode_seconds)
+        histogram('callback_seconds', 'Time taken by the change callbacks of one incoming message',
+                  self.callback_seconds)
+        histogram('backlog_bytes', 'Bytes waiting to be read before each incoming message', self.backlog_bytes)
+        return '\n'.join(lines) + '\n'
+
+
+class CountingSerial:
+    """ Wraps a serial port, counting the bytes both ways and timing the writes """
+    def __init__(self, sp, stats):
+        """
+        :param sp: The serial port (or anything like it)
+        :param stats: Where to count
+        :type stats: Stats
+        """
+        self.sp = sp
+        self.stats = stats
+
+    def __getattr__(self, name):
+        # Everything not counted goes straight to the port
+        return getattr(self.sp, name)
+
+    def write(self, data):
+        start = time.perf_counter()
+        written = self.sp.write(data)
+        self.stats.write_seconds.observe(time.perf_counter() - start)
+        self.stats.bytes_sent += len(data)
+        return written
+
+    def read(self, size=1):
+        data = self.sp.read(size)
+        self.stats.bytes_received += len(data)
+        return data
+
+
+def timed_iterate(board, stats):
+    """ Wraps the iterate method of a pyfirmata board to time every message and see how much is waiting behind it
+
+    :param board: The pyfirmata board
+    :param stats: Where to count
+    :type stats: Stats
+    :return: The wrapper, to be set as the iterate of the board instance
+    """
+    iterate = type(board).iterate.__get__(board)
+    clock = time.perf_counter
+
+    def wrapper():
+        backlog = board.sp.inWaiting()
+        start = clock()
+        iterate()
+        stats.decode_seconds.observe(clock() - start)
+        stats.backlog = backlog
+        stats.backlog_bytes.observe(backlog)
+        stats.frames += 1
+    return wrapper
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# Keeping the connection to a board up.
+#
+# When a USB cable blips, the serial port is gone for good: the reader thread stops and every write fails, and
+# starting over means a new Pyrduino and its whole startup. The supervisor notices the loss (a write failing, the
+# reader stopping or the board not answering the heartbeat version queries), opens the port again with a growing
+# delay between the attempts, waits for the board to answer and sends it the modes and values of all the registered
+# pins in a single write. The link holds the writes back meanwhile, so the callers only see a short stall.
+
+import threading
+import time
+
+import serial
+
+from . import protocol
+from .pyrduino import BOARD_TYPE_SIM, HANDSHAKE_QUERY_INTERVAL, logger
+from .stats import CountingSerial
+
+# Seconds between the version queries asking the board if it's still there
+DEFAULT_HEARTBEAT_INTERVAL = 1.0
+# Seconds without an answer to the heartbeat before the connection is considered lost
+DEFAULT_HEARTBEAT_TIMEOUT = 3.0
+# Seconds a write waits for the connection to come back before giving up
+DEFAULT_STALL_TIMEOUT = 10.0
+# Seconds before the first reopening attempt, doubled after every failed one up to the maximum
+DEFAULT_BACKOFF = 0.1
+DEFAULT_MAX_BACKOFF = 5.0
+# Seconds to wait for the board to answer after opening the port, long enough for the bootloader
+DEFAULT_READY_TIMEOUT = 5.0
+
+# Seconds between the checks of the connection
+CHECK_INTERVAL = 0.05
+
+
+class Supervisor:
+    """ Watches the connection to a board and opens it again when it's lost, see Pyrduino.supervise """
+    def __init__(self, board, opener=None, heartbeat_interval=DEFAULT_HEARTBEAT_INTERVAL,
+                 heartbeat_timeout=DEFAULT_HEARTBEAT_TIMEOUT, stall_timeout=DEFAULT_STALL_TIMEOUT,
+                 backoff=DEFAULT_BACKOFF, max_backoff=DEFAULT_MAX_BACKOFF, ready_timeout=DEFAULT_READY_TIMEOUT):
+        """ Constructor for the supervisor, starts watching right away
+
+        :param board: The board
+        :type board: Pyrduino
+        :param opener: Function returning a new open serial port (or transport) for the board. By default the
+            serial port of the board is opened with its settings, a board with a transport needs its own opener.
+        :param heartbeat_interval: Seconds between the version queries, None sends none and only the failed reads
+            and writes tell that the connection is lost
+        :type heartbeat_interval: float
+        :param heartbeat_timeout: Seconds without an answer before the connection is considered lost
+        :type heartbeat_timeout: float
+        :param stall_timeout: Seconds a write waits for the connection to come back before raising IOError
+        :type stall_timeout: float
+        :param backoff: Seconds before the first reopening attempt, doubled after every failed one
+        :type backoff: float
+        :param max_backoff: The longest delay between the attempts
+        :type max_backoff: float
+        :param ready_timeout: Seconds to wait for the board to answer after opening the port
+        :type ready_timeout: float
+        """
+        if opener is None and (board.transport is not None or board.board_type == BOARD_TYPE_SIM):
+            raise Exception('Board {} was not opened from a serial port, give an opener to reconnect it'
+                            .format(board.board_id))
+        self.board = board
+        self.opener = opener or self._open_serial
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.ready_timeout = ready_timeout
+        # How many times the connection has been opened again, and why it was lost the last time
+        self.reconnects = 0
+        self.last_error = None
+
+        self._link = board.board.sp
+        self._last_heard = time.monotonic()
+        self._lost = threading.Event()
+        self._stop = threading.Event()
+        board.board.add_cmd_handler(protocol.REPORT_VERSION, self._handle_report_version)
+        self._link.supervise(stall_timeout, self._on_lost)
+        self._thread = threading.Thread(target=self._run, name='pyrduino-supervisor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stops watching, a lost connection is not opened again after this
+
+        :return: None
+        """
+        self._stop.set()
+        self._lost.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _handle_report_version(self, major, minor):
+        self.board.board.firmata_version = (major, minor)
+        self._last_heard = time.monotonic()
+
+    def _on_lost(self, error):
+        # Called by the link on the thread whose write failed
+        self.last_error = error
+        self._lost.set()
+
+    def _run(self):
+        next_heartbeat = 0
+        while not self._stop.is_set():
+            self._lost.wait(CHECK_INTERVAL)
+            if self._stop.is_set():
+                return
+            now = time.monotonic()
+            reader = self.board._reader
+            if self._lost.is_set():
+                reason = self.last_error
+            elif not reader.is_alive():
+                if reader.crashed:
+                    # Opening the port again resets the board and the same bug would just stop the reader again
+                    logger.error('Reading board {} failed, not reconnecting it: {!r}'.format(self.board.board_id,
+                                                                                         reader.error))
+                    return
+                reason = 'reader stopped: {}'.format(reader.error)
+            elif self.heartbeat_interval is not None and now - self._last_heard > self.heartbeat_timeout:
+                reason = 'no answer in {} seconds'.format(self.heartbeat_timeout)
+            else:
+                if self.heartbeat_interval is not None and now >= next_heartbeat:
+                    next_heartbeat = now + self.heartbeat_interval
+                    try:
+                        self._link.send_now(bytearray([protocol.REPORT_VERSION]))
+                    except (serial.SerialException, OSError) as e:
+                        self._link.lost(e)
+                continue
+            self._reconnect(reason)
+            next_heartbeat = 0
+
+    def _reconnect(self, reason):
+        """ Opens the connection again and restores the state of the pins
+
+        :param reason: Why the connection was lost, for the log
+        :return: None
+        """
+        board = self.board
+        link = self._link
+        logger.warning('Lost the connection to board {}: {}'.format(board.board_id, reason))
+        started = time.monotonic()
+        link.online.clear()
+        board._reader.stop()
+        try:
+            link.sp.close()
+        except Exception:
+            pass
+        board._reader.join(1.0)
+
+        delay = self.backoff
+        while True:
+            sp = self._try_open()
+            if sp is not None:
+                break
+            if self._stop.wait(delay):
+                return
+            delay = min(delay * 2, self.max_backoff)
+
+        if board._stats is not None:
+            sp = CountingSerial(sp, board._stats)
+        link.attach(sp)
+        self._last_heard = time.monotonic()
+        self._lost.clear()
+        try:
+            # The board may have been reset, so everything is set up again before the held back writes go out
+            link.send_now(board._state_messages())
+        except (serial.SerialException, OSError) as e:
+            # Lost again already, the next round tries again
+            self.last_error = e
+            self._lost.set()
+            return
+        board._start_reader()
+        link.online.set()
+        self.reconnects += 1
+        logger.warning('Reconnected to board {} in {:.2f} seconds'.format(board.board_id,
+                                                                         time.monotonic() - started))
+
+    def _try_open(self):
+        """ Opens the port and waits for the board to answer
+
+        :return: The open port, or None if the board couldn't be reached
+        """
+        try:
+            sp = self.opener()
+        except (serial.SerialException, OSError) as e:
+            logger.debug('Could not open {}: {}'.format(self.board.board_id, e))
+            return None
+        try:
+            if self._handshake(sp):
+                return sp
+            logger.debug('Board on {} did not answer'.format(self.board.board_id))
+        except (serial.SerialException, OSError) as e:
+            logger.debug('Handshake with {} failed: {}'.format(self.board.board_id, e))
+        try:
+            sp.close()
+        except Exception:
+            pass
+        return None
+
+    def _handshake(self, sp):
+        """ Asks the board for its version until it answers, the reader thread isn't running yet
+
+        :return: True if the board answered in time
+        :rtype: bool
+        """
+        parser = protocol.FirmataParser(protocol.BOARD_MESSAGE_LENGTHS)
+        deadline = time.monotonic() + self.ready_timeout
+        next_query = 0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= deadline:
+                return False
+            if now >= next_query:
+                sp.write(bytearray([protocol.REPORT_VERSION]))
+                next_query = now + HANDSHAKE_QUERY_INTERVAL
+            waiting = sp.inWaiting()
+            if not waiting:
+                time.sleep(0.001)
+                continue
+            for command, channel, data in parser.feed(sp.read(waiting)):
+                if command == protocol.REPORT_VERSION:
+                    self.board.board.firmata_version = (data[0], data[1])
+                    return True
+        return False
+
+    def _open_serial(self):
+        board = self.board
+        return serial.Serial(board.board_id, board.baudrate, timeout=board.timeout, write_timeout=board.write_timeout)
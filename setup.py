@@ -13,9 +13,14 @@ setuptools.setup(
     long_description_content_type='text/markdown',
     install_requires=[
         'pyfirmata',
-        'dotmap',
         'pyserial',
     ],
+    extras_require={
+        'sampling': ['numpy'],
+        'motion': ['numpy'],
+        'yaml': ['pyyaml'],
+        'toml': ['tomli; python_version < "3.11"'],
+    },
     keywords='arduino',
     license='MIT',
     packages=setuptools.find_packages(),
@@ -0,0 +1,7 @@
+# -*- coding: utf-8 -*-
+# pyFirmata 1.1.0 uses inspect.getargspec, which is gone since Python 3.11. The tests put it back before pyrduino
+# imports pyfirmata, only the first item (the argument names) is used.
+import inspect
+
+if not hasattr(inspect, 'getargspec'):
+    inspect.getargspec = inspect.getfullargspec
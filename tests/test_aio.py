@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import pytest
+
+from pyrduino.aio import AsyncPyrduino
+from pyrduino.pyrduino import PIN_TYPE_DIGITAL, PIN_MODE_INPUT
+from pyrduino.sim import SimulatedBoard, PtyBridge
+
+
+def _run(test):
+    simulated = SimulatedBoard()
+    bridge = PtyBridge(simulated)
+
+    async def main():
+        board = AsyncPyrduino(bridge.path)
+        await board.connect()
+        try:
+            await board.register_pins([('led', 13), ('button', 2, PIN_TYPE_DIGITAL, PIN_MODE_INPUT)])
+            await test(board, simulated)
+        finally:
+            await board.close()
+    try:
+        asyncio.run(main())
+    finally:
+        bridge.close()
+
+
+async def _wait_for(check):
+    deadline = time.monotonic() + 1.0
+    while not check() and time.monotonic() < deadline:
+        await asyncio.sleep(0.005)
+    return check()
+
+
+def test_nothing_changes_when_a_pin_is_bad():
+    async def test(board, simulated):
+        with pytest.raises(IOError):
+            await board.write_pins({'led': 1, 'button': 1})
+        assert board.registered_pins['led'].value is None
+        assert board._port_masks.get(1, 0) == 0
+        await board.write_pins({'led': 1})
+        assert await _wait_for(lambda: simulated.outputs.get(13) == 1)
+    _run(test)
+
+
+def test_digital_values_like_pyrduino():
+    async def test(board, simulated):
+        await board.write_pin('led', 1)
+        assert await _wait_for(lambda: simulated.outputs.get(13) == 1)
+        # Only 1 is high, as in Pyrduino.write_pin
+        await board.write_pin('led', 2)
+        assert await _wait_for(lambda: simulated.outputs.get(13) == 0)
+    _run(test)
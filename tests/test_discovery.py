@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import time
+
+from pyrduino.discovery import probe
+from pyrduino.pyrduino import BOARD_TYPE_ARDUINO
+from pyrduino.sim import SimulatedBoard, PtyBridge
+
+
+def test_connect_with_reconnect():
+    simulated = SimulatedBoard()
+    bridge = PtyBridge(simulated)
+    try:
+        found = probe(bridge.path, timeout=2)
+        assert found.board_type == BOARD_TYPE_ARDUINO
+        board = found.connect(reconnect=True)
+        try:
+            board.register_pin('led', 13)
+            board.board.sp.lost(OSError('unplugged'))
+            # The write waits for the port to be opened again by its name
+            board.write_pin('led', 1)
+            deadline = time.monotonic() + 1.0
+            while simulated.outputs.get(13) != 1 and time.monotonic() < deadline:
+                time.sleep(0.005)
+            assert simulated.outputs[13] == 1
+            assert board._supervisor.reconnects == 1
+        finally:
+            board.exit_board()
+    finally:
+        bridge.close()
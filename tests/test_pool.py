@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from pyrduino.pool import BoardPool
+from pyrduino.pyrduino import BOARD_TYPE_SIM, PIN_TYPE_ANALOG, PIN_TYPE_DIGITAL, PIN_MODE_INPUT
+
+
+def test_snapshot_has_the_inputs():
+    with BoardPool([('a', BOARD_TYPE_SIM), ('b', BOARD_TYPE_SIM)]) as pool:
+        pool.register_pins([('light', 13), ('button', 2, PIN_TYPE_DIGITAL, PIN_MODE_INPUT),
+                            ('pot', 0, PIN_TYPE_ANALOG)])
+        pool.write_pin('light', 1)
+        snapshot = pool.snapshot()
+        assert sorted(snapshot) == ['a', 'b']
+        assert all(sorted(values) == ['button', 'pot'] for values in snapshot.values())
+        # Outputs are there when asked for, with the value last written
+        assert pool.snapshot(['light', 'button'])['a']['light'] == 1
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from pyrduino import protocol
+
+
+def test_messages_split_anywhere():
+    data = (protocol.analog_write(3, 200) + protocol.digital_port(1, 0x05)
+            + bytearray([protocol.REPORT_VERSION, 2, 5]))
+    expected = protocol.FirmataParser(protocol.HOST_MESSAGE_LENGTHS).feed(data)
+    assert expected == [(protocol.ANALOG_MESSAGE, 3, bytes([200 % 128, 200 >> 7])),
+                        (protocol.DIGITAL_MESSAGE, 1, bytes([0x05, 0])),
+                        (protocol.REPORT_VERSION, None, b'')]
+    for cut in range(1, len(data)):
+        parser = protocol.FirmataParser(protocol.HOST_MESSAGE_LENGTHS)
+        assert parser.feed(data[:cut]) + parser.feed(data[cut:]) == expected
+
+
+def test_board_and_host_lengths_differ():
+    # The board answers a version query with the version, the host asks with the bare command
+    assert protocol.FirmataParser().feed(bytes([protocol.REPORT_VERSION, 2, 5])) == \
+        [(protocol.REPORT_VERSION, None, bytes([2, 5]))]
+    assert protocol.FirmataParser(protocol.HOST_MESSAGE_LENGTHS).feed(bytes([protocol.REPORT_VERSION])) == \
+        [(protocol.REPORT_VERSION, None, b'')]
+
+
+def test_sysex():
+    parser = protocol.FirmataParser()
+    data = protocol.sysex(protocol.REPORT_FIRMWARE, [2, 5, ord('a'), 0])
+    assert parser.feed(data) == [(protocol.START_SYSEX, protocol.REPORT_FIRMWARE, bytes([2, 5, ord('a'), 0]))]
+    # An empty SysEx has no command and gives nothing
+    assert parser.feed(bytes([protocol.START_SYSEX, protocol.END_SYSEX])) == []
+
+
+def test_unknown_and_cut_messages_are_skipped():
+    parser = protocol.FirmataParser()
+    # Stray data bytes, a command the board doesn't send and an analog message cut by a new command
+    data = bytes([0x10, 0x20, protocol.SYSTEM_RESET, 0x01, protocol.ANALOG_MESSAGE | 2, 0x01,
+                  protocol.DIGITAL_MESSAGE | 0, 0x03, 0x00])
+    assert parser.feed(data) == [(protocol.DIGITAL_MESSAGE, 0, bytes([0x03, 0x00]))]
+
+
+def test_capability_response():
+    data = bytes([protocol.INPUT, 1, protocol.OUTPUT, 1, protocol.CAPABILITY_PIN_END,
+                  protocol.CAPABILITY_PIN_END,
+                  protocol.ANALOG, 10, protocol.CAPABILITY_PIN_END])
+    assert protocol.parse_capability_response(data) == {
+        0: {protocol.INPUT: 1, protocol.OUTPUT: 1},
+        1: dict(),
+        2: {protocol.ANALOG: 10}
+    }
+    assert protocol.parse_analog_mapping_response(bytes([protocol.NO_ANALOG_CHANNEL, 0, 1])) == {0: 1, 1: 2}
+    assert protocol.two_byte_value(bytes([0x7F, 0x07])) == 1023
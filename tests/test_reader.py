@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+
+import pytest
+
+from pyrduino import protocol
+from pyrduino.pyrduino import Pyrduino, BOARD_TYPE_SIM
+
+
+@pytest.fixture
+def board():
+    board = Pyrduino('sim', BOARD_TYPE_SIM)
+    yield board
+    board.exit_board()
+
+
+class _Broken:
+    def handle(self, major, minor):
+        raise AttributeError('a bug, not a lost port')
+
+
+def test_empty_reads_stop_the_reader_with_a_warning(board, caplog):
+    caplog.set_level(logging.WARNING, logger='Pyrduino')
+    link = board.board.sp
+    # A closed port reads nothing, which pyfirmata notices in the middle of a message
+    reads = iter([bytes([protocol.REPORT_VERSION])])
+    link.read = lambda size=1: next(reads, b'')
+    link.inWaiting = lambda: 1
+    board._reader.join(1.0)
+    assert not board._reader.is_alive()
+    assert not board._reader.crashed
+    assert 'Stopped reading board sim' in caplog.text
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_handler_bug_is_not_a_lost_connection(board):
+    opened = list()
+    board.supervise(opener=lambda: opened.append(True), heartbeat_interval=None)
+    board.board.add_cmd_handler(protocol.REPORT_VERSION, _Broken().handle)
+    board._send(bytearray([protocol.REPORT_VERSION]))
+    board._reader.join(1.0)
+    assert board._reader.crashed
+    assert isinstance(board._reader.error, AttributeError)
+    time.sleep(0.2)
+    assert opened == []
+    assert board._supervisor.reconnects == 0
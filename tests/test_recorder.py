@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+
+import pytest
+
+from pyrduino.pyrduino import Pyrduino, BOARD_TYPE_SIM, PIN_TYPE_ANALOG
+from pyrduino.recorder import Recorder, Recording, Replay, EVENT_INPUT, EVENT_OUTPUT, HEADER, RECORD
+
+
+@pytest.fixture
+def board():
+    board = Pyrduino('sim', BOARD_TYPE_SIM)
+    board.register_pins([('led', 13), ('pot', 0, PIN_TYPE_ANALOG)])
+    yield board
+    board.exit_board()
+
+
+def _wait_for(check):
+    deadline = time.monotonic() + 2.0
+    while not check() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return check()
+
+
+def test_file_format(board, tmp_path):
+    path = str(tmp_path / 'outputs.pyrd')
+    # Two records per chunk, so the file has to grow
+    with Recorder(board, path, names=['led'], chunk_records=2) as recorder:
+        for value in (1, 0, 1, 0, 1):
+            recorder.record('led', value, EVENT_OUTPUT)
+    with Recording(path) as recording:
+        assert len(recording) == 5
+        assert recording.board_type == BOARD_TYPE_SIM
+        assert [pin['name'] for pin in recording.pins] == ['led']
+        events = list(recording.events())
+        assert [(name, value, kind) for at, name, value, kind in events] == \
+            [('led', value, EVENT_OUTPUT) for value in (1, 0, 1, 0, 1)]
+        times = [at for at, name, value, kind in events]
+        assert times == sorted(times)
+        assert recording.duration == times[-1]
+        # A time range is found with a binary search
+        assert recording.index(times[2]) == 2
+        assert [at for at, name, value, kind in recording.events(times[1], times[3])] == times[1:3]
+        assert list(recording.array()['value']) == [1, 0, 1, 0, 1]
+        data_offset = recording._data_offset
+    # Closing cuts the file to the records written
+    assert data_offset % RECORD.size == 0 and data_offset > HEADER.size
+    assert os.path.getsize(path) == data_offset + 5 * RECORD.size
+
+
+def test_unfinished_recording_is_readable(board, tmp_path):
+    path = str(tmp_path / 'crash.pyrd')
+    recorder = Recorder(board, path, names=['led'])
+    try:
+        recorder.record('led', 1, EVENT_OUTPUT)
+        recorder.record('led', 0, EVENT_OUTPUT)
+        # The file still has room for a whole chunk, the count in the header tells how much of it is records
+        with Recording(path) as recording:
+            assert [value for at, name, value, kind in recording.events()] == [1, 0]
+    finally:
+        recorder.close()
+
+
+def test_inputs_are_recorded_and_replayed(board, tmp_path):
+    path = str(tmp_path / 'inputs.pyrd')
+    simulated = board.board.sp.sp.board
+    with Recorder(board, path, names=['pot']):
+        simulated.set_analog(0, 512)
+        assert _wait_for(lambda: board.read_pin('pot') == pytest.approx(512 / 1023, abs=0.001))
+    with Recording(path) as recording:
+        inputs = [(name, kind) for at, name, value, kind in recording.events()]
+        assert inputs and set(inputs) == {('pot', EVENT_INPUT)}
+        last = list(recording.events())[-1][2]
+        assert last == pytest.approx(512 / 1023, abs=0.001)
+    with Replay(path, speed=10) as replay:
+        replay.start()
+        assert replay.wait(2.0)
+        assert _wait_for(lambda: replay.board.read_pin('pot') == pytest.approx(512 / 1023, abs=0.001))
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from pyrduino.pyrduino import (Pyrduino, BOARD_TYPE_SIM, PIN_TYPE_ANALOG, PIN_TYPE_DIGITAL, PIN_MODE_INPUT,
+                               PIN_MODE_OUTPUT, PinRegistrationError)
+
+
+@pytest.fixture
+def board():
+    board = Pyrduino('sim', BOARD_TYPE_SIM)
+    yield board
+    board.exit_board()
+
+
+def test_same_pin_twice_in_one_spec(board):
+    with pytest.raises(PinRegistrationError) as error:
+        board.register_pins([('a', 13), ('b', 13, PIN_TYPE_DIGITAL, PIN_MODE_INPUT)])
+    assert 'already taken' in str(error.value)
+    # Nothing of the failed spec is registered
+    assert board.registered_pins == {}
+    board.register_pins([('a', 13)])
+    assert board.registered_pins['a'].pin_mode == PIN_MODE_OUTPUT
+
+
+def test_analog_pins_are_inputs(board):
+    with pytest.raises(PinRegistrationError) as error:
+        board.register_pins([('x', 0, PIN_TYPE_ANALOG, PIN_MODE_OUTPUT)])
+    assert 'only be inputs' in str(error.value)
+    board.register_pins([('x', 0, PIN_TYPE_ANALOG)])
+    assert board.registered_pins['x'].pin_mode == PIN_MODE_INPUT
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import time
+
+from pyrduino.sequence import Sequence
+
+
+class _Board:
+    """ Notes when every step is written, the first write can be made slow """
+    def __init__(self, slow=0.0):
+        self.slow = slow
+        self.writes = list()
+        self.flushes = 0
+
+    def write_pins(self, values):
+        self.writes.append((time.perf_counter(), dict(values)))
+        if len(self.writes) == 1 and self.slow:
+            time.sleep(self.slow)
+
+    def flush(self):
+        self.flushes += 1
+
+
+def test_steps():
+    sequence = Sequence()
+    sequence.write_pin('light', 1).write_pin('fan', 1).pass_time(0.5).write_pins({'light': 0, 'fan': 0})
+    sequence.add(0.25, 'beep', 1).add_series('beep', [0.75, 1.0], [0, 1])
+    assert sequence.steps() == [(0.0, {'light': 1, 'fan': 1}), (0.25, {'beep': 1}), (0.5, {'light': 0, 'fan': 0}),
+                                (0.75, {'beep': 0}), (1.0, {'beep': 1})]
+    assert sequence.duration == 1.0
+    assert len(sequence) == 7
+
+
+def test_same_time_same_pin_keeps_the_last_value():
+    sequence = Sequence().add(0.1, 'light', 1).add(0.1, 'light', 0)
+    assert sequence.steps() == [(0.1, {'light': 0})]
+
+
+def test_steps_keep_their_times_after_a_late_one():
+    sequence = Sequence()
+    for i in range(5):
+        sequence.add(i * 0.02, 'light', i % 2)
+    sequence.pass_time(0.12)
+    board = _Board(slow=0.035)
+    start = time.perf_counter()
+    report = sequence.run(board)
+    elapsed = time.perf_counter() - start
+    times = [at - start for at, values in board.writes]
+    # The slow first write makes the second step late, but the ones after it are back on time instead of drifting
+    assert times[1] >= 0.035
+    for i in (2, 3, 4):
+        assert abs(times[i] - i * 0.02) < 0.01
+    assert report.steps == 5
+    assert report.max_lateness >= 0.01
+    assert board.flushes == 5
+    # The time after the last step is waited too
+    assert 0.12 <= elapsed < 0.2
+    assert report.duration == 0.12
+
+
+def test_without_waiting_for_the_end():
+    sequence = Sequence().write_pin('light', 1).pass_time(0.5)
+    start = time.perf_counter()
+    sequence.run(_Board(), wait_end=False)
+    assert time.perf_counter() - start < 0.25
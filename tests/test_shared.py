@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import struct
+import threading
+import time
+
+import pytest
+
+from pyrduino.pyrduino import Pyrduino, BOARD_TYPE_SIM, PIN_TYPE_DIGITAL, PIN_MODE_PWM
+from pyrduino.shared import SharedStatePublisher, SharedStateClient
+
+
+@pytest.fixture
+def board():
+    board = Pyrduino('sim', BOARD_TYPE_SIM)
+    board.register_pins([('led', 13), ('dim', 9, PIN_TYPE_DIGITAL, PIN_MODE_PWM)])
+    yield board
+    board.exit_board()
+
+
+def _wait_for(check):
+    deadline = time.monotonic() + 2.0
+    while not check() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return check()
+
+
+def test_writes_are_published_once(board):
+    with SharedStatePublisher(board) as publisher:
+        client = SharedStateClient(publisher.name)
+        try:
+            assert client.names == ['led', 'dim']
+            assert client.snapshot() == {'led': None, 'dim': None}
+            published = client.publish_count
+            board.write_pins({'led': 1, 'dim': 0.5})
+            assert client.snapshot() == {'led': 1, 'dim': 0.5}
+            assert client.publish_count == published + 1
+            # Nothing changes while the board is idle
+            time.sleep(0.05)
+            assert client.publish_count == published + 1
+            assert client.read_slot('led')[2] == 2
+        finally:
+            client.close()
+
+
+def test_reads_never_see_half_a_slot(board):
+    with SharedStatePublisher(board) as publisher:
+        client = SharedStateClient(publisher.name)
+        done = threading.Event()
+
+        def write():
+            for k in range(1, 2001):
+                board.write_pin('dim', k / 2000.0)
+            done.set()
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            reads = 0
+            while not done.is_set():
+                value, updated, updates = client.read_slot('dim')
+                if value is not None:
+                    # The first update published None, every write after it one more value
+                    assert round(value * 2000) == updates - 1
+                    reads += 1
+            assert reads > 0
+        finally:
+            writer.join()
+            client.close()
+
+
+def test_slot_being_written_is_not_read(board):
+    with SharedStatePublisher(board) as publisher:
+        client = SharedStateClient(publisher.name)
+        try:
+            offset = publisher._layout.slot(0)
+            buf = publisher._shm.buf
+            sequence = struct.unpack_from('<Q', buf, offset)[0]
+            # An odd sequence means the owner is in the middle of writing the slot
+            struct.pack_into('<Q', buf, offset, sequence + 1)
+            with pytest.raises(IOError):
+                client.read('led')
+            struct.pack_into('<Q', buf, offset, sequence + 2)
+            assert client.read('led') is None
+        finally:
+            client.close()
+
+
+def test_command_ring(board):
+    # A long interval, so the rings are only served when the test says so
+    with SharedStatePublisher(board, ring_capacity=2, interval=60) as publisher:
+        client = SharedStateClient(publisher.name, writer=1)
+        try:
+            assert client.write('dim', 0.25)
+            assert client.write('dim', 0.75)
+            # Full until the publisher has served it
+            assert not client.write('led', 1)
+            publisher.serve_writes()
+            assert board.read_pin('dim') == 0.75
+            assert client.write('led', 1)
+            publisher.serve_writes()
+            assert board.read_pin('led') == 1
+            assert client.snapshot() == {'led': 1, 'dim': 0.75}
+        finally:
+            client.close()
+
+
+def test_rings_are_served_on_their_own(board):
+    with SharedStatePublisher(board, interval=0.001) as publisher:
+        client = SharedStateClient(publisher.name, writer=0)
+        try:
+            client.write('led', 1)
+            assert _wait_for(lambda: board.read_pin('led') == 1)
+            assert board.board.sp.sp.board.outputs[13] == 1
+        finally:
+            client.close()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from pyrduino import protocol
+from pyrduino.pyrduino import (Pyrduino, BOARD_TYPE_SIM, PIN_TYPE_ANALOG, PIN_TYPE_DIGITAL, PIN_MODE_INPUT,
+                               PIN_MODE_PWM)
+from pyrduino.sim import LoopbackTransport
+
+
+@pytest.fixture
+def board():
+    board = Pyrduino('sim', BOARD_TYPE_SIM)
+    board.register_pins([('led', 13), ('dim', 9, PIN_TYPE_DIGITAL, PIN_MODE_PWM),
+                         ('button', 2, PIN_TYPE_DIGITAL, PIN_MODE_INPUT), ('pot', 0, PIN_TYPE_ANALOG)])
+    yield board
+    board.exit_board()
+
+
+def _reset_and_open(simulated, opened):
+    def opener():
+        # Opening the port resets a real board, so everything it was told is gone
+        simulated.receive(bytes([protocol.SYSTEM_RESET]))
+        opened.append(True)
+        return LoopbackTransport(simulated)
+    return opener
+
+
+def test_reconnect_restores_the_pins(board):
+    simulated = board.board.sp.sp.board
+    board.write_pins({'led': 1, 'dim': 0.5})
+    expected = (dict(simulated.pin_modes), dict(simulated.outputs), set(simulated.reporting_analog),
+                set(simulated.reporting_ports))
+    opened = list()
+    supervisor = board.supervise(opener=_reset_and_open(simulated, opened), heartbeat_interval=None, backoff=0.01)
+
+    board.board.sp.lost(OSError('unplugged'))
+    # Writes wait for the connection instead of failing
+    board.write_pin('led', 0)
+    assert opened == [True]
+    deadline = time.monotonic() + 2.0
+    while supervisor.reconnects == 0 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert supervisor.reconnects == 1
+    assert board.connected
+    pin_modes, outputs, reporting_analog, reporting_ports = expected
+    assert simulated.pin_modes == pin_modes
+    assert simulated.reporting_analog == reporting_analog
+    assert simulated.reporting_ports == reporting_ports
+    outputs[13] = 0
+    assert simulated.outputs == outputs
+
+
+def test_failed_opens_are_tried_again(board):
+    simulated = board.board.sp.sp.board
+    opener = _reset_and_open(simulated, list())
+    attempts = list()
+
+    def flaky():
+        attempts.append(True)
+        if len(attempts) < 3:
+            raise OSError('not there yet')
+        return opener()
+    supervisor = board.supervise(opener=flaky, heartbeat_interval=None, backoff=0.01)
+    board.board.sp.lost(OSError('unplugged'))
+    board.write_pin('led', 1)
+    assert len(attempts) == 3
+    assert simulated.outputs[13] == 1
+    assert 'unplugged' in str(supervisor.last_error)
+
+
+def test_silent_board_is_noticed_by_the_heartbeat(board):
+    simulated = board.board.sp.sp.board
+    opened = list()
+    supervisor = board.supervise(opener=_reset_and_open(simulated, opened), heartbeat_interval=0.02,
+                                 heartbeat_timeout=0.1, backoff=0.01)
+    # The board stops answering but the port stays open
+    simulated.attach(lambda data: None)
+    deadline = time.monotonic() + 2.0
+    while supervisor.reconnects == 0 and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert supervisor.reconnects == 1
+    assert opened == [True]
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import pytest
+import serial
+
+from pyrduino.pyrduino import Pyrduino, BOARD_TYPE_SIM, PIN_TYPE_DIGITAL, PIN_MODE_INPUT, PIN_MODE_PWM
+
+
+@pytest.fixture
+def board():
+    board = Pyrduino('sim', BOARD_TYPE_SIM, write_cache=True)
+    board.register_pins([('led', 13), ('dim', 9, PIN_TYPE_DIGITAL, PIN_MODE_PWM),
+                         ('button', 2, PIN_TYPE_DIGITAL, PIN_MODE_INPUT)])
+    yield board
+    board.exit_board()
+
+
+@pytest.mark.parametrize('bad', [{'nope': 1}, {'button': 1}])
+def test_nothing_changes_when_a_pin_is_bad(board, bad):
+    values = dict({'led': 1, 'dim': 0.5}, **bad)
+    with pytest.raises(Exception):
+        board.write_pins(values)
+    assert board.pin('led').last_value is None
+    assert board.pin('dim').pin.value is None
+    # The same values still go to the board afterwards
+    board.write_pins({'led': 1, 'dim': 0.5})
+    simulated = board.board.sp.sp.board
+    assert simulated.outputs[13] == 1
+    assert simulated.outputs[9] == 128
+
+
+def test_digital_values_like_write_pin(board):
+    board.write_pins({'led': 2})
+    assert board.board.sp.sp.board.outputs[13] == 0
+
+
+def _fail_next_write(board):
+    link = board.board.sp
+    write = link.write
+
+    def fail(data):
+        link.write = write
+        raise serial.SerialException('unplugged')
+    link.write = fail
+
+
+@pytest.mark.parametrize('write', [lambda board: board.write_pin('led', 1),
+                                   lambda board: board.write_pins({'led': 1})])
+def test_failed_write_is_tried_again(board, write):
+    _fail_next_write(board)
+    with pytest.raises(serial.SerialException):
+        write(board)
+    assert board.pin('led').last_value is None
+    write(board)
+    assert board.board.sp.sp.board.outputs[13] == 1
+    assert board.get_write_cache_stats()['hits'] == 0
+
+
+@pytest.mark.parametrize('thread_safe', [False, True])
+def test_bad_writes_raise_in_the_caller(thread_safe):
+    board = Pyrduino('sim', BOARD_TYPE_SIM, thread_safe=thread_safe)
+    try:
+        board.register_pins([('led', 13), ('button', 2, PIN_TYPE_DIGITAL, PIN_MODE_INPUT)])
+        with pytest.raises(IOError):
+            board.write_pin('button', 1)
+        with pytest.raises(IOError):
+            board.pin('button').write(1)
+        with pytest.raises(TypeError):
+            board.write_pin('led', 'on')
+    finally:
+        board.exit_board()
+
+
+def test_stats_count_only_sent_writes():
+    board = Pyrduino('sim', BOARD_TYPE_SIM, write_cache=True, stats=True)
+    try:
+        board.register_pins([('led', 13), ('dim', 9, PIN_TYPE_DIGITAL, PIN_MODE_PWM)])
+        board.write_pins({'led': 1, 'dim': 0.5})
+        board.write_pins({'led': 1, 'dim': 0.25})
+        board.write_pin('led', 1)
+        assert board.stats().snapshot()['writes'] == {'led': 1, 'dim': 2}
+    finally:
+        board.exit_board()